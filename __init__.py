@@ -1,5 +1,4 @@
 import os
-import folder_paths
 from .model_downloader_node import ModelDownloader
 
 WEB_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), "js")
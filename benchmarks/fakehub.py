@@ -0,0 +1,220 @@
+"""
+A local stand-in for huggingface.co, for benchmarks and load tests.
+
+Serves generated files under /{repo_id}/resolve/{revision}/{path} with the
+headers huggingface_hub and this node rely on (ETag with the LFS sha256,
+X-Repo-Commit, ranges), and repository listings under /api/models/{repo_id}
+and /api/models/{repo_id}/revision/{revision} in the shape HfApi.model_info
+parses, so repository downloads work against it too. Latency, a per-connection
+bandwidth cap, random 5xx errors and gated files are configurable:
+
+    python benchmarks/fakehub.py --files 4 --file-size-mb 64 --latency-ms 20 --bandwidth-mb 50
+    HF_ENDPOINT=http://127.0.0.1:8790 ...
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from urllib.parse import unquote
+
+from aiohttp import web
+
+MiB = 1024 * 1024
+COMMIT = "0123456789abcdef0123456789abcdef01234567"
+# File contents repeat a block derived from the file's path, so files differ without being stored
+BLOCK_SIZE = 64 * 1024
+# Gated files: accepted ones are served to any token, denied ones to none
+GATED_ACCEPTED = "accepted"
+GATED_DENIED = "denied"
+
+
+def make_files(count, size, gated=0, repo_id="bench/models"):
+    """
+    Files of a benchmark repository: count downloadable files of size bytes,
+    then gated small files, alternately accepted and denied.
+    """
+    files = [{"repo_id": repo_id, "path": f"file-{i:04d}.safetensors", "size": size, "gated": None} for i in range(count)]
+    files += [
+        {
+            "repo_id": f"{repo_id}-gated",
+            "path": f"gated-{i:04d}.safetensors",
+            "size": 1024,
+            "gated": GATED_ACCEPTED if i % 2 == 0 else GATED_DENIED,
+        }
+        for i in range(gated)
+    ]
+    return files
+
+
+class HubFile:
+    def __init__(self, spec):
+        self.repo_id = spec["repo_id"]
+        self.path = spec["path"]
+        self.size = spec["size"]
+        self.gated = spec.get("gated")
+        self.block = b"".join(
+            hashlib.sha256(f"{self.repo_id}/{self.path}/{i}".encode()).digest() for i in range(BLOCK_SIZE // 32)
+        )
+        self.sha256 = self._hash()
+        # Size of the LFS pointer file git stores in place of the content
+        self.pointer_size = len(f"version https://git-lfs.github.com/spec/v1\noid sha256:{self.sha256}\nsize {self.size}\n")
+
+    def read(self, start, end):
+        """Bytes start..end (exclusive)"""
+        offset = start % BLOCK_SIZE
+        return (self.block * ((end - start + offset) // BLOCK_SIZE + 1))[offset:offset + end - start]
+
+    def _hash(self):
+        digest = hashlib.sha256()
+        step = 16 * BLOCK_SIZE
+        for start in range(0, self.size, step):
+            digest.update(self.read(start, min(start + step, self.size)))
+        return digest.hexdigest()
+
+
+class FakeHub:
+    """
+    aiohttp application serving files. latency is added to every response,
+    bandwidth caps each response in bytes/s, and error_rate is the share of
+    file requests answered with a random 5xx.
+    """
+
+    def __init__(self, files, latency=0.0, bandwidth=None, error_rate=0.0, seed=0):
+        self.files = {(spec["repo_id"], spec["path"]): HubFile(spec) for spec in files}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "errors_injected": 0, "bytes_sent": 0, "statuses": {}}
+        self.app = web.Application()
+        self.app.router.add_get("/api/stats", self.stats_handler)
+        self.app.router.add_get("/api/models/{repo_id:[^/]+/[^/]+}", self.listing_handler)
+        self.app.router.add_get("/api/models/{repo_id:[^/]+/[^/]+}/revision/{revision:.+}", self.listing_handler)
+        self.app.router.add_route("*", "/{repo_id:[^/]+/[^/]+}/resolve/{revision}/{path:.+}", self.resolve_handler)
+
+    def _count(self, status):
+        self.stats["statuses"][str(status)] = self.stats["statuses"].get(str(status), 0) + 1
+
+    async def stats_handler(self, request):
+        return web.json_response(self.stats)
+
+    async def listing_handler(self, request):
+        """Every revision, and no revision (the default branch), lists the same files at COMMIT"""
+        repo_id = request.match_info["repo_id"]
+        siblings = [
+            {
+                "rfilename": f.path,
+                "size": f.size,
+                "blobId": f.sha256[:40],
+                "lfs": {"sha256": f.sha256, "size": f.size, "pointerSize": f.pointer_size},
+            }
+            for (repo, _), f in self.files.items()
+            if repo == repo_id
+        ]
+        if not siblings:
+            return web.json_response({"error": "Repository not found"}, status=404, headers={"X-Error-Code": "RepoNotFound"})
+        etag = f'"{COMMIT}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.json_response({"id": repo_id, "sha": COMMIT, "siblings": siblings}, headers={"ETag": etag})
+
+    async def resolve_handler(self, request):
+        self.stats["requests"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        hub_file = self.files.get((request.match_info["repo_id"], unquote(request.match_info["path"])))
+        if hub_file is None:
+            self._count(404)
+            return web.Response(status=404, headers={"X-Error-Code": "EntryNotFound"})
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["errors_injected"] += 1
+            status = self.random.choice((500, 502, 503))
+            self._count(status)
+            return web.Response(status=status, text="injected error")
+        if hub_file.gated:
+            token = request.headers.get("Authorization", "")
+            if not token or hub_file.gated == GATED_DENIED:
+                status = 403 if token else 401
+                self._count(status)
+                return web.Response(
+                    status=status,
+                    headers={"X-Error-Code": "GatedRepo", "X-Error-Message": "Access to this model is restricted"},
+                )
+
+        headers = {
+            "ETag": f'"{hub_file.sha256}"',
+            "X-Repo-Commit": COMMIT,
+            "Accept-Ranges": "bytes",
+            "Content-Type": "application/octet-stream",
+        }
+        start, end = 0, hub_file.size
+        status = 200
+        range_header = request.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].split(",")[0].partition("-")
+            start = int(first) if first else max(0, hub_file.size - int(last))
+            end = min(int(last) + 1, hub_file.size) if first and last else hub_file.size
+            if start >= hub_file.size:
+                self._count(416)
+                return web.Response(status=416, headers={"Content-Range": f"bytes */{hub_file.size}"})
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{hub_file.size}"
+        headers["Content-Length"] = str(end - start)
+        self._count(status)
+        if request.method == "HEAD":
+            return web.Response(status=status, headers=headers)
+
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        started = time.monotonic()
+        sent = 0
+        step = 16 * BLOCK_SIZE
+        for offset in range(start, end, step):
+            chunk = hub_file.read(offset, min(offset + step, end))
+            await response.write(chunk)
+            sent += len(chunk)
+            self.stats["bytes_sent"] += len(chunk)
+            if self.bandwidth:
+                ahead = sent / self.bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        await response.write_eof()
+        return response
+
+
+def add_hub_arguments(parser):
+    """Options shared with the load test, which starts this server with them"""
+    parser.add_argument("--files", type=int, default=8, help="downloadable files (default: 8)")
+    parser.add_argument("--file-size-mb", type=float, default=32, help="size of each file in MiB (default: 32)")
+    parser.add_argument("--gated", type=int, default=40, help="small gated files, half of them accepted (default: 40)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="added to every file response (default: 20)")
+    parser.add_argument("--bandwidth-mb", type=float, default=None, help="per-response cap in MiB/s (default: none)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of file requests failing with 5xx (default: 0)")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def hub_from_args(args):
+    files = make_files(args.files, int(args.file_size_mb * MiB), args.gated)
+    return FakeHub(
+        files,
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_mb * MiB if args.bandwidth_mb else None,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    add_hub_arguments(parser)
+    args = parser.parse_args(argv)
+    hub = hub_from_args(args)
+    print(f"Fake Hub serving {len(hub.files)} files on http://{args.host}:{args.port}", flush=True)
+    web.run_app(hub.app, host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+How much this node adds to ComfyUI's startup: the time to import it in a
+fresh interpreter, with the modules ComfyUI loads anyway (its server,
+aiohttp) already imported.
+
+    python benchmarks/import_time.py --comfyui /path/to/ComfyUI
+    python benchmarks/import_time.py --update-baseline
+
+Exits with 1 if the median import time is more than --tolerance above the
+one in baseline.json, or if importing the node loads a module that should
+only be imported on first use, such as huggingface_hub.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Only needed once something is downloaded
+LAZY_MODULES = ("huggingface_hub", "requests", "httpx")
+# Timing noise on a fast import can be larger than any relative tolerance
+MIN_SLACK_MS = 10
+
+# Loads the node the way ComfyUI loads custom nodes and prints the result as JSON
+CHILD = r"""
+import asyncio, importlib.util, json, os, sys, time
+
+comfyui, root = sys.argv[1], sys.argv[2]
+sys.path.insert(0, comfyui)
+import aiohttp.web, execution, folder_paths, server
+
+if server.PromptServer.instance is None:
+    server.PromptServer(asyncio.new_event_loop())
+before = set(sys.modules)
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location(
+    "hf_model_downloader", os.path.join(root, "__init__.py"), submodule_search_locations=[root]
+)
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+seconds = time.perf_counter() - started
+print(json.dumps({"seconds": seconds, "modules": sorted(set(sys.modules) - before)}))
+"""
+
+
+def measure_once(comfyui, cwd):
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD, comfyui, ROOT], cwd=cwd, capture_output=True, text=True, check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing the node failed:\n{result.stderr}")
+    # ComfyUI modules may print on import; the measurement is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(comfyui, runs):
+    """Median import time in ms over runs, and the lazy modules that were imported eagerly"""
+    # Runs from ComfyUI's directory, where the node keeps its user/ state
+    measure_once(comfyui, comfyui)  # compiles bytecode, not counted
+    samples = [measure_once(comfyui, comfyui) for _ in range(runs)]
+    times = sorted(sample["seconds"] * 1000 for sample in samples)
+    eager = sorted(
+        {name.split(".")[0] for sample in samples for name in sample["modules"] if name.split(".")[0] in LAZY_MODULES}
+    )
+    return {
+        "median_ms": round(statistics.median(times), 2),
+        "min_ms": round(times[0], 2),
+        "max_ms": round(times[-1], 2),
+        "runs": runs,
+    }, eager
+
+
+def load_baseline():
+    try:
+        with open(BASELINE_PATH, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--comfyui",
+        default=os.path.dirname(os.path.dirname(ROOT)),
+        help="ComfyUI directory (default: two levels above this node, i.e. from custom_nodes/)",
+    )
+    parser.add_argument("--runs", type=int, default=15, help="fresh interpreters to measure (default: 15)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the baseline (default: 0.25)")
+    parser.add_argument("--update-baseline", action="store_true", help="store this measurement as the new baseline")
+    args = parser.parse_args(argv)
+
+    result, eager = measure(os.path.abspath(args.comfyui), args.runs)
+    print(f"import: median {result['median_ms']} ms, min {result['min_ms']} ms, max {result['max_ms']} ms over {args.runs} runs")
+
+    baseline = load_baseline()
+    if args.update_baseline:
+        baseline["import_time"] = result
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+
+    failed = False
+    if eager:
+        print(f"FAIL: importing the node loaded {', '.join(eager)}, which should be imported on first use")
+        failed = True
+    reference = baseline.get("import_time", {}).get("median_ms")
+    if reference is not None and not args.update_baseline:
+        allowed = max(reference * (1 + args.tolerance), reference + MIN_SLACK_MS)
+        if result["median_ms"] > allowed:
+            print(f"FAIL: median {result['median_ms']} ms is above {allowed:.1f} ms (baseline {reference} ms)")
+            failed = True
+        else:
+            print(f"OK: baseline {reference} ms, allowed up to {allowed:.1f} ms")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,552 @@
+"""
+Load test for the downloader against a local fake Hub (fakehub.py).
+
+Every scenario runs in a fresh interpreter with its own state and models
+directory, loads the node the way ComfyUI does, and reports throughput,
+p50/p99 latency and peak RSS:
+
+- download_model, download_model_chunked: ModelDownloader.download_model with each engine
+- download_snapshot: a repository entry for the whole benchmark repository, downloaded and then checked again
+- download_route: POST /hal-fun-downloader/download with "wait": true, one request per file
+- node_execute: DownloadModelNode.execute from worker threads, as ComfyUI's prompt worker runs it
+- active_route: GET and POST /hal-fun-downloader/active from concurrent clients
+- check_license_cold, check_license_cached: POST /hal-fun-downloader/check-license for gated files
+
+    python benchmarks/loadtest.py --comfyui /path/to/ComfyUI
+    python benchmarks/loadtest.py --scenarios download_model --bandwidth-mb 100 --error-rate 0.05
+
+Results are compared with the "loadtest" section of baseline.json if it was
+recorded with the same options. Exits with 1 on a regression beyond
+--tolerance; --update-baseline stores the results instead.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import math
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from fakehub import MiB, add_hub_arguments, make_files
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SCENARIOS = (
+    "download_model",
+    "download_model_chunked",
+    "download_snapshot",
+    "download_route",
+    "node_execute",
+    "active_route",
+    "check_license_cold",
+    "check_license_cached",
+)
+# Latency noise in ms and RSS noise in MiB that never count as a regression
+MIN_SLACK_MS = 15
+MIN_SLACK_RSS_MIB = 32
+MIN_SAMPLES_FOR_P99 = 100
+TOKEN = "hf_benchmark"
+
+
+# Scenario side: runs inside the child interpreter
+
+
+def load_node(comfyui, loop):
+    """Import the node package like ComfyUI does, with a PromptServer on loop"""
+    sys.path.insert(0, comfyui)
+    import server
+
+    if server.PromptServer.instance is None:
+        server.PromptServer(loop)
+    spec = importlib.util.spec_from_file_location(
+        "hf_model_downloader", os.path.join(ROOT, "__init__.py"), submodule_search_locations=[ROOT]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return sys.modules["hf_model_downloader.model_downloader_node"]
+
+
+def catalog_entries(files):
+    entries = []
+    for spec in files:
+        entry = {"repo_id": spec["repo_id"], "filename": spec["path"]}
+        if spec["gated"]:
+            entry["local_path"] = f"loras/{spec['path']}"
+            entry["license"] = {"required": True}
+        else:
+            entry["local_path"] = f"checkpoints/{spec['path']}"
+        entries.append(entry)
+    return entries
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+
+def summarize(latencies, wall, nbytes=0, failures=0):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "failures": failures,
+        "wall_s": round(wall, 3),
+        "throughput_mib_s": round(nbytes / MiB / wall, 2) if nbytes else None,
+        "requests_per_s": round(len(latencies) / wall, 1) if wall else None,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+
+def reset_peak_rss():
+    """Start peak RSS over from the current RSS, where the OS allows it (Linux)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mib():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (MiB if sys.platform == "darwin" else 1024), 1)
+
+
+async def run_timed(calls, concurrency):
+    """Await each zero-argument coroutine function, concurrency at a time; returns [(seconds, result)]"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(call):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await call()
+            return time.perf_counter() - started, result
+
+    return await asyncio.gather(*(run(call) for call in calls))
+
+
+async def start_routes(node):
+    """Serve the node's handlers on a free local port; returns (runner, base URL)"""
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/hal-fun-downloader/active", node.get_active_config)
+    app.router.add_post("/hal-fun-downloader/active", node.update_active_config)
+    app.router.add_post("/hal-fun-downloader/download", node.download_model_handler)
+    app.router.add_post("/hal-fun-downloader/check-license", node.check_license_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    await web.SockSite(runner, sock).start()
+    return runner, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+async def download_scenario(node, entries, args, engine="hub"):
+    downloader = node.get_model_downloader()
+    files = [entry for entry in entries if "license" not in entry]
+
+    def call(entry):
+        return lambda: downloader.download_model({**entry, "engine": engine})
+
+    started = time.perf_counter()
+    results = await run_timed([call(entry) for entry in files], args.concurrency)
+    return finish_downloads(node, files, results, time.perf_counter() - started)
+
+
+def finish_downloads(node, files, results, wall):
+    catalog = node.get_model_catalog()
+    done = [entry for entry in files if os.path.isfile(catalog.resolve_path(entry))]
+    nbytes = sum(os.path.getsize(catalog.resolve_path(entry)) for entry in done)
+    return summarize([seconds for seconds, _ in results], wall, nbytes, len(files) - len(done))
+
+
+async def download_snapshot_scenario(node, entries, args):
+    downloader = node.get_model_downloader()
+    files = [entry for entry in entries if "license" not in entry]
+    repo_entry = {"repo_id": files[0]["repo_id"], "local_path": "diffusers/bench-models/"}
+    repo_dir = node.get_model_catalog().resolve_path(repo_entry)
+
+    # The second call only compares the listing with the snapshot manifest
+    started = time.perf_counter()
+    results = await run_timed([lambda: downloader.download_model(repo_entry)] * 2, 1)
+    wall = time.perf_counter() - started
+    done = [entry for entry in files if os.path.isfile(os.path.join(repo_dir, entry["filename"]))]
+    nbytes = sum(os.path.getsize(os.path.join(repo_dir, entry["filename"])) for entry in done)
+    return summarize([seconds for seconds, _ in results], wall, nbytes, len(files) - len(done))
+
+
+async def download_route_scenario(node, entries, args):
+    import aiohttp
+
+    files = [entry for entry in entries if "license" not in entry]
+    runner, base = await start_routes(node)
+    try:
+        async with aiohttp.ClientSession() as session:
+            def call(entry):
+                async def post():
+                    body = {"model_names": [entry["local_path"]], "wait": True}
+                    async with session.post(f"{base}/hal-fun-downloader/download", json=body) as resp:
+                        return resp.status
+                return post
+
+            started = time.perf_counter()
+            results = await run_timed([call(entry) for entry in files], len(files))
+            wall = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+    return finish_downloads(node, files, results, wall)
+
+
+async def node_execute_scenario(node, entries, args):
+    files = [entry for entry in entries if "license" not in entry]
+    download_node = node.DownloadModelNode()
+
+    def call(entry):
+        # A thread per call, like ComfyUI's prompt worker; the download itself runs on the loop
+        return lambda: asyncio.to_thread(download_node.execute, entry)
+
+    started = time.perf_counter()
+    results = await run_timed([call(entry) for entry in files], args.concurrency)
+    return finish_downloads(node, files, results, time.perf_counter() - started)
+
+
+async def active_route_scenario(node, entries, args):
+    import aiohttp
+
+    runner, base = await start_routes(node)
+    url = f"{base}/hal-fun-downloader/active"
+    names = [entry["filename"] for entry in entries]
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.clients)) as session:
+            def call(i):
+                async def request():
+                    # Every tenth request changes the selection, as ticking a checkbox does
+                    if i % 10 == 9:
+                        body = {"enabled_models": names[: i % len(names)]}
+                        async with session.post(url, json=body) as resp:
+                            await resp.read()
+                            return resp.status
+                    async with session.get(url) as resp:
+                        await resp.read()
+                        return resp.status
+                return request
+
+            started = time.perf_counter()
+            results = await run_timed([call(i) for i in range(args.requests)], args.clients)
+            wall = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+    failures = sum(1 for _, status in results if status != 200)
+    return summarize([seconds for seconds, _ in results], wall, failures=failures)
+
+
+async def check_license_scenario(node, entries, args, cached=False):
+    import aiohttp
+
+    gated = [entry for entry in entries if "license" in entry]
+    expected = {spec["path"]: spec["gated"] == "accepted" for spec in make_files(0, 0, args.gated)}
+    await asyncio.to_thread(node.get_model_downloader().save_token, TOKEN)
+    runner, base = await start_routes(node)
+    url = f"{base}/hal-fun-downloader/check-license"
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.clients)) as session:
+            def call(entry):
+                async def request():
+                    async with session.post(url, json={"repo_id": entry["repo_id"], "filename": entry["filename"]}) as resp:
+                        body = await resp.json()
+                        return body.get("accepted") == expected[entry["filename"]]
+                return request
+
+            if cached:
+                await run_timed([call(entry) for entry in gated], args.clients)
+                calls = [call(gated[i % len(gated)]) for i in range(args.requests)]
+            else:
+                calls = [call(entry) for entry in gated]
+            started = time.perf_counter()
+            results = await run_timed(calls, args.clients)
+            wall = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+    failures = sum(1 for _, correct in results if not correct)
+    return summarize([seconds for seconds, _ in results], wall, failures=failures)
+
+
+SCENARIO_FUNCTIONS = {
+    "download_model": download_scenario,
+    "download_model_chunked": lambda node, entries, args: download_scenario(node, entries, args, engine="chunked"),
+    "download_snapshot": download_snapshot_scenario,
+    "download_route": download_route_scenario,
+    "node_execute": node_execute_scenario,
+    "active_route": active_route_scenario,
+    "check_license_cold": check_license_scenario,
+    "check_license_cached": lambda node, entries, args: check_license_scenario(node, entries, args, cached=True),
+}
+
+
+def run_child(args):
+    workdir = args.workdir
+    os.environ.update(
+        HF_ENDPOINT=args.hub,
+        HF_HOME=os.path.join(workdir, "hf_home"),
+        HF_HUB_DISABLE_TELEMETRY="1",
+        HF_HUB_DISABLE_PROGRESS_BARS="1",
+        HF_HUB_DISABLE_XET="1",
+    )
+    # The node keeps its state under user/ in the working directory
+    os.chdir(workdir)
+    settings_dir = os.path.join(workdir, "user", "default", "hal.fun-downloader")
+    os.makedirs(settings_dir)
+    with open(os.path.join(settings_dir, "settings.json"), "w") as f:
+        json.dump({
+            "max_concurrent_downloads": args.concurrency,
+            "max_downloads_per_host": args.concurrency,
+            "min_free_space_gb": 0,
+            "retry_base_delay": 0.05,
+            "retry_max_delay": 1.0,
+            "circuit_breaker_reset": 1.0,
+            "resume_jobs_on_startup": False,
+            "prefetch_on_prompt": False,
+        }, f)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    node = load_node(args.comfyui, loop)
+    files = make_files(args.files, int(args.file_size_mb * MiB), args.gated)
+    entries = catalog_entries(files)
+    config_path = os.path.join(workdir, "model_config.json")
+    with open(config_path, "w") as f:
+        json.dump(entries, f)
+    models_dir = os.path.join(workdir, "models")
+    node.DEFAULT_MODELS_DIR = models_dir
+    node.model_catalog = node.ModelCatalog(config_path, models_dir)
+
+    reset_peak_rss()
+    result = loop.run_until_complete(SCENARIO_FUNCTIONS[args.child](node, entries, args))
+    result["peak_rss_mib"] = peak_rss_mib()
+    print(json.dumps(result), flush=True)
+    return 0
+
+
+# Driver side: starts the fake Hub and a child per scenario
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def hub_stats(url):
+    with urllib.request.urlopen(f"{url}/api/stats", timeout=5) as resp:
+        return json.load(resp)
+
+
+def start_hub(args):
+    port = free_port()
+    argv = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakehub.py"),
+        "--port", str(port),
+        "--files", str(args.files),
+        "--file-size-mb", str(args.file_size_mb),
+        "--gated", str(args.gated),
+        "--latency-ms", str(args.latency_ms),
+        "--error-rate", str(args.error_rate),
+        "--seed", str(args.seed),
+    ]
+    if args.bandwidth_mb:
+        argv += ["--bandwidth-mb", str(args.bandwidth_mb)]
+    process = subprocess.Popen(argv, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    # Hashing large files takes a moment before the server listens
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The fake Hub exited during startup")
+        try:
+            hub_stats(url)
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("The fake Hub did not start")
+
+
+def run_scenario(name, hub_url, argv, args):
+    workdir = tempfile.mkdtemp(prefix=f"hfdl-{name}-")
+    before = hub_stats(hub_url)
+    try:
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *argv, "--child", name, "--hub", hub_url, "--workdir", workdir],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Scenario {name} failed:\n{result.stderr[-4000:]}")
+    metrics = json.loads(result.stdout.strip().splitlines()[-1])
+    metrics["hub_errors_injected"] = hub_stats(hub_url)["errors_injected"] - before["errors_injected"]
+    return metrics
+
+
+def median_metrics(runs):
+    """Per-metric median over repeated runs of a scenario; failures are the worst run's"""
+    merged = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs if run.get(key) is not None]
+        if key == "failures":
+            merged[key] = max(values)
+        elif values:
+            merged[key] = statistics.median(values)
+        else:
+            merged[key] = None
+    return merged
+
+
+def params(args):
+    """Options that change results; a baseline is only comparable with the same ones"""
+    keys = (
+        "files", "file_size_mb", "gated", "latency_ms", "bandwidth_mb", "error_rate", "seed",
+        "concurrency", "clients", "requests", "repeat",
+    )
+    return {key: getattr(args, key) for key in keys}
+
+
+def regressions(name, current, reference, tolerance):
+    problems = []
+    for key in ("throughput_mib_s", "requests_per_s"):
+        if current.get(key) is not None and reference.get(key) and current[key] < reference[key] * (1 - tolerance):
+            problems.append(f"{key} {current[key]} < {reference[key]}")
+    # With a handful of samples p99 is just the slowest one, too noisy to compare
+    latency = "p99_ms" if current["count"] >= MIN_SAMPLES_FOR_P99 else "p50_ms"
+    if current.get(latency) is not None and reference.get(latency) is not None:
+        allowed = max(reference[latency] * (1 + tolerance), reference[latency] + MIN_SLACK_MS)
+        if current[latency] > allowed:
+            problems.append(f"{latency} {current[latency]} > {allowed:.1f}")
+    if current.get("peak_rss_mib") and reference.get("peak_rss_mib"):
+        allowed = reference["peak_rss_mib"] * (1 + tolerance) + MIN_SLACK_RSS_MIB
+        if current["peak_rss_mib"] > allowed:
+            problems.append(f"peak_rss_mib {current['peak_rss_mib']} > {allowed:.1f}")
+    if current["failures"] > reference.get("failures", 0):
+        problems.append(f"failures {current['failures']} > {reference.get('failures', 0)}")
+    return [f"{name}: {problem}" for problem in problems]
+
+
+def print_table(results):
+    columns = ("count", "failures", "throughput_mib_s", "requests_per_s", "p50_ms", "p99_ms", "peak_rss_mib")
+    print(f"{'scenario':<24}" + "".join(f"{column:>18}" for column in columns))
+    for name, metrics in results.items():
+        cells = ["-" if metrics.get(column) is None else str(metrics[column]) for column in columns]
+        print(f"{name:<24}" + "".join(f"{cell:>18}" for cell in cells))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--comfyui",
+        default=os.path.dirname(os.path.dirname(ROOT)),
+        help="ComfyUI directory (default: two levels above this node, i.e. from custom_nodes/)",
+    )
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated (default: all)")
+    parser.add_argument("--concurrency", type=int, default=4, help="downloads at once (default: 4)")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent HTTP clients for route scenarios (default: 16)")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per route scenario (default: 2000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario; metrics are their median (default: 3)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed change against the baseline (default: 0.25)")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    add_hub_arguments(parser)
+    # Internal: run one scenario in this process
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--hub", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = build_parser().parse_args(argv)
+    args.comfyui = os.path.abspath(args.comfyui)
+    if args.child:
+        return run_child(args)
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    hub, hub_url = start_hub(args)
+    results = {}
+    try:
+        for name in names:
+            print(f"Running {name}...", file=sys.stderr, flush=True)
+            results[name] = median_metrics([run_scenario(name, hub_url, argv, args) for _ in range(args.repeat)])
+    finally:
+        hub.terminate()
+        hub.wait()
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"params": params(args), "results": results}, f, indent=2)
+
+    try:
+        with open(BASELINE_PATH, "r") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    if args.update_baseline:
+        section = baseline.get("loadtest", {})
+        if section.get("params") != params(args):
+            section = {"params": params(args), "results": {}}
+        section["results"].update(results)
+        baseline["loadtest"] = section
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+        return 0
+
+    section = baseline.get("loadtest")
+    if not section:
+        print("No baseline to compare with; run with --update-baseline to record one")
+        return 0
+    if section.get("params") != params(args):
+        print("The baseline was recorded with different options; not comparing")
+        return 0
+    problems = []
+    for name, metrics in results.items():
+        if name in section["results"]:
+            problems += regressions(name, metrics, section["results"][name], args.tolerance)
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    if not problems:
+        print("OK: no regressions against the baseline")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+"""
+Download engine and job scheduling for the Hal.fun model downloader.
+
+Nothing in this package imports ComfyUI modules, so it can be used from
+the node module as well as from standalone tooling.
+"""
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+from urllib.parse import quote
+
+import aiohttp
+
+from .jobs import DEFAULT_ENDPOINT
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+# Statuses that mean the file would be served to this token
+ACCESSIBLE = (200, 206, 301, 302, 303, 307, 308)
+DENIED = (401, 403)
+
+
+def resolve_url(repo_id, path, revision=None, endpoint=None):
+    endpoint = (endpoint or os.environ.get("HF_ENDPOINT", DEFAULT_ENDPOINT)).rstrip("/")
+    return f"{endpoint}/{repo_id}/resolve/{quote(revision or 'main', safe='')}/{quote(path)}"
+
+
+class AccessProber:
+    """
+    Checks whether a token may download gated files using metadata-only
+    HEAD requests, without following the redirect to the file itself.
+
+    All probes share one pooled session and run concurrently up to
+    concurrency at a time, so checking every gated model costs about as
+    long as the slowest single request.
+    """
+
+    def __init__(self, concurrency=16, timeout=15):
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session = None
+
+    async def get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def probe(self, repo_id, path, token=None, revision=None, endpoint=None):
+        """
+        True if the file is accessible, False if access is denied (gated and
+        not accepted, or not logged in), None if the answer is unknown.
+        """
+        session = await self.get_session()
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        url = resolve_url(repo_id, path, revision, endpoint)
+        try:
+            async with session.head(url, headers=headers, allow_redirects=False) as resp:
+                if resp.status in ACCESSIBLE:
+                    return True
+                if resp.status in DENIED:
+                    return False
+                logger.warning(f"Unexpected HTTP {resp.status} probing access to {repo_id}/{path}")
+                return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Error probing access to {repo_id}/{path}: {e}")
+            return None
+
+    async def probe_many(self, items, token=None):
+        """
+        Probe several files at once. items maps a key to (repo_id, path, revision);
+        returns a dict of key -> probe result.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(key, repo_id, path, revision):
+            async with semaphore:
+                return key, await self.probe(repo_id, path, token=token, revision=revision)
+
+        results = await asyncio.gather(*(run(key, *item) for key, item in items.items()))
+        return dict(results)
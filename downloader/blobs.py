@@ -0,0 +1,206 @@
+import errno
+import logging
+import os
+import re
+import shutil
+import uuid
+
+from .integrity import git_blob_sha1, hash_file
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+# Linux FICLONE ioctl, used for copy-on-write clones on btrfs/xfs
+FICLONE = 0x40049409
+
+_KEY_RE = re.compile(r"^[0-9a-f]{40,64}$")
+
+
+def normalize_key(etag):
+    """Blob key for a Hub etag: LFS files use their sha256, small files their git sha1"""
+    if not etag:
+        return None
+    key = etag.strip().strip('"').lower()
+    if key.startswith("w/"):
+        key = key[2:].strip('"')
+    return key if _KEY_RE.match(key) else None
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def link_or_copy(src, dst):
+    """
+    Make dst have the contents of src as cheaply as the filesystem allows:
+    hardlink, then reflink, then a plain copy. Returns the method used.
+    """
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+        return "reflink"
+    except (OSError, ImportError):
+        try:
+            os.remove(dst)
+        except FileNotFoundError:
+            pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+def place_file(src, dest):
+    """Make dest a link or copy of src via a temp file, so dest is replaced in one step; returns the method"""
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    tmp_path = f"{dest}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        method = link_or_copy(src, tmp_path)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return method
+
+
+def content_key(path, key):
+    """Hash path the way key was made: sha256 for LFS keys, git blob sha1 for 40-character ones"""
+    return git_blob_sha1(path) if len(key) == 40 else hash_file(path)
+
+
+def _same_file(st, path):
+    try:
+        return os.path.samestat(st, os.stat(path))
+    except OSError:
+        return False
+
+
+class BlobStore:
+    """
+    Content-addressed store for downloaded files, keyed by the Hub etag.
+
+    Model files under models/ are hardlinks to blobs where possible, so the
+    same upstream file used by several catalog entries is downloaded and
+    stored once. A blob whose link count has dropped to one is referenced
+    by nothing but the store and can be garbage collected.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+
+    def blob_path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def has(self, key):
+        return bool(key) and os.path.isfile(self.blob_path(key))
+
+    def check(self, key, size=None, damaged=None):
+        """
+        True if blob key is stored and intact. Model files are hardlinks of
+        their blob, so damage to a model file is damage to the blob: a blob
+        that is the same file as damaged (a target known to be bad), has
+        the wrong size or no longer hashes to its key is removed and
+        reported missing. Reads the whole blob.
+        """
+        if not key:
+            return False
+        blob = self.blob_path(key)
+        try:
+            st = os.stat(blob)
+        except FileNotFoundError:
+            return False
+        problem = None
+        if damaged is not None and _same_file(st, damaged):
+            problem = f"is the damaged file {damaged}"
+        elif size is not None and st.st_size != size:
+            problem = f"is {st.st_size} bytes, expected {size}"
+        elif content_key(blob, key) != key:
+            problem = "does not match its key"
+        if problem is None:
+            return True
+        logger.warning(f"Blob {key[:12]} {problem}, removing it")
+        try:
+            os.remove(blob)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def place(self, key, dest):
+        """Materialize blob key at dest, replacing whatever is there"""
+        method = place_file(self.blob_path(key), dest)
+        logger.info(f"Placed blob {key[:12]} at {dest} ({method})")
+        return method
+
+    def ingest(self, path, key):
+        """
+        Record a freshly downloaded file under key. If the blob already
+        exists, path is replaced by a link to it so the bytes are stored once.
+        Returns False when the file could not be linked into the store.
+        """
+        if not key:
+            return False
+        blob = self.blob_path(key)
+        if os.path.isfile(blob):
+            if os.path.samefile(blob, path):
+                return True
+            # A damaged blob is dropped and replaced by path below
+            if self.check(key):
+                self.place(key, path)
+                return True
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(path, blob)
+            return True
+        except FileExistsError:
+            return True
+        except OSError as e:
+            # Different filesystem or no hardlink support: a second copy would defeat the point
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EMLINK):
+                raise
+            logger.debug(f"Not adding {path} to blob store at {self.root}: {e}")
+            return False
+
+    def iter_blobs(self):
+        if not os.path.isdir(self.root):
+            return
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if _KEY_RE.match(name):
+                    yield name, os.path.join(prefix_dir, name)
+
+    def gc(self, dry_run=False):
+        """Remove blobs that no model file links to any more"""
+        removed = []
+        freed = 0
+        for key, path in list(self.iter_blobs()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if st.st_nlink > 1:
+                continue
+            removed.append(key)
+            freed += st.st_size
+            if not dry_run:
+                os.remove(path)
+        logger.info(f"Blob store GC {'would remove' if dry_run else 'removed'} {len(removed)} blobs ({freed} bytes)")
+        return {"removed": removed, "freed_bytes": freed, "dry_run": dry_run}
+
+    def stats(self):
+        count = 0
+        total = 0
+        for _, path in self.iter_blobs():
+            try:
+                total += os.stat(path).st_size
+                count += 1
+            except FileNotFoundError:
+                pass
+        return {"root": self.root, "blobs": count, "bytes": total}
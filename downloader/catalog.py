@@ -0,0 +1,308 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+from .metrics import STATUS_SCAN_SECONDS
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+
+class AmbiguousModelError(ValueError):
+    """A model name that refers to several catalog entries"""
+
+    def __init__(self, name, entries):
+        self.name = name
+        self.local_paths = sorted({entry.get("local_path", "") for entry in entries})
+        super().__init__(
+            f"{name!r} matches {len(self.local_paths)} models ({', '.join(self.local_paths)}); use its local_path"
+        )
+
+
+def model_key(entry):
+    """Name used for an entry in model_status: the last component of local_path"""
+    return os.path.basename(entry.get("local_path", "").rstrip("/"))
+
+
+def is_repo_entry(entry):
+    return not entry.get("filename")
+
+
+def model_folder(entry):
+    """ComfyUI model folder of an entry, e.g. "loras": the first component of a relative local_path"""
+    local_path = entry.get("local_path", "")
+    if os.path.isabs(local_path) or "/" not in local_path.strip("/"):
+        return ""
+    return local_path.strip("/").split("/")[0]
+
+
+def _search_text(entry):
+    fields = ("filename", "repo_id", "local_path", "subfolder")
+    return "\n".join(entry.get(field) or "" for field in fields).lower()
+
+
+def resolve_path(entry, default_base_path):
+    """Absolute destination for an entry: local_path under base_model_path or default_base_path"""
+    local_path = entry.get("local_path", "")
+    if os.path.isabs(local_path):
+        return local_path
+    return os.path.join(entry.get("base_model_path", default_base_path), local_path)
+
+
+def candidate_paths(entry, default_base_path, folder_dirs=None):
+    """
+    Where an entry may be on disk, the download destination first. With
+    folder_dirs (model folder -> its directories, e.g. from ComfyUI's
+    folder_paths), a relative local_path like "loras/x.safetensors" is
+    looked up in every directory of its folder; otherwise, or for entries
+    with base_model_path or an absolute local_path, there is one candidate.
+    """
+    folder = model_folder(entry)
+    dirs = folder_dirs(folder) if folder and folder_dirs is not None and not entry.get("base_model_path") else None
+    if not dirs:
+        return [resolve_path(entry, default_base_path)]
+    # Keeps the trailing slash of repository entries
+    rest = entry["local_path"].lstrip("/").split("/", 1)[1]
+    return [os.path.join(directory, rest) for directory in dirs]
+
+
+def parse_cursor(cursor):
+    """
+    (version, offset) from a page cursor "<version>:<offset>"; without a
+    cursor, the first page of whatever version is current. Raises ValueError.
+    """
+    if not cursor:
+        return None, 0
+    version, _, offset = cursor.partition(":")
+    if not (version.isdigit() and offset.isdigit()):
+        raise ValueError(f"bad cursor {cursor!r}")
+    return int(version), int(offset)
+
+
+class ModelCatalog:
+    """
+    In-memory view of model_config.json.
+
+    The file is only re-parsed when its mtime changes. Entries are indexed
+    by name, repo_id and local_path, and the downloaded/not-downloaded state
+    of every entry is cached. Status is refreshed by a periodic stat poll
+    (start_polling) and by refresh_entry() after a download finishes, so
+    readers never touch the filesystem themselves.
+
+    folder_dirs, if given, maps a model folder to the directories it spans
+    (see candidate_paths); an entry found in any of them is downloaded.
+    """
+
+    def __init__(self, config_path, default_base_path, folder_dirs=None):
+        self.config_path = str(config_path)
+        self.default_base_path = default_base_path
+        self.folder_dirs = folder_dirs
+        self._lock = threading.RLock()
+        self._mtime = None
+        self._entries = []
+        self._by_name = {}
+        self._by_repo = {}
+        self._by_local_path = {}
+        self._search_texts = []
+        self._status = {}
+        self.version = 0
+        self.status_version = 0
+        self._poller = None
+
+    def _check_reload(self):
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Model config file not found at {self.config_path}")
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with open(self.config_path, "r") as f:
+                entries = json.load(f)
+            self._index(entries)
+            self._mtime = mtime
+            self.version += 1
+            logger.debug(f"Loaded {len(entries)} catalog entries from {self.config_path}")
+        self.refresh_status()
+
+    def _index(self, entries):
+        by_name, by_repo, by_local_path = {}, {}, {}
+
+        def add(index, key, entry):
+            if key:
+                index.setdefault(key, []).append(entry)
+
+        for entry in entries:
+            local_path = entry.get("local_path", "")
+            add(by_name, model_key(entry), entry)
+            if entry.get("filename"):
+                add(by_name, entry["filename"], entry)
+            add(by_name, entry.get("repo_id", "").split("/")[-1], entry)
+            add(by_repo, entry.get("repo_id"), entry)
+            add(by_local_path, local_path.rstrip("/"), entry)
+
+        # Drop duplicate references to the same entry under one name
+        for index in (by_name, by_repo, by_local_path):
+            for key, items in index.items():
+                unique = []
+                for item in items:
+                    if not any(item is seen for seen in unique):
+                        unique.append(item)
+                index[key] = unique
+
+        self._entries = entries
+        self._search_texts = [_search_text(entry) for entry in entries]
+        self._by_name = by_name
+        self._by_repo = by_repo
+        self._by_local_path = by_local_path
+
+    def entries(self):
+        self._check_reload()
+        return self._entries
+
+    def candidates(self, name):
+        """
+        Every entry name may refer to: an exact local_path, else entries whose
+        local_path basename, filename or repo name is name, else entries whose
+        local_path contains it.
+        """
+        self._check_reload()
+        name = (name or "").rstrip("/")
+        if not name:
+            return []
+        matches = self._by_local_path.get(name) or self._by_name.get(name)
+        if matches:
+            return list(matches)
+        return [entry for entry in self._entries if name in entry.get("local_path", "")]
+
+    def find(self, name):
+        """
+        The entries name refers to (see candidates). A name matching entries
+        with different local_paths, such as a generic Hub filename like
+        "model.safetensors", raises AmbiguousModelError rather than
+        selecting all of them; a local_path is never ambiguous.
+        """
+        matches = self.candidates(name)
+        if len({entry.get("local_path", "").rstrip("/") for entry in matches}) > 1:
+            raise AmbiguousModelError(name, matches)
+        return matches
+
+    def by_repo(self, repo_id):
+        self._check_reload()
+        return list(self._by_repo.get(repo_id, []))
+
+    def by_local_path(self, local_path):
+        self._check_reload()
+        return list(self._by_local_path.get(local_path.rstrip("/"), []))
+
+    def search(self, query=None, folder=None, repo_id=None, downloaded=None):
+        """
+        Entries, in config order, whose filename, repo_id or local_path contain
+        every word of query, optionally limited to one model folder, one
+        repository and downloaded or missing models.
+        """
+        self._check_reload()
+        with self._lock:
+            entries, texts, status = self._entries, self._search_texts, self._status
+        words = (query or "").lower().split()
+        results = []
+        for entry, text in zip(entries, texts):
+            if words and not all(word in text for word in words):
+                continue
+            if folder and model_folder(entry) != folder:
+                continue
+            if repo_id and entry.get("repo_id") != repo_id:
+                continue
+            if downloaded is not None and status.get(model_key(entry), {}).get("downloaded", False) != downloaded:
+                continue
+            results.append(entry)
+        return results
+
+    def page(self, version, offset, limit, **filters):
+        """
+        (entries, total, next_cursor) for one page of search results, or
+        None if the catalog was reloaded since version, which would shift
+        the offsets; next_cursor is None on the last page.
+        """
+        matches = self.search(**filters)
+        if version is None:
+            version = self.version
+        elif version != self.version:
+            return None
+        end = offset + limit
+        return matches[offset:end], len(matches), f"{version}:{end}" if end < len(matches) else None
+
+    def candidate_paths(self, entry):
+        return candidate_paths(entry, self.default_base_path, self.folder_dirs)
+
+    def resolve_path(self, entry):
+        """Absolute path of an entry: where the last status scan found it, else its download destination"""
+        candidates = self.candidate_paths(entry)
+        if len(candidates) > 1:
+            entry_status = self._status.get(model_key(entry))
+            if entry_status and entry_status["downloaded"] and entry_status["path"] in candidates:
+                return entry_status["path"]
+        return candidates[0]
+
+    def _stat_entry(self, entry):
+        check = os.path.isdir if is_repo_entry(entry) else os.path.isfile
+        candidates = self.candidate_paths(entry)
+        for path in candidates:
+            if check(path.rstrip("/")):
+                return {"downloaded": True, "path": path}
+        return {"downloaded": False, "path": candidates[0]}
+
+    def refresh_status(self):
+        """Re-stat every entry; cheap enough to run on a timer"""
+        started = time.perf_counter()
+        entries = self._entries
+        status = {}
+        for entry in entries:
+            name = model_key(entry)
+            if name:
+                status[name] = self._stat_entry(entry)
+        STATUS_SCAN_SECONDS.observe(time.perf_counter() - started)
+        with self._lock:
+            if status != self._status:
+                self._status = status
+                self.status_version += 1
+
+    def refresh_entry(self, entry):
+        """
+        Update the cached status of a single entry after its download
+        finished. status_version changes even if the file existed before,
+        since it may have been replaced by a newer one.
+        """
+        name = model_key(entry)
+        if not name:
+            return
+        entry_status = self._stat_entry(entry)
+        with self._lock:
+            self._status = {**self._status, name: entry_status}
+            self.status_version += 1
+
+    def status(self):
+        """Cached model_status mapping; never touches the filesystem except for the config mtime"""
+        self._check_reload()
+        return self._status
+
+    def start_polling(self, interval=10.0):
+        """Refresh status in a background thread every interval seconds"""
+        if self._poller is not None or interval <= 0:
+            return
+
+        async def poll():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await asyncio.to_thread(self._check_reload)
+                    await asyncio.to_thread(self.refresh_status)
+                except Exception as e:
+                    logger.error(f"Error refreshing model status: {e}")
+
+        self._poller = asyncio.ensure_future(poll())
@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import os
+import threading
+from urllib.parse import urlparse
+
+import aiohttp
+
+from .integrity import IntegrityError, StreamingHasher, check_digest
+from .journal import ChunkJournal
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+MiB = 1024 * 1024
+
+
+class RangeDownloadError(Exception):
+    pass
+
+
+def _pwrite(fd, data, offset, lock):
+    """Positioned write; falls back to seek+write where os.pwrite is missing (Windows)"""
+    if hasattr(os, "pwrite"):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        return
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+
+
+def _write_block(fd, data, offset, lock, hasher):
+    _pwrite(fd, data, offset, lock)
+    hasher.feed(offset, data)
+
+
+def _preallocate(fd, size):
+    """Reserve size bytes for fd, using posix_fallocate when the platform has it"""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+def split_ranges(size, chunk_size):
+    """Split [0, size) into inclusive (start, end) byte ranges of at most chunk_size"""
+    return [(start, min(start + chunk_size, size) - 1) for start in range(0, size, chunk_size)]
+
+
+class ChunkedDownloader:
+    """
+    Downloads a single file over several parallel HTTP range requests.
+
+    The file is preallocated at its final size and every range is written
+    in place with positioned writes, so nothing has to be stitched
+    together afterwards. Servers that do not advertise range support are
+    downloaded over a single stream instead. One pooled aiohttp session is
+    shared by all downloads made through the same instance.
+
+    Data goes to <dest>.part with a ChunkJournal next to it; ranges that a
+    previous run finished are skipped, and the .part file is renamed onto
+    dest only once every byte is on disk.
+
+    The sha256 of the file is computed while it streams in (see
+    StreamingHasher). If expected_sha256 is given and does not match, the
+    partial file is discarded and IntegrityError is raised.
+
+    throttle, if given, is awaited with the size of every block read from
+    the network (see throttle.Throttle).
+    """
+
+    def __init__(self, connections=8, chunk_size=64 * MiB, write_block=4 * MiB, pool_size=64, timeout=None):
+        self.connections = max(1, int(connections))
+        self.chunk_size = max(MiB, int(chunk_size))
+        self.write_block = write_block
+        self.pool_size = pool_size
+        self.timeout = timeout or aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+        self._session = None
+
+    async def get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def probe(self, url, headers=None):
+        """
+        Return (final_url, size, etag, accepts_ranges) for url after following redirects.
+        """
+        session = await self.get_session()
+        async with session.head(url, headers=headers, allow_redirects=True) as resp:
+            resp.raise_for_status()
+            size = resp.headers.get("Content-Length")
+            accepts_ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+            # The Hub's CDN reports the LFS etag on the redirect, not on the final response
+            etag = resp.headers.get("ETag")
+            for previous in resp.history:
+                etag = previous.headers.get("X-Linked-Etag") or etag
+            return str(resp.url), int(size) if size is not None else None, etag, accepts_ranges
+
+    @staticmethod
+    def _headers_for(url, original_url, headers):
+        # Never forward credentials to a different host (e.g. a CDN redirect)
+        if headers and urlparse(url).netloc != urlparse(original_url).netloc:
+            return {k: v for k, v in headers.items() if k.lower() != "authorization"}
+        return headers
+
+    async def download(self, url, dest_path, headers=None, progress=None, expected_sha256=None, throttle=None):
+        """Download url to dest_path and return (bytes written, sha256 hex digest)"""
+        final_url, size, etag, accepts_ranges = await self.probe(url, headers=headers)
+        range_headers = self._headers_for(final_url, url, headers)
+        if progress is not None and size is not None:
+            progress.set_total(size)
+
+        os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+        part_path = f"{dest_path}.part"
+
+        hasher = StreamingHasher(part_path)
+        journal = ChunkJournal.for_part_file(part_path)
+        try:
+            if not size or not accepts_ranges:
+                logger.info(f"Server does not support range requests for {url}, using a single stream")
+                written = await self._download_stream(final_url, part_path, range_headers, progress, hasher, throttle)
+            else:
+                written = await self._download_ranges(final_url, part_path, size, etag, range_headers, progress, hasher, throttle)
+            digest = await asyncio.to_thread(hasher.hexdigest, written)
+        finally:
+            hasher.close()
+
+        try:
+            check_digest(digest, expected_sha256, dest_path)
+        except IntegrityError:
+            # Corrupt data must not be resumed from either
+            os.remove(part_path)
+            journal.remove()
+            raise
+
+        os.replace(part_path, dest_path)
+        journal.remove()
+        return written, digest
+
+    async def _download_stream(self, url, part_path, headers, progress, hasher, throttle):
+        session = await self.get_session()
+        written = 0
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        lock = threading.Lock()
+        try:
+            async with session.get(url, headers=headers) as resp:
+                resp.raise_for_status()
+                buffer = []
+                buffered = 0
+                async for data in resp.content.iter_chunked(MiB):
+                    if throttle is not None:
+                        await throttle(len(data))
+                    buffer.append(data)
+                    buffered += len(data)
+                    if buffered >= self.write_block:
+                        await asyncio.to_thread(_write_block, fd, b"".join(buffer), written, lock, hasher)
+                        written += buffered
+                        buffer, buffered = [], 0
+                    if progress is not None:
+                        progress.update(len(data))
+                if buffer:
+                    await asyncio.to_thread(_write_block, fd, b"".join(buffer), written, lock, hasher)
+                    written += buffered
+            await asyncio.to_thread(os.fsync, fd)
+        finally:
+            os.close(fd)
+        return written
+
+    async def _download_ranges(self, url, part_path, size, etag, headers, progress, hasher, throttle):
+        journal = ChunkJournal.for_part_file(part_path)
+        resuming = journal.load(size, etag, self.chunk_size) and os.path.exists(part_path)
+
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        if not resuming:
+            flags |= os.O_TRUNC
+            journal.completed = set()
+        fd = os.open(part_path, flags, 0o644)
+        lock = threading.Lock()
+        try:
+            await asyncio.to_thread(_preallocate, fd, size)
+
+            queue = asyncio.Queue()
+            for byte_range in split_ranges(size, self.chunk_size):
+                if byte_range not in journal.completed:
+                    queue.put_nowait(byte_range)
+
+            already_done = journal.completed_bytes()
+            if resuming:
+                logger.info(f"Resuming {part_path}: {already_done} of {size} bytes already downloaded")
+                for start, end in sorted(journal.completed):
+                    await asyncio.to_thread(hasher.mark_written, start, end - start + 1)
+            if progress is not None:
+                progress.set_done(already_done)
+
+            # Set when a range fails: the other workers finish (and journal) their
+            # current range but take no new ones, so a retry loses as little as possible
+            stop = asyncio.Event()
+            workers = [
+                asyncio.ensure_future(self._range_worker(url, fd, lock, queue, headers, progress, journal, hasher, throttle, stop))
+                for _ in range(min(self.connections, queue.qsize()))
+            ]
+            try:
+                results = await asyncio.gather(*workers, return_exceptions=True)
+            except BaseException:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+            written = already_done + sum(results)
+
+            if written != size:
+                raise RangeDownloadError(f"Expected {size} bytes but received {written}")
+            await asyncio.to_thread(os.fsync, fd)
+        finally:
+            os.close(fd)
+        return written
+
+    async def _range_worker(self, url, fd, lock, queue, headers, progress, journal, hasher, throttle, stop):
+        written = 0
+        while not queue.empty() and not stop.is_set():
+            start, end = queue.get_nowait()
+            try:
+                written += await self._fetch_range(url, fd, lock, start, end, headers, progress, hasher, throttle)
+            except Exception:
+                stop.set()
+                raise
+            await asyncio.to_thread(self._commit_range, fd, lock, journal, start, end)
+        return written
+
+    @staticmethod
+    def _commit_range(fd, lock, journal, start, end):
+        # Flush the range before recording it so the journal never runs ahead of the data
+        os.fsync(fd)
+        with lock:
+            journal.mark_done(start, end)
+
+    async def _fetch_range(self, url, fd, lock, start, end, headers, progress, hasher, throttle):
+        session = await self.get_session()
+        request_headers = dict(headers or {})
+        request_headers["Range"] = f"bytes={start}-{end}"
+
+        async with session.get(url, headers=request_headers) as resp:
+            resp.raise_for_status()
+            if resp.status != 206:
+                raise RangeDownloadError(f"Server ignored range request for bytes {start}-{end} (HTTP {resp.status})")
+
+            offset = start
+            buffer = []
+            buffered = 0
+            async for data in resp.content.iter_chunked(MiB):
+                if throttle is not None:
+                    await throttle(len(data))
+                buffer.append(data)
+                buffered += len(data)
+                if buffered >= self.write_block:
+                    await asyncio.to_thread(_write_block, fd, b"".join(buffer), offset, lock, hasher)
+                    offset += buffered
+                    buffer, buffered = [], 0
+                if progress is not None:
+                    progress.update(len(data))
+            if buffer:
+                await asyncio.to_thread(_write_block, fd, b"".join(buffer), offset, lock, hasher)
+                offset += buffered
+
+        expected = end - start + 1
+        if offset - start != expected:
+            raise RangeDownloadError(f"Range {start}-{end} returned {offset - start} of {expected} bytes")
+        return expected
@@ -0,0 +1,159 @@
+"""
+Headless provisioning, without a running ComfyUI server.
+
+Run from the node's directory (custom_nodes/ComfyUI-HF-Model-Downloader):
+
+    python -m downloader lock model_config.json -o models.lock.json
+    python -m downloader provision models.lock.json --report report.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+from .catalog import model_key
+from .fetcher import ModelFetcher
+from .provision import LockfileError, lock_entries, parse_lockfile, plan_provisioning, provision, read_lockfile
+from .settings import read_settings
+from .throttle import Throttle, TokenBucket
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+# custom_nodes/<this node>/downloader/cli.py -> ComfyUI root
+COMFY_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+DEFAULT_MODELS_DIR = os.path.join(COMFY_ROOT, "models")
+DEFAULT_STATE_DIR = os.path.join(COMFY_ROOT, "user", "default", "hal.fun-downloader")
+
+
+def _get_token(args):
+    """--token, then HF_TOKEN / the huggingface-cli login, then the token saved by the node's UI"""
+    if args.token:
+        return args.token
+    try:
+        from huggingface_hub import get_token
+    except ImportError:  # huggingface_hub < 0.21
+        from huggingface_hub import HfFolder
+
+        get_token = HfFolder.get_token
+    token = get_token()
+    if token:
+        return token
+    token_path = os.path.join(args.state_dir, "hf_token.txt")
+    if os.path.exists(token_path):
+        with open(token_path, "r") as f:
+            return f.read().strip() or None
+    return None
+
+
+def _make_fetcher(args):
+    settings = read_settings(os.path.join(args.state_dir, "settings.json"))
+    if args.engine:
+        settings["download_engine"] = args.engine
+    if args.no_blob_store:
+        settings["blob_store"] = False
+    # No catalog here, so nothing can be evicted
+    settings["auto_evict"] = False
+    return ModelFetcher(settings, args.models_dir)
+
+
+def _write_json(data, path):
+    text = json.dumps(data, indent=2) + "\n"
+    if path in (None, "-"):
+        sys.stdout.write(text)
+    else:
+        with open(path, "w") as f:
+            f.write(text)
+
+
+async def _provision(args):
+    entries = read_lockfile(args.lockfile, strict=not args.allow_unpinned)
+    plan = plan_provisioning(entries, args.models_dir)
+    fetcher = _make_fetcher(args)
+    token = _get_token(args)
+    throttle = Throttle(TokenBucket(args.bandwidth_limit)) if args.bandwidth_limit else None
+    logger.info(f"Provisioning {len(plan['downloads'])} downloads from {args.lockfile} into {args.models_dir}")
+
+    async def run(entry, path, details):
+        return await fetcher.download(entry, path, token, report=details, throttle=throttle)
+
+    try:
+        report = await provision(
+            plan,
+            run,
+            concurrency=args.jobs or fetcher.settings["max_concurrent_downloads"],
+            dry_run=args.dry_run,
+            verify=args.verify,
+            verify_workers=fetcher.settings["verify_workers"],
+        )
+    finally:
+        await fetcher.close()
+    report["lockfile"] = os.path.abspath(args.lockfile)
+    report["models_dir"] = os.path.abspath(args.models_dir)
+    _write_json(report, args.report)
+    summary = report["summary"]
+    logger.info(", ".join(f"{count} {state}" for state, count in summary.items() if state != "bytes_downloaded"))
+    return 0 if report["ok"] else 1
+
+
+async def _lock(args):
+    with open(args.config, "r") as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = parse_lockfile(entries, strict=False)
+    if args.names:
+        entries = [entry for entry in entries if model_key(entry) in args.names or entry.get("filename") in args.names]
+    fetcher = _make_fetcher(args)
+    try:
+        lockfile = await lock_entries(fetcher, entries, _get_token(args))
+    finally:
+        await fetcher.close()
+    _write_json(lockfile, args.output)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m downloader", description="Provision Hugging Face models without ComfyUI")
+    parser.add_argument("--models-dir", default=DEFAULT_MODELS_DIR, help="destination for relative local_path entries")
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR, help="where settings.json and hf_token.txt are read from")
+    parser.add_argument("--token", default=None, help="Hugging Face token (default: HF_TOKEN or the saved login)")
+    parser.add_argument("--engine", choices=("hub", "chunked"), default=None, help="override download_engine")
+    parser.add_argument("--no-blob-store", action="store_true", help="do not deduplicate through the blob store")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("provision", help="download everything in a lock file and write a JSON report")
+    run.add_argument("lockfile")
+    run.add_argument("--report", default="-", help="report path, - for stdout (default)")
+    run.add_argument("-j", "--jobs", type=int, default=None, help="concurrent downloads (default: max_concurrent_downloads)")
+    run.add_argument("--bandwidth-limit", type=int, default=None, help="bytes per second shared by all downloads")
+    run.add_argument("--dry-run", action="store_true", help="only report which files are present or missing")
+    run.add_argument("--verify", action="store_true", help="also hash files that were already present")
+    run.add_argument("--allow-unpinned", action="store_true", help="accept branch revisions and missing sha256")
+    run.set_defaults(func=_provision)
+
+    lock = commands.add_parser("lock", help="pin model_config.json entries to commits and sha256 hashes")
+    lock.add_argument("config", help="model_config.json or an existing lock file")
+    lock.add_argument("-o", "--output", default="-", help="lock file path, - for stdout (default)")
+    lock.add_argument("names", nargs="*", help="only these models (local_path basename or filename)")
+    lock.set_defaults(func=_lock)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # Logs go to stderr so a report on stdout stays machine-readable
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        stream=sys.stderr,
+    )
+    if not args.verbose:
+        # huggingface_hub's HTTP client logs every request at INFO
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    try:
+        return asyncio.run(args.func(args))
+    except (LockfileError, OSError, json.JSONDecodeError) as e:
+        logger.error(str(e))
+        return 2
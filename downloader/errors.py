@@ -0,0 +1,135 @@
+import asyncio
+import errno
+import functools
+
+import aiohttp
+
+from .chunked import RangeDownloadError
+from .integrity import IntegrityError
+from .storage import InsufficientSpaceError
+
+
+@functools.lru_cache(maxsize=None)
+def _hub_errors():
+    """
+    huggingface_hub's gated and not-found error classes, imported on first
+    use so that importing this package does not pull in huggingface_hub
+    """
+    try:
+        from huggingface_hub.utils import (
+            EntryNotFoundError,
+            GatedRepoError,
+            RepositoryNotFoundError,
+            RevisionNotFoundError,
+        )
+    except ImportError:  # pragma: no cover - very old huggingface_hub
+        return (), ()
+    return GatedRepoError, (RepositoryNotFoundError, RevisionNotFoundError, EntryNotFoundError)
+
+
+@functools.lru_cache(maxsize=None)
+def _transport_errors():
+    """Transport errors of the HTTP clients huggingface_hub may be built on"""
+    errors = [aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError, ConnectionError, TimeoutError]
+    try:
+        import requests
+
+        errors += [requests.ConnectionError, requests.Timeout]
+    except ImportError:
+        pass
+    try:
+        import httpx
+
+        errors += [httpx.TransportError]
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+AUTH = "auth"
+GATED = "gated"
+NOT_FOUND = "not_found"
+TRANSIENT = "transient"
+DISK = "disk"
+INTEGRITY = "integrity"
+UNKNOWN = "unknown"
+
+# Worth another attempt: the next try may succeed, and resumes where this one stopped
+RETRYABLE = (TRANSIENT, INTEGRITY)
+# A mismatching hash means downloading the whole file again, so only try that once more
+RETRY_LIMITS = {INTEGRITY: 1}
+
+TRANSIENT_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+HINTS = {
+    AUTH: "log in with a valid Hugging Face token",
+    GATED: "accept the model's license on huggingface.co with the logged-in account",
+    DISK: "free up disk space or raise the storage quota",
+}
+
+
+class DownloadError(Exception):
+    """An error with its kind attached, e.g. for circuit breaker failures"""
+
+    def __init__(self, kind, message, retry_after=None):
+        super().__init__(message)
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+def http_status(exc):
+    """HTTP status carried by an aiohttp or huggingface_hub error, if any"""
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def retry_after(exc):
+    """Seconds from a Retry-After header, or a DownloadError's own hint"""
+    if isinstance(exc, DownloadError):
+        return exc.retry_after
+    headers = getattr(exc, "headers", None) or getattr(getattr(exc, "response", None), "headers", None)
+    try:
+        return float(headers.get("Retry-After")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(exc):
+    """Kind of failure, from the exception type and HTTP status rather than its message"""
+    if isinstance(exc, DownloadError):
+        return exc.kind
+    gated_errors, not_found_errors = _hub_errors()
+    if isinstance(exc, gated_errors):
+        return GATED
+    if isinstance(exc, not_found_errors):
+        return NOT_FOUND
+    if isinstance(exc, IntegrityError):
+        return INTEGRITY
+    if isinstance(exc, InsufficientSpaceError):
+        return DISK
+    if isinstance(exc, OSError) and exc.errno in (errno.ENOSPC, getattr(errno, "EDQUOT", errno.ENOSPC)):
+        return DISK
+
+    status = http_status(exc)
+    if status is not None:
+        if status == 401:
+            return AUTH
+        if status == 403:
+            return GATED
+        if status == 404:
+            return NOT_FOUND
+        if status in TRANSIENT_STATUSES:
+            return TRANSIENT
+        return UNKNOWN
+
+    if isinstance(exc, (RangeDownloadError,) + _transport_errors()):
+        return TRANSIENT
+    return UNKNOWN
+
+
+def describe(exc):
+    """Error message with a hint for failures the user can fix"""
+    hint = HINTS.get(classify(exc))
+    return f"{exc} ({hint})" if hint else str(exc)
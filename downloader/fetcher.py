@@ -0,0 +1,542 @@
+import asyncio
+import logging
+import os
+import posixpath
+import shutil
+
+from .blobs import BlobStore, content_key, normalize_key, place_file
+from .chunked import MiB, ChunkedDownloader
+from .errors import classify, describe
+from .fsutil import remove_empty_dirs
+from .integrity import IntegrityError, as_sha256, check_digest, hash_file
+from .jobs import endpoint_host
+from .locks import FileLock, SingleFlight
+from .metrics import BYTES_DOWNLOADED, CACHE_REQUESTS
+from .mirrors import MirrorFetcher
+from .progress import FileProgress, watch_download_dir
+from .retry import CircuitBreaker, RetryPolicy, retry_call
+from .snapshot import diff_manifest, entry_patterns, load_manifest, remote_manifest, save_manifest
+from .storage import GiB, InsufficientSpaceError, StorageManager
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+# Where a download's bytes came from, reported as details["source"]
+SOURCE_LOCAL = "local"
+SOURCE_BLOB_STORE = "blob_store"
+SOURCE_MIRROR = "mirror"
+SOURCE_HUB = "hub"
+
+# Where hf_hub_download writes, next to the target so moving the file into place is a rename
+STAGING_DIR = os.path.join(".cache", "hal-fun-downloader", "staging")
+
+
+def transfer_key(model_config):
+    """Identity of an upstream file; downloads with the same key share one transfer"""
+    return (
+        model_config.get("endpoint") or os.environ.get("HF_ENDPOINT", ""),
+        model_config["repo_id"],
+        model_config.get("revision") or "main",
+        "/".join(p for p in (model_config.get("subfolder"), model_config["filename"]) if p),
+    )
+
+
+def _is_complete(path, expected_size):
+    try:
+        return expected_size is None or os.path.getsize(path) == expected_size
+    except OSError:
+        return False
+
+
+def check_listed_file(path, listed, digest=None):
+    """
+    Raise IntegrityError unless the file at path has the size and etag of
+    its repository listing. digest is the sha256 already computed while
+    downloading, if any, which saves hashing an LFS file again.
+    """
+    size = os.path.getsize(path)
+    if listed["size"] is not None and size != listed["size"]:
+        raise IntegrityError(f"{path} is {size} bytes, the repository lists {listed['size']}")
+    key = normalize_key(listed["etag"])
+    if key and digest != key and content_key(path, key) != key:
+        raise IntegrityError(f"{path} does not match its listed etag {key}")
+
+
+class ModelFetcher:
+    """
+    Downloads catalog entries to disk.
+
+    A single file is taken from the local disk, the blob store, a mirror or
+    the Hub, in that order; a repository entry is fetched file by file.
+    The blob store, range downloader, mirrors, storage manager and circuit
+    breaker are built from settings on first use. The node module shares
+    one fetcher with its job scheduler; the provisioning CLI makes its own.
+
+    Concurrent downloads of the same upstream file share one transfer, and
+    a file lock next to each target keeps other processes using the same
+    models directory from writing it at the same time.
+    """
+
+    def __init__(self, settings, models_dir, state_dir=None, catalog=None):
+        self.settings = settings
+        self.models_dir = models_dir
+        self.state_dir = state_dir
+        self.catalog = catalog
+        self._blob_store = None
+        self._chunked = None
+        self._mirrors = None
+        self._storage = None
+        self._breaker = None
+        self.transfers = SingleFlight()
+
+    @property
+    def blob_store(self):
+        """Shared BlobStore, or None when deduplication is disabled"""
+        if not self.settings["blob_store"]:
+            return None
+        if self._blob_store is None:
+            self._blob_store = BlobStore(self.settings["blob_store_dir"] or os.path.join(self.models_dir, ".hf-blobs"))
+        return self._blob_store
+
+    @property
+    def chunked(self):
+        if self._chunked is None:
+            self._chunked = ChunkedDownloader(
+                connections=self.settings["connections_per_file"],
+                chunk_size=self.settings["chunk_size_mb"] * MiB,
+            )
+        return self._chunked
+
+    @property
+    def mirrors(self):
+        if self._mirrors is None:
+            self._mirrors = MirrorFetcher(self.settings["mirrors"], self.chunked, self.settings["blob_token"])
+        return self._mirrors
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            self._storage = StorageManager(
+                self.catalog,
+                os.path.join(self.state_dir, "model_usage.json") if self.state_dir else None,
+                min_free=self.settings["min_free_space_gb"] * GiB,
+                quota=self.settings["storage_quota_gb"] * GiB if self.settings["storage_quota_gb"] else None,
+                pinned=self.settings["pinned_models"],
+                blob_store=self.blob_store,
+            )
+        return self._storage
+
+    @property
+    def breaker(self):
+        if self._breaker is None:
+            self._breaker = CircuitBreaker(
+                threshold=self.settings["circuit_breaker_threshold"],
+                reset_after=self.settings["circuit_breaker_reset"],
+            )
+        return self._breaker
+
+    async def close(self):
+        if self._chunked is not None:
+            await self._chunked.close()
+
+    def file_metadata(self, repo_id, subfolder, filename, token, revision=None):
+        """Hub metadata (size, etag, commit) for a single file, or None if it could not be fetched"""
+        from huggingface_hub import get_hf_file_metadata, hf_hub_url
+
+        try:
+            url = hf_hub_url(repo_id, filename, subfolder=subfolder or None, revision=revision)
+            return get_hf_file_metadata(url, token=token)
+        except Exception as e:
+            logger.debug(f"Could not fetch metadata for {repo_id}/{filename}: {e}")
+            return None
+
+    def retry_policy(self):
+        return RetryPolicy(
+            attempts=self.settings["retry_attempts"],
+            base_delay=self.settings["retry_base_delay"],
+            max_delay=self.settings["retry_max_delay"],
+        )
+
+    def expected_sha256(self, model_config, metadata):
+        """sha256 from the entry, else from the Hub's LFS etag"""
+        if not self.settings["verify_downloads"]:
+            return None
+        return as_sha256(model_config.get('sha256')) or (as_sha256(metadata.etag) if metadata else None)
+
+    async def download(self, model_config, local_path, token=None, progress=None, report=None, throttle=None):
+        """Download an entry to local_path and return a status string; failures start with "Error" """
+        repo_id = model_config['repo_id']
+        filename = model_config.get('filename')  # May be None for full repo downloads
+        try:
+            if not filename:
+                logger.info(f"Starting full repository download of {repo_id} to {local_path}")
+                return await self._download_snapshot(model_config, local_path, token, progress, report, throttle)
+            logger.info(f"Starting single file download of {filename} from {repo_id}")
+            # "update" replaces a file on disk that no longer matches the Hub
+            return await self._download_file(
+                model_config, local_path, token, progress, report, throttle, force=bool(model_config.get('update'))
+            )
+        except Exception as e:
+            error_detail = filename if filename else f"repository {repo_id}"
+            kind = classify(e)
+            if report is not None:
+                report["error_kind"] = kind
+            logger.debug(f"Download of {error_detail} failed ({kind}): {e}")
+            return f"Error downloading {error_detail}: {describe(e)}"
+
+    async def _run_with_progress(self, func, progress, watch_dir, **kwargs):
+        """
+        Run a blocking huggingface_hub download in a thread while reporting
+        progress. A thread cannot be stopped, so when this is cancelled it
+        waits for func to return before raising CancelledError; until then
+        the caller keeps its file lock and nothing else writes the target.
+        """
+        watcher = asyncio.ensure_future(watch_download_dir(progress, watch_dir)) if progress is not None else None
+        thread = asyncio.ensure_future(asyncio.to_thread(func, **kwargs))
+        try:
+            return await asyncio.shield(thread)
+        except asyncio.CancelledError:
+            logger.info(f"Cancelled, waiting for the download thread writing to {watch_dir} to return")
+            while not thread.done():
+                try:
+                    await asyncio.wait([thread])
+                except asyncio.CancelledError:
+                    pass
+            if thread.exception() is not None:
+                logger.debug(f"Download thread for a cancelled transfer failed: {thread.exception()}")
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+    async def _download_snapshot(self, model_config, local_path, token, progress=None, report=None, throttle=None):
+        """
+        Fetch the files of a repository that are missing or changed locally.
+
+        The file list comes from the Hub, filtered by the entry's
+        allow_patterns/ignore_patterns (or its subfolder) and pinned to its
+        revision. It is compared with the manifest written by the previous
+        run, so only new or changed files are downloaded, snapshot_workers
+        at a time, each through the same path as a single-file entry.
+        """
+        repo_id = model_config['repo_id']
+        local_dir = local_path.rstrip('/')
+        allow_patterns, ignore_patterns = entry_patterns(model_config)
+
+        commit, files = await retry_call(
+            lambda: asyncio.to_thread(
+                remote_manifest, repo_id, model_config.get('revision'), token, allow_patterns, ignore_patterns
+            ),
+            self.retry_policy(),
+            self.breaker,
+            endpoint_host(model_config),
+            f"Listing files of {repo_id}",
+        )
+        if not files:
+            return f"Error: No files in repository {repo_id} match the configured patterns"
+
+        manifest = await asyncio.to_thread(load_manifest, local_dir)
+        needed = await asyncio.to_thread(diff_manifest, local_dir, files, manifest)
+        os.makedirs(local_dir, exist_ok=True)
+        if report is not None:
+            report["commit"] = commit
+            report["source"] = SOURCE_HUB if needed else SOURCE_LOCAL
+        if not needed:
+            if manifest.get("commit") != commit or manifest.get("files") != files:
+                await asyncio.to_thread(save_manifest, local_dir, repo_id, commit, files)
+            return f"Repository already up to date at {local_path}"
+
+        logger.info(f"Fetching {len(needed)} of {len(files)} files from {repo_id} at {commit}")
+        file_states = {path: {"size": files[path]["size"], "bytes_done": 0, "state": "queued"} for path in needed}
+        if report is not None:
+            report["files"] = file_states
+        if progress is not None:
+            progress.set_total(sum(files[path]["size"] or 0 for path in needed))
+
+        semaphore = asyncio.Semaphore(max(1, self.settings["snapshot_workers"]))
+
+        async def fetch(path):
+            async with semaphore:
+                state = file_states[path]
+                state["state"] = "running"
+                subfolder, filename = posixpath.split(path)
+                file_config = {
+                    "repo_id": repo_id,
+                    "subfolder": subfolder,
+                    "filename": filename,
+                    "revision": commit,
+                    # LFS files carry their sha256 in the listing; small files have none
+                    "sha256": as_sha256(files[path]["etag"]),
+                    # Per-file progress and resume need the range engine
+                    "engine": "chunked",
+                }
+                file_progress = FileProgress(progress, state) if progress is not None else None
+                file_path = os.path.join(local_dir, path)
+                try:
+                    await self._download_file(file_config, file_path, token, file_progress, state, throttle, force=True)
+                    # Only what is verifiably on disk goes into the manifest
+                    try:
+                        await asyncio.to_thread(
+                            check_listed_file, file_path, files[path], state.get("sha256", {}).get("actual")
+                        )
+                    except IntegrityError:
+                        # A same-size file without a manifest record would be trusted next time
+                        os.remove(file_path)
+                        raise
+                    state["state"] = "completed"
+                except Exception as e:
+                    state["state"] = "failed"
+                    state["error"] = str(e)
+                    state["error_kind"] = classify(e)
+                    raise
+
+        results = await asyncio.gather(*(fetch(path) for path in needed), return_exceptions=True)
+        failed = {path: result for path, result in zip(needed, results) if isinstance(result, Exception)}
+
+        # Failed files keep their previous record, so the next run fetches them again
+        recorded = manifest.get("files", {})
+        done = {path: files[path] for path in files if path not in failed}
+        done.update({path: recorded[path] for path in failed if path in recorded})
+        await asyncio.to_thread(save_manifest, local_dir, repo_id, commit, done)
+
+        if failed:
+            path, error = next(iter(failed.items()))
+            if report is not None:
+                report["error_kind"] = classify(error)
+            return f"Error downloading {len(failed)} of {len(needed)} files from {repo_id} (first: {path}: {error})"
+        return f"Successfully downloaded {len(needed)} files from repository {repo_id} to {local_path}"
+
+    async def _reserve_space(self, local_path, expected_size):
+        """Admit a download of expected_size bytes, evicting old models first if allowed"""
+        storage = self.storage
+        needed = expected_size or 0
+        part_path = f"{local_path}.part"
+        if needed and os.path.exists(part_path):
+            # A resumed download has its space preallocated already
+            needed = max(0, needed - os.path.getsize(part_path))
+        try:
+            storage.admit(local_path, needed)
+        except InsufficientSpaceError:
+            if not self.settings["auto_evict"] or storage.catalog is None:
+                raise
+            plan = await asyncio.to_thread(storage.plan_eviction, needed, local_path)
+            if not plan["satisfied"]:
+                raise
+            logger.info(f"Evicting {len(plan['evict'])} models to free {plan['freed_bytes']} bytes for {os.path.basename(local_path)}")
+            await asyncio.to_thread(storage.evict, plan)
+            storage.admit(local_path, needed)
+
+    async def _download_from_hub(self, model_config, local_path, token, expected_sha256, progress=None, throttle=None):
+        """Download a single file from the Hub with the configured engine; returns its sha256 if known"""
+        # Imported on first use: huggingface_hub is slow to import and most ComfyUI starts never need it
+        from huggingface_hub import hf_hub_download, hf_hub_url
+        from huggingface_hub.utils import build_hf_headers
+
+        repo_id = model_config['repo_id']
+        subfolder = model_config.get('subfolder', '')
+        filename = model_config['filename']
+        revision = model_config.get('revision')
+
+        engine = model_config.get('engine', self.settings["download_engine"])
+        if throttle is not None and throttle.limited and engine != "chunked":
+            # hf_hub_download cannot be rate limited, the built-in engine can
+            logger.debug(f"Bandwidth limit set, using chunked engine for {filename}")
+            engine = "chunked"
+        if engine == "chunked":
+            url = hf_hub_url(repo_id, filename, subfolder=subfolder or None, revision=revision)
+            # Hashed while streaming; a mismatch raises before the file is renamed into place
+            _, digest = await self.chunked.download(
+                url,
+                local_path,
+                headers=build_hf_headers(token=token),
+                progress=progress,
+                expected_sha256=expected_sha256,
+                throttle=throttle,
+            )
+        else:
+            # Staged on the target's filesystem, without leaving the repo's subfolders in the model folder.
+            # One directory per target, which its file lock keeps to this download; kept on failure so a retry resumes
+            staging_dir = os.path.join(os.path.dirname(local_path), STAGING_DIR, os.path.basename(local_path))
+            # Run the blocking hf_hub_download in a separate thread
+            await self._run_with_progress(
+                hf_hub_download,
+                progress,
+                staging_dir,
+                repo_id=repo_id,
+                subfolder=subfolder,
+                filename=filename,
+                revision=revision,
+                local_dir=staging_dir,
+                token=token
+            )
+            os.replace(os.path.join(staging_dir, subfolder, filename), local_path)
+            # hf_hub_download leaves its own .cache/huggingface lock and metadata files behind
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            remove_empty_dirs(os.path.dirname(staging_dir), os.path.dirname(local_path))
+
+            if progress is not None:
+                progress.set_done(os.path.getsize(local_path))
+
+            # hf_hub_download gives no access to the stream, so this needs one read pass
+            digest = None
+            if expected_sha256:
+                digest = await asyncio.to_thread(hash_file, local_path)
+                try:
+                    check_digest(digest, expected_sha256, local_path)
+                except Exception:
+                    os.remove(local_path)
+                    raise
+        return digest
+
+    async def _download_file(self, model_config, local_path, token, progress=None, report=None, throttle=None, force=False):
+        repo_id = model_config['repo_id']
+        subfolder = model_config.get('subfolder', '')
+        filename = model_config['filename']
+        revision = model_config.get('revision')
+
+        metadata = await asyncio.to_thread(self.file_metadata, repo_id, subfolder, filename, token, revision)
+        expected_size = metadata.size if metadata else None
+        # A sha256 from the entry identifies the blob too, e.g. when the Hub is unreachable
+        blob_key = (normalize_key(metadata.etag) if metadata else None) or as_sha256(model_config.get('sha256'))
+        expected_sha256 = self.expected_sha256(model_config, metadata)
+        blobs = self.blob_store
+        if progress is not None:
+            progress.set_total(expected_size)
+        if report is not None:
+            report["size"] = expected_size
+
+        # A file of the wrong size is a leftover from an interrupted copy or damaged, not a finished download
+        damaged = None
+        if os.path.exists(local_path):
+            actual_size = os.path.getsize(local_path)
+            size_ok = expected_size is None or actual_size == expected_size
+            if size_ok and not force:
+                CACHE_REQUESTS.inc(cache="local_file", result="hit")
+                if blobs is not None:
+                    await asyncio.to_thread(blobs.ingest, local_path, blob_key)
+                if report is not None:
+                    report["source"] = SOURCE_LOCAL
+                return f"File already exists at {local_path}"
+            if not size_ok:
+                logger.warning(f"{local_path} is {actual_size} bytes but {expected_size} were expected, downloading again")
+                damaged = local_path
+        CACHE_REQUESTS.inc(cache="local_file", result="miss")
+
+        # Same upstream blob already stored for another entry: link it instead of downloading.
+        # It is checked first, since a damaged model file may have damaged its blob through the hardlink.
+        if blobs is not None and await asyncio.to_thread(blobs.check, blob_key, expected_size, damaged):
+            CACHE_REQUESTS.inc(cache="blob_store", result="hit")
+            method = await asyncio.to_thread(blobs.place, blob_key, local_path)
+            if progress is not None:
+                progress.set_done(expected_size or 0)
+            if report is not None:
+                report["source"] = SOURCE_BLOB_STORE
+                if as_sha256(blob_key):
+                    # check() has just hashed it
+                    report["sha256"] = {
+                        "expected": expected_sha256,
+                        "actual": blob_key,
+                        "verified": blob_key == expected_sha256 if expected_sha256 else None,
+                    }
+            return f"Linked {filename} to {local_path} from blob store ({method})"
+
+        if blobs is not None:
+            CACHE_REQUESTS.inc(cache="blob_store", result="miss")
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+
+        # A second caller for the same file (another tab, a node, another entry) waits for the first one's transfer
+        result, leader = await self.transfers.run(
+            transfer_key(model_config),
+            lambda: self._transfer(
+                model_config, local_path, token, expected_size, blob_key, expected_sha256, progress, throttle
+            ),
+        )
+        if not leader:
+            logger.info(f"Attached to the running download of {filename} to {result['path']}")
+            if result["path"] != local_path:
+                if blobs is not None and blobs.has(blob_key):
+                    await asyncio.to_thread(blobs.place, blob_key, local_path)
+                else:
+                    await asyncio.to_thread(place_file, result["path"], local_path)
+            if progress is not None:
+                progress.set_done(expected_size or 0)
+        digest = result["digest"]
+
+        if report is not None:
+            report["source"] = result["source"]
+            if not leader:
+                report["shared_transfer"] = True
+            if result["source"] != SOURCE_LOCAL:
+                report["sha256"] = {
+                    "expected": expected_sha256,
+                    "actual": digest,
+                    "verified": digest == expected_sha256 if expected_sha256 and digest else None,
+                }
+
+        if result["source"] == SOURCE_LOCAL:
+            return f"File already exists at {local_path}"
+        if result["mirror"] is not None:
+            return f"Successfully downloaded {filename} to {local_path} from mirror {result['mirror']}"
+        return f"Successfully downloaded {filename} to {local_path}"
+
+    async def _transfer(self, model_config, local_path, token, expected_size, blob_key, expected_sha256, progress=None, throttle=None):
+        """
+        Fetch a single file to local_path from a mirror or the Hub while
+        holding its file lock. If another process held the lock and left the
+        complete file behind, that file is used. Returns the path, sha256
+        (if hashed), source and mirror.
+        """
+        repo_id = model_config['repo_id']
+        subfolder = model_config.get('subfolder', '')
+        filename = model_config['filename']
+        revision = model_config.get('revision')
+        blobs = self.blob_store
+
+        async with FileLock(local_path) as waited:
+            if waited and os.path.exists(local_path) and _is_complete(local_path, expected_size):
+                logger.info(f"{filename} was downloaded by another process")
+                if progress is not None:
+                    progress.set_done(expected_size or 0)
+                return {"path": local_path, "digest": None, "source": SOURCE_LOCAL, "mirror": None}
+
+            await self._reserve_space(local_path, expected_size)
+            try:
+                # Nearby copies first; they are only accepted if they hash to the blob key
+                source = await self.mirrors.fetch(
+                    local_path,
+                    blob_key,
+                    repo_id,
+                    "/".join(p for p in (subfolder, filename) if p),
+                    revision,
+                    progress=progress,
+                    throttle=throttle,
+                )
+                if source is not None:
+                    digest = as_sha256(blob_key)
+                    if digest:
+                        try:
+                            check_digest(digest, expected_sha256, local_path)
+                        except Exception:
+                            os.remove(local_path)
+                            raise
+                else:
+                    # A retry resumes from the .part journal (chunked) or the .incomplete file (hub)
+                    digest = await retry_call(
+                        lambda: self._download_from_hub(model_config, local_path, token, expected_sha256, progress, throttle),
+                        self.retry_policy(),
+                        self.breaker,
+                        endpoint_host(model_config),
+                        f"Downloading {filename}",
+                    )
+            finally:
+                self.storage.release(local_path)
+            BYTES_DOWNLOADED.inc(os.path.getsize(local_path), source="hub" if source is None else "mirror")
+
+            # Stored before callers waiting on this transfer link their own copies from it
+            if blobs is not None:
+                await asyncio.to_thread(blobs.ingest, local_path, blob_key)
+        return {
+            "path": local_path,
+            "digest": digest,
+            "source": SOURCE_HUB if source is None else SOURCE_MIRROR,
+            "mirror": source,
+        }
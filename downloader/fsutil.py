@@ -0,0 +1,66 @@
+import json
+import os
+import stat
+import tempfile
+
+
+def _read_umask():
+    # os.umask can only be read by setting it; done once, at import, before any threads write files
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _read_umask()
+
+
+def _default_mode(path):
+    """Mode of the file being replaced, else what open() would have created it with"""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def write_text_atomic(path, text, mode=None):
+    """
+    Write text to a unique temp file next to path and rename it into place,
+    so readers and a crash mid-write only ever see the old or the new file.
+    Without a mode, the file keeps the mode it had, or gets the usual one
+    for a new file rather than mkstemp's 0600.
+    """
+    path = str(path)
+    if mode is None:
+        mode = _default_mode(path)
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_json_atomic(path, data, indent=2):
+    """Write JSON to a temp file next to path and rename it into place"""
+    write_text_atomic(path, json.dumps(data, indent=indent))
+
+
+def remove_empty_dirs(path, root):
+    """Remove path and its parents below root for as long as they are empty"""
+    path = os.path.abspath(path)
+    root = os.path.abspath(root)
+    while path.startswith(root + os.sep):
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+        path = os.path.dirname(path)
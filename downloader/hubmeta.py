@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import time
+from urllib.parse import quote
+
+import aiohttp
+
+from .blobs import normalize_key
+from .catalog import is_repo_entry
+from .jobs import DEFAULT_ENDPOINT
+from .metrics import CACHE_REQUESTS
+from .snapshot import entry_patterns, load_manifest
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+
+def repo_key(entry):
+    return f"{entry['repo_id']}@{entry.get('revision') or 'main'}"
+
+
+def entry_path(entry):
+    return "/".join(p for p in (entry.get("subfolder"), entry.get("filename")) if p)
+
+
+def _same_file(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+class HubMetadataCache:
+    """
+    Sizes, hashes and commits of catalog files, cached on disk.
+
+    One Hub API request per repository and revision lists every file with
+    its size and LFS sha256. Each listing is kept for ttl seconds and then
+    revalidated with If-None-Match, so an unchanged repository costs a 304.
+    Readers only ever see the cache; refresh() runs in the background.
+    """
+
+    def __init__(self, store, ttl=3600, concurrency=8, timeout=30):
+        self.store = store
+        self.ttl = ttl
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        data = store.load({})
+        self.repos = data.get("repos", {}) if isinstance(data, dict) else {}
+        self.version = 0
+        self._refresh_task = None
+
+    def is_fresh(self, key):
+        record = self.repos.get(key)
+        return record is not None and time.time() - record.get("fetched_at", 0) < self.ttl
+
+    def refresh_in_background(self, entries, token=None, on_done=None):
+        """Start refreshing stale repositories unless a refresh is running; never waits"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return False
+        if all(self.is_fresh(repo_key(entry)) for entry in entries if entry.get("repo_id")):
+            return False
+
+        async def run():
+            try:
+                changed = await self.refresh(entries, token)
+                if changed and on_done is not None:
+                    on_done()
+            except Exception as e:
+                logger.error(f"Error refreshing Hub metadata: {e}")
+
+        self._refresh_task = asyncio.ensure_future(run())
+        return True
+
+    async def refresh(self, entries, token=None, force=False):
+        """Fetch listings that are missing or older than ttl; returns how many changed"""
+        keys = {}
+        for entry in entries:
+            if entry.get("repo_id"):
+                key = repo_key(entry)
+                if force or not self.is_fresh(key):
+                    keys[key] = (entry["repo_id"], entry.get("revision") or "main")
+        if not keys:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=self.timeout) as session:
+            async def fetch(key, repo_id, revision):
+                async with semaphore:
+                    return await self._fetch(session, key, repo_id, revision, token)
+
+            results = await asyncio.gather(*(fetch(key, *item) for key, item in keys.items()))
+        changed = sum(1 for result in results if result)
+        if changed:
+            self.version += 1
+        self.store.save({"repos": self.repos})
+        logger.debug(f"Refreshed Hub metadata for {len(keys)} repositories, {changed} changed")
+        return changed
+
+    async def _fetch(self, session, key, repo_id, revision, token):
+        endpoint = os.environ.get("HF_ENDPOINT", DEFAULT_ENDPOINT).rstrip("/")
+        url = f"{endpoint}/api/models/{repo_id}/revision/{quote(revision, safe='')}"
+        record = self.repos.get(key)
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        if record and record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        try:
+            async with session.get(url, params={"blobs": "true"}, headers=headers) as resp:
+                if resp.status == 304:
+                    CACHE_REQUESTS.inc(cache="hub_metadata", result="hit")
+                    record["fetched_at"] = time.time()
+                    return False
+                if resp.status != 200:
+                    logger.warning(f"Could not fetch Hub metadata for {key}: HTTP {resp.status}")
+                    return False
+                info = await resp.json()
+                etag = resp.headers.get("ETag")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"Could not fetch Hub metadata for {key}: {e}")
+            return False
+
+        CACHE_REQUESTS.inc(cache="hub_metadata", result="miss")
+        files = {}
+        for sibling in info.get("siblings") or []:
+            lfs = sibling.get("lfs") or {}
+            files[sibling["rfilename"]] = {
+                "size": sibling.get("size", lfs.get("size")),
+                "sha256": lfs.get("sha256"),
+                "blob_id": sibling.get("blobId"),
+            }
+        new_record = {"commit": info.get("sha"), "etag": etag, "files": files, "fetched_at": time.time()}
+        old_files = record.get("files") if record else None
+        self.repos[key] = new_record
+        return old_files != files or (record or {}).get("commit") != new_record["commit"]
+
+    def describe(self, entry, local_path, blob_store=None):
+        """
+        Cached Hub facts for an entry: size, sha256 (single files), commit,
+        and whether the copy on disk differs from the Hub. None if unknown.
+        """
+        record = self.repos.get(repo_key(entry)) if entry.get("repo_id") else None
+        if record is None:
+            return None
+        info = {"commit": record["commit"], "fetched_at": record["fetched_at"]}
+        files = record["files"]
+
+        if is_repo_entry(entry):
+            from huggingface_hub.utils import filter_repo_objects
+
+            allow, ignore = entry_patterns(entry)
+            paths = list(filter_repo_objects(files, allow_patterns=allow, ignore_patterns=ignore))
+            info["size"] = sum(files[path]["size"] or 0 for path in paths)
+            info["files"] = len(paths)
+            local_dir = local_path.rstrip("/")
+            manifest = load_manifest(local_dir) if os.path.isdir(local_dir) else {}
+            if manifest:
+                recorded = manifest.get("files", {})
+                info["update_available"] = any(
+                    path not in recorded or recorded[path].get("etag") not in (files[path]["sha256"], files[path]["blob_id"])
+                    for path in paths
+                )
+            else:
+                info["update_available"] = None
+            return info
+
+        remote = files.get(entry_path(entry))
+        if remote is None:
+            info["missing"] = True
+            return info
+        info["size"] = remote["size"]
+        info["sha256"] = remote["sha256"]
+        info["update_available"] = self._file_outdated(local_path, remote, blob_store)
+        return info
+
+    @staticmethod
+    def _file_outdated(local_path, remote, blob_store):
+        """
+        Whether the file on disk differs from the Hub's, or None if it is not
+        on disk. Without hashing, a file of the right size that is not linked
+        to another blob counts as up to date.
+        """
+        try:
+            st = os.stat(local_path)
+        except OSError:
+            return None
+        if remote["size"] is not None and st.st_size != remote["size"]:
+            return True
+        key = normalize_key(remote["sha256"] or remote["blob_id"])
+        if blob_store is not None and key and st.st_nlink > 1:
+            # Hardlinked into the blob store, but to a different blob
+            return not _same_file(local_path, blob_store.blob_path(key))
+        return False
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+READ_BLOCK = 8 * 1024 * 1024
+
+
+class IntegrityError(Exception):
+    pass
+
+
+def as_sha256(value):
+    """Return value as a lowercase sha256 hex digest, or None if it is not one"""
+    if not value:
+        return None
+    value = value.strip().strip('"').lower()
+    return value if _SHA256_RE.match(value) else None
+
+
+def _pread(fd, length, offset):
+    if hasattr(os, "pread"):
+        return os.pread(fd, length, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, length)
+
+
+class StreamingHasher:
+    """
+    sha256 of a file that is written out of order by parallel range downloads.
+
+    sha256 has to consume bytes in order, so the hasher keeps a cursor at
+    the end of the hashed prefix. Data written at the cursor is hashed
+    straight from the download buffer. Ranges that land further ahead are
+    only recorded; once the gap before them closes they are read back with
+    pread while they are still in the page cache. For a single stream, or
+    when ranges finish in order, every byte is hashed exactly once from
+    memory with no read-back at all.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._hash = hashlib.sha256()
+        self._cursor = 0
+        self._ahead = {}
+        self._lock = threading.Lock()
+
+    @property
+    def hashed_bytes(self):
+        return self._cursor
+
+    def feed(self, offset, data):
+        """Account for len(data) bytes written at offset; call after the write"""
+        with self._lock:
+            if offset == self._cursor:
+                self._hash.update(data)
+                self._cursor += len(data)
+                self._drain()
+            elif offset > self._cursor:
+                self._ahead[offset] = max(self._ahead.get(offset, 0), len(data))
+
+    def mark_written(self, offset, length):
+        """Account for bytes already on disk (e.g. from a resumed download)"""
+        with self._lock:
+            if offset > self._cursor:
+                self._ahead[offset] = max(self._ahead.get(offset, 0), length)
+            elif offset + length > self._cursor:
+                self._ahead[self._cursor] = offset + length - self._cursor
+            self._drain()
+
+    def _drain(self):
+        while self._cursor in self._ahead:
+            length = self._ahead.pop(self._cursor)
+            self._read_into_hash(self._cursor, length)
+            self._cursor += length
+
+    def _read_into_hash(self, offset, length):
+        # A private read-only descriptor, so seek-based reads never race the writers
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        end = offset + length
+        while offset < end:
+            data = _pread(self._fd, min(READ_BLOCK, end - offset), offset)
+            if not data:
+                raise IntegrityError(f"Unexpected end of file at byte {offset}")
+            self._hash.update(data)
+            offset += len(data)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def hexdigest(self, size):
+        """Finish hashing up to size bytes and return the digest"""
+        with self._lock:
+            if self._cursor < size:
+                # Anything not seen yet (e.g. gaps in a resumed journal) is read back now
+                self._ahead = {}
+                self._read_into_hash(self._cursor, size - self._cursor)
+                self._cursor = size
+            return self._hash.hexdigest()
+
+
+def hash_file(path, block_size=READ_BLOCK):
+    """sha256 of a file on disk, read through mmap without copying into Python objects"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return h.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                for start in range(0, size, block_size):
+                    h.update(view[start:start + block_size])
+            finally:
+                view.release()
+    return h.hexdigest()
+
+
+def git_blob_sha1(path, block_size=READ_BLOCK):
+    """Git object id of a file; the Hub uses it as the etag of files not stored in LFS"""
+    h = hashlib.sha1()
+    h.update(f"blob {os.path.getsize(path)}\0".encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def check_digest(actual, expected, path):
+    if expected and actual != expected:
+        raise IntegrityError(f"sha256 mismatch for {path}: expected {expected}, got {actual}")
+
+
+def verify_files(items, workers=4):
+    """
+    Hash files on disk in a worker pool. items is a list of (path, expected_sha256)
+    pairs; expected may be None. Returns one result dict per item, in order.
+    """
+    def verify(item):
+        path, expected = item
+        result = {"path": path, "expected": expected, "actual": None, "verified": None, "error": None}
+        try:
+            result["actual"] = hash_file(path)
+            if expected:
+                result["verified"] = result["actual"] == expected
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(verify, items))
@@ -0,0 +1,405 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from urllib.parse import urlparse
+
+from .metrics import JOB_DURATION, JOBS_FINISHED
+from .progress import ProgressTracker
+from .state import get_state_file
+from .throttle import Throttle, TokenBucket
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+DEFAULT_ENDPOINT = "https://huggingface.co"
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+# Cancelled while a blocking transfer thread is still finishing; it keeps its slot and file lock until then
+CANCELLING = "cancelling"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# Priority classes, most urgent first: a queued prompt is waiting on "prompt"
+# jobs, "normal" is an explicit request from the UI/API, "prefetch" is background
+PRIORITIES = {"prompt": 0, "normal": 1, "prefetch": 2}
+DEFAULT_PRIORITY = "normal"
+
+
+def endpoint_host(model_config):
+    """Host a catalog entry is downloaded from, for per-host limits"""
+    endpoint = model_config.get("endpoint") or os.environ.get("HF_ENDPOINT", DEFAULT_ENDPOINT)
+    return urlparse(endpoint).netloc or endpoint
+
+
+def job_key(model_config):
+    """Identity of a download target; jobs with the same key share one transfer"""
+    return (
+        model_config.get("repo_id"),
+        model_config.get("revision") or "main",
+        model_config.get("subfolder") or "",
+        model_config.get("filename") or "",
+        model_config.get("base_model_path") or "",
+        (model_config.get("local_path") or "").rstrip("/"),
+    )
+
+
+class DownloadJob:
+    """A single queued model download"""
+
+    def __init__(self, model_name, model_config, job_id=None, priority=DEFAULT_PRIORITY, bandwidth_limit=None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}, expected one of {', '.join(PRIORITIES)}")
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.model_name = model_name
+        self.model_config = model_config
+        self.priority = priority
+        self.bandwidth = TokenBucket(bandwidth_limit)
+        # Set by the scheduler: this job's bucket combined with the global one
+        self.throttle = Throttle(self.bandwidth)
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = None
+        # Extra facts reported by the runner, e.g. sha256 verification
+        self.details = {}
+
+    @property
+    def key(self):
+        return job_key(self.model_config)
+
+    @property
+    def host(self):
+        return endpoint_host(self.model_config)
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "model_name": self.model_name,
+            "model_config": self.model_config,
+            "state": self.state,
+            "priority": self.priority,
+            "bandwidth_limit": self.bandwidth.rate,
+            "result": self.result,
+            "error": self.error,
+            "host": self.host,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress.snapshot() if self.progress else None,
+            "details": self.details,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(
+            data["model_name"],
+            data["model_config"],
+            job_id=data["id"],
+            priority=data.get("priority", DEFAULT_PRIORITY),
+            bandwidth_limit=data.get("bandwidth_limit"),
+        )
+        job.state = data.get("state", QUEUED)
+        job.result = data.get("result")
+        job.error = data.get("error")
+        job.created_at = data.get("created_at", job.created_at)
+        job.started_at = data.get("started_at")
+        job.finished_at = data.get("finished_at")
+        job.details = data.get("details") or {}
+        return job
+
+
+class DownloadScheduler:
+    """
+    Runs download jobs in the background with a bounded worker pool.
+
+    At most max_concurrent jobs run at once, and at most max_per_host of
+    them (or the value in host_limits) talk to the same host. Job state is
+    persisted to state_path so the job list survives a restart; like the
+    other state files it is written by a StateFile, debounced and off the
+    event loop.
+
+    Each running job gets a ProgressTracker; on_progress(job, snapshot) is
+    called at most once per progress_interval seconds per job.
+
+    With resume_unfinished, jobs that were queued or running when the
+    previous process stopped are queued again; call start() once an event
+    loop is running to pick them up.
+
+    Cancelling a running job cancels its task. Work in a thread (e.g.
+    hf_hub_download) cannot be interrupted, so the job reports CANCELLING,
+    and keeps its worker slot, until the task has actually returned.
+
+    Pending jobs start in priority order (see PRIORITIES), oldest first
+    within a class. bandwidth_limit caps the combined throughput of all
+    jobs and each job may have its own cap on top; both can be changed
+    while downloads are running.
+    """
+
+    def __init__(self, runner, state_path, max_concurrent=2, max_per_host=2, host_limits=None, history_limit=200,
+                 on_progress=None, progress_interval=0.5, resume_unfinished=True, bandwidth_limit=None):
+        self.runner = runner
+        self.bandwidth = TokenBucket(bandwidth_limit)
+        self.resume_unfinished = resume_unfinished
+        self.state_path = state_path
+        self.state_file = get_state_file(state_path)
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_per_host = max(1, int(max_per_host))
+        self.host_limits = dict(host_limits or {})
+        self.history_limit = history_limit
+
+        self.jobs = {}
+        self._pending = []
+        self._active_per_host = {}
+        self._running = 0
+        self._tasks = {}
+        self._workers = []
+        self._wakeup = None
+        self._load_state()
+
+    def _load_state(self):
+        data = self.state_file.load()
+        if not isinstance(data, dict):
+            return
+
+        for item in data.get("jobs", []):
+            job = DownloadJob.from_dict(item)
+            job.throttle = Throttle(self.bandwidth, job.bandwidth)
+            if job.state == CANCELLING:
+                job.state = CANCELLED
+                job.finished_at = job.finished_at or time.time()
+            elif not job.finished:
+                # The process that owned this job is gone
+                if self.resume_unfinished:
+                    job.state = QUEUED
+                    job.started_at = None
+                    self._pending.append(job)
+                else:
+                    job.state = FAILED
+                    job.error = "Interrupted by restart"
+                    job.finished_at = time.time()
+            self.jobs[job.id] = job
+        self._pending.sort(key=lambda job: job.created_at)
+
+    def _save_state(self):
+        self.state_file.save({"jobs": [job.to_dict() for job in self.jobs.values()]})
+
+    def _prune_history(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        excess = len(finished) - self.history_limit
+        if excess > 0:
+            finished.sort(key=lambda job: job.finished_at or 0)
+            for job in finished[:excess]:
+                del self.jobs[job.id]
+
+    def _host_limit(self, host):
+        return max(1, int(self.host_limits.get(host, self.max_per_host)))
+
+    def _ensure_workers(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Condition()
+        started = len(self._workers)
+        while len(self._workers) < self.max_concurrent:
+            self._workers.append(asyncio.ensure_future(self._worker(len(self._workers))))
+        if len(self._workers) > started:
+            logger.info(f"Started {len(self._workers) - started} download workers")
+
+    def start(self):
+        """Start the worker pool; must be called from the event loop thread"""
+        self._ensure_workers()
+
+    async def _notify(self):
+        async with self._wakeup:
+            self._wakeup.notify_all()
+
+    async def configure(self, max_concurrent=None, max_per_host=None, host_limits=None, bandwidth_limit=None):
+        """Update limits in place; running jobs are not interrupted"""
+        if max_concurrent is not None:
+            self.max_concurrent = max(1, int(max_concurrent))
+        if max_per_host is not None:
+            self.max_per_host = max(1, int(max_per_host))
+        if host_limits is not None:
+            self.host_limits = dict(host_limits)
+        if bandwidth_limit is not None:
+            self.bandwidth.set_rate(bandwidth_limit)
+        if self._workers:
+            self._ensure_workers()
+            await self._notify()
+
+    async def update_job(self, job_id, priority=None, bandwidth_limit=None):
+        """Change a job's priority or bandwidth cap. Returns the job, or None if unknown."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if priority is not None:
+            if priority not in PRIORITIES:
+                raise ValueError(f"Unknown priority {priority!r}, expected one of {', '.join(PRIORITIES)}")
+            job.priority = priority
+        if bandwidth_limit is not None:
+            job.bandwidth.set_rate(bandwidth_limit)
+        self._save_state()
+        await self._notify()
+        return job
+
+    def find_active(self, model_config):
+        """The queued or running job for the same target, if any"""
+        key = job_key(model_config)
+        for job in self.jobs.values():
+            # A cancelling job is on its way out; a new download queues behind its file lock
+            if not job.finished and job.state != CANCELLING and job.key == key:
+                return job
+        return None
+
+    async def submit(self, model_name, model_config, priority=DEFAULT_PRIORITY, bandwidth_limit=None):
+        """
+        Queue a download and return its job without waiting for it. If the
+        same target is already queued or running, that job is returned,
+        promoted to priority if that is more urgent.
+        """
+        self._ensure_workers()
+        existing = self.find_active(model_config)
+        if existing is not None:
+            logger.info(f"{model_name} is already being downloaded by job {existing.id}")
+            if PRIORITIES.get(priority, 1) < PRIORITIES[existing.priority]:
+                existing.priority = priority
+                self._save_state()
+                await self._notify()
+            return existing
+        job = DownloadJob(model_name, model_config, priority=priority, bandwidth_limit=bandwidth_limit)
+        job.throttle = Throttle(self.bandwidth, job.bandwidth)
+        self.jobs[job.id] = job
+        self._pending.append(job)
+        self._prune_history()
+        self._save_state()
+        logger.info(f"Queued download job {job.id} for {model_name}")
+        await self._notify()
+        return job
+
+    async def wait(self, job_id):
+        """Wait until a job has finished and return it"""
+        while True:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            async with self._wakeup:
+                await self._wakeup.wait()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        return sorted(self.jobs.values(), key=lambda job: job.created_at)
+
+    def queue_depth(self):
+        return len(self._pending)
+
+    def active_jobs(self):
+        return [job for job in self.jobs.values() if job.state == RUNNING]
+
+    async def cancel(self, job_id):
+        """
+        Cancel a queued or running job. Returns False if it already finished.
+        A running job is CANCELLING until its task has returned.
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+
+        if job in self._pending:
+            self._pending.remove(job)
+            self._finish(job, CANCELLED, error="Cancelled")
+        else:
+            task = self._tasks.get(job.id)
+            if task is not None:
+                job.state = CANCELLING
+                self._save_state()
+                if job.progress is not None:
+                    job.progress.flush()
+                task.cancel()
+        await self._notify()
+        return True
+
+    def _finish(self, job, state, result=None, error=None):
+        job.state = state
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        self._save_state()
+        if job.progress is not None:
+            job.progress.flush()
+
+    def _emit_progress(self, job, snapshot):
+        if self.on_progress is not None:
+            try:
+                self.on_progress(job, snapshot)
+            except Exception as e:
+                logger.debug(f"Error reporting progress for job {job.id}: {e}")
+
+    def _next_job(self):
+        if self._running >= self.max_concurrent:
+            return None
+        for job in sorted(self._pending, key=lambda job: (PRIORITIES[job.priority], job.created_at)):
+            if self._active_per_host.get(job.host, 0) < self._host_limit(job.host):
+                self._pending.remove(job)
+                return job
+        return None
+
+    async def _worker(self, worker_id):
+        while True:
+            async with self._wakeup:
+                job = self._next_job()
+                while job is None:
+                    await self._wakeup.wait()
+                    job = self._next_job()
+
+            await self._run(job)
+            await self._notify()
+
+    async def _run(self, job):
+        host = job.host
+        self._active_per_host[host] = self._active_per_host.get(host, 0) + 1
+        self._running += 1
+        job.state = RUNNING
+        job.started_at = time.time()
+        job.progress = ProgressTracker(
+            emit=lambda snapshot: self._emit_progress(job, snapshot),
+            interval=self.progress_interval,
+        )
+        self._save_state()
+        job.progress.flush()
+        logger.info(f"Starting download job {job.id} for {job.model_name}")
+
+        task = asyncio.ensure_future(self.runner(job))
+        self._tasks[job.id] = task
+        try:
+            status = await task
+            if isinstance(status, str) and status.startswith("Error"):
+                self._finish(job, FAILED, result=status, error=status)
+            else:
+                self._finish(job, COMPLETED, result=status)
+        except asyncio.CancelledError:
+            self._finish(job, CANCELLED, error="Cancelled")
+        except Exception as e:
+            logger.error(f"Download job {job.id} failed: {e}", exc_info=True)
+            self._finish(job, FAILED, error=str(e))
+        finally:
+            self._tasks.pop(job.id, None)
+            self._active_per_host[host] -= 1
+            self._running -= 1
+            JOBS_FINISHED.inc(state=job.state)
+            if job.started_at and job.finished_at:
+                JOB_DURATION.observe(job.finished_at - job.started_at, state=job.state)
+            logger.info(f"Download job {job.id} finished: {job.state}")
@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+
+from .fsutil import write_json_atomic
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+
+class ChunkJournal:
+    """
+    Sidecar record of the byte ranges of a .part file that are on disk.
+
+    The journal is tied to the remote file by size and ETag; if either
+    changes, the partial data is discarded instead of being resumed.
+    Ranges are only recorded after their bytes have been fsynced, so a
+    crash can lose in-flight ranges but never marks missing data as done.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.size = None
+        self.etag = None
+        self.chunk_size = None
+        self.completed = set()
+
+    @classmethod
+    def for_part_file(cls, part_path):
+        return cls(f"{part_path}.journal")
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self, size, etag, chunk_size):
+        """Load an existing journal; returns False if it does not match the remote file"""
+        self.size, self.etag, self.chunk_size = size, etag, chunk_size
+        self.completed = set()
+        if not self.exists():
+            return False
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable download journal {self.path}: {e}")
+            return False
+
+        if data.get("size") != size or data.get("etag") != etag or data.get("chunk_size") != chunk_size:
+            logger.info(f"Remote file changed since {self.path} was written, restarting download")
+            return False
+        self.completed = {tuple(r) for r in data.get("completed", [])}
+        return True
+
+    def completed_bytes(self):
+        return sum(end - start + 1 for start, end in self.completed)
+
+    def mark_done(self, start, end):
+        self.completed.add((start, end))
+        self.save()
+
+    def save(self):
+        write_json_atomic(self.path, {
+            "size": self.size,
+            "etag": self.etag,
+            "chunk_size": self.chunk_size,
+            "completed": sorted(self.completed),
+        }, indent=None)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import logging
+import os
+
+from .fsutil import remove_empty_dirs
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+# Directory next to a download holding its lock file; .cache is skipped by directory scans
+LOCK_DIR = os.path.join(".cache", "hal-fun-downloader")
+
+
+class SingleFlight:
+    """
+    Running transfers of this process, keyed by what they fetch.
+
+    run() starts factory() for a new key, or attaches to the transfer that
+    is already running for it; every caller gets the same result or
+    exception. The transfer runs as its own task, so one caller being
+    cancelled does not cancel it for the others, only the last caller
+    leaving does. A cancelled transfer may take a while to wind down (see
+    ModelFetcher._run_with_progress); later callers start a new one rather
+    than attaching to it.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    async def run(self, key, factory):
+        """(result, leader): leader is False for callers that attached to a running transfer"""
+        # Tasks belong to one loop; callers from another loop (e.g. asyncio.run in a thread) never share them
+        key = (asyncio.get_running_loop(), key)
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = {"task": asyncio.ensure_future(factory()), "waiters": 0}
+            self._flights[key] = flight
+
+            def forget(_):
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+            flight["task"].add_done_callback(forget)
+        flight["waiters"] += 1
+        try:
+            return await asyncio.shield(flight["task"]), leader
+        except asyncio.CancelledError:
+            if flight["waiters"] == 1 and not flight["task"].done():
+                flight["task"].cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            raise
+        finally:
+            flight["waiters"] -= 1
+
+
+def _try_lock(fd):
+    """Take an exclusive lock on fd without blocking; False if another holder has it"""
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        import msvcrt
+
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _unlock(fd):
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        return
+    fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _is_open_file(fd, path):
+    try:
+        return os.path.samestat(os.fstat(fd), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+class FileLock:
+    """
+    Exclusive lock on a download target shared by processes, e.g. several
+    ComfyUI instances using one models directory.
+
+    The lock file lives in .cache/ next to the target. The holder removes
+    it, and the .cache directories once empty, before releasing the lock; a
+    waiter that then gets the lock on the removed file opens it again.
+    Waiting polls without blocking the event loop. Locks are per open file,
+    so two downloads in one process exclude each other too.
+    """
+
+    def __init__(self, target, poll_interval=0.5):
+        directory, name = os.path.split(os.path.abspath(target))
+        # Long names would exceed NAME_MAX with a suffix, so those are hashed
+        if len(name) > 200:
+            name = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        self.path = os.path.join(directory, LOCK_DIR, f"{name}.lock")
+        self.directory = directory
+        self.target = target
+        self.poll_interval = poll_interval
+        self._fd = None
+
+    async def acquire(self):
+        """Wait for the lock; returns True if another holder had to finish first"""
+        waited = False
+        while True:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            except FileNotFoundError:
+                # The directory was removed by a holder releasing its lock
+                continue
+            try:
+                while not _try_lock(fd):
+                    if not waited:
+                        logger.info(f"Waiting for another process downloading {os.path.basename(self.target)}")
+                        waited = True
+                    await asyncio.sleep(self.poll_interval)
+                if _is_open_file(fd, self.path):
+                    self._fd = fd
+                    return waited
+            except BaseException:
+                os.close(fd)
+                raise
+            # Locked a file the previous holder had already removed
+            os.close(fd)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            try:
+                os.remove(self.path)
+            except OSError:
+                # Windows cannot remove an open file; it is reused next time
+                pass
+            _unlock(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+            remove_empty_dirs(os.path.dirname(self.path), self.directory)
+
+    async def __aenter__(self):
+        return await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
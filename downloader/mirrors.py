@@ -0,0 +1,150 @@
+import asyncio
+import hmac
+import logging
+import os
+import uuid
+
+import aiohttp
+
+from .access import resolve_url
+from .blobs import BlobStore, link_or_copy
+from .chunked import RangeDownloadError
+from .integrity import IntegrityError, as_sha256, check_digest, git_blob_sha1, hash_file
+from .journal import ChunkJournal
+from .metrics import CACHE_REQUESTS
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+MIRROR_TYPES = ("http", "path", "peer")
+
+
+def parse_mirror(mirror):
+    """
+    Normalize a mirror setting. Accepts {"type": ..., "url"/"path": ...}
+    dicts, or plain strings: an http(s) URL is a peer ComfyUI worker, anything
+    else a blob store directory (e.g. on NFS).
+    """
+    if isinstance(mirror, str):
+        if mirror.startswith(("http://", "https://")):
+            return {"type": "peer", "url": mirror.rstrip("/")}
+        return {"type": "path", "path": mirror}
+    mirror = dict(mirror)
+    if mirror.get("type") not in MIRROR_TYPES:
+        raise ValueError(f"Unknown mirror type {mirror.get('type')!r}, expected one of {', '.join(MIRROR_TYPES)}")
+    if "url" in mirror:
+        mirror["url"] = mirror["url"].rstrip("/")
+    return mirror
+
+
+def peer_authorized(authorization, token):
+    """Whether an Authorization header carries the blob_token; nothing is authorized without a token"""
+    if not token or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {token}".encode("utf-8"))
+
+
+def describe(mirror):
+    return mirror.get("url") or mirror.get("path")
+
+
+def _verify(path, key, expected_sha256):
+    """Hash a file that came from a mirror; a mirror is never trusted without a hash"""
+    if expected_sha256:
+        check_digest(hash_file(path), expected_sha256, path)
+        return expected_sha256
+    check_digest(git_blob_sha1(path), key, path)
+    return None
+
+
+def _discard_partial(dest):
+    """Drop what a failed mirror left behind so the Hub download starts clean"""
+    part_path = f"{dest}.part"
+    try:
+        os.remove(part_path)
+    except FileNotFoundError:
+        pass
+    ChunkJournal.for_part_file(part_path).remove()
+
+
+class MirrorFetcher:
+    """
+    Tries to fetch a file from nearby copies before going to the Hub.
+
+    Mirrors are tried in order:
+      - "path": a blob store directory shared over NFS or similar
+      - "peer": another ComfyUI worker, via its /hal-fun-downloader/blobs/{key} route,
+        authenticated with the mirror's "token" or else token (blob_token)
+      - "http": a Hub-compatible cache server ({url}/{repo}/resolve/{revision}/{path})
+
+    Files are looked up by their blob key (LFS sha256, or git sha1 for
+    small files) and always hashed against it, so a stale or corrupt
+    mirror can only cause a fallback, never a bad file.
+    """
+
+    def __init__(self, mirrors, downloader, token=None):
+        self.mirrors = [parse_mirror(mirror) for mirror in mirrors or []]
+        self.downloader = downloader
+        self.token = token
+
+    async def fetch(self, dest, key, repo_id, path, revision=None, progress=None, throttle=None):
+        """Fetch into dest from the first mirror that has it; returns the mirror used, or None"""
+        expected_sha256 = as_sha256(key)
+        if not key or not self.mirrors:
+            return None
+        for mirror in self.mirrors:
+            try:
+                if mirror["type"] == "path":
+                    found = await self._fetch_path(mirror, key, dest, expected_sha256, progress)
+                else:
+                    headers = None
+                    if mirror["type"] == "peer":
+                        url = f"{mirror['url']}/hal-fun-downloader/blobs/{key}"
+                        token = mirror.get("token") or self.token
+                        headers = {"Authorization": f"Bearer {token}"} if token else None
+                    else:
+                        url = resolve_url(repo_id, path, revision, endpoint=mirror["url"])
+                    found = await self._fetch_url(url, key, dest, expected_sha256, progress, throttle, headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RangeDownloadError, IntegrityError, OSError) as e:
+                logger.warning(f"Mirror {describe(mirror)} failed for {key[:12]}: {e}")
+                await asyncio.to_thread(_discard_partial, dest)
+                continue
+            if found:
+                logger.info(f"Fetched {os.path.basename(dest)} from mirror {describe(mirror)}")
+                CACHE_REQUESTS.inc(cache="mirror", result="hit")
+                return describe(mirror)
+        CACHE_REQUESTS.inc(cache="mirror", result="miss")
+        return None
+
+    async def _fetch_path(self, mirror, key, dest, expected_sha256, progress):
+        source = BlobStore(mirror["path"]).blob_path(key)
+        if not os.path.isfile(source):
+            return False
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        tmp_path = f"{dest}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            await asyncio.to_thread(link_or_copy, source, tmp_path)
+            await asyncio.to_thread(_verify, tmp_path, key, expected_sha256)
+            os.replace(tmp_path, dest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if progress is not None:
+            progress.set_done(os.path.getsize(dest))
+        return True
+
+    async def _fetch_url(self, url, key, dest, expected_sha256, progress, throttle, headers=None):
+        try:
+            await self.downloader.download(
+                url, dest, headers=headers, progress=progress, expected_sha256=expected_sha256, throttle=throttle
+            )
+        except aiohttp.ClientResponseError as e:
+            if e.status == 404:
+                return False
+            raise
+        if not expected_sha256:
+            try:
+                await asyncio.to_thread(_verify, dest, key, None)
+            except IntegrityError:
+                os.remove(dest)
+                raise
+        return True
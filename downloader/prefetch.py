@@ -0,0 +1,78 @@
+import logging
+import os
+
+from .catalog import is_repo_entry, model_folder, model_key
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+# Loader node inputs that name a model file, and the models/ folders they read from
+LOADER_INPUTS = {
+    "ckpt_name": ("checkpoints",),
+    "lora_name": ("loras",),
+    "vae_name": ("vae",),
+    "unet_name": ("unet", "diffusion_models"),
+    "clip_name": ("clip", "text_encoders", "clip_vision"),
+    "clip_name1": ("clip", "text_encoders"),
+    "clip_name2": ("clip", "text_encoders"),
+    "clip_name3": ("clip", "text_encoders"),
+    "control_net_name": ("controlnet",),
+    "ipadapter_file": ("ipadapter",),
+    "style_model_name": ("style_models",),
+    "upscale_model": ("upscale_models",),
+    "gligen_name": ("gligen",),
+    "model_name": None,
+}
+
+MODEL_EXTENSIONS = (".safetensors", ".ckpt", ".pt", ".pth", ".bin", ".gguf", ".sft", ".onnx")
+
+
+def referenced_models(prompt):
+    """
+    (input_name, value) for every loader input in an API-format prompt that
+    names a model file. Links to other nodes ([node_id, slot]) are skipped.
+    """
+    found = []
+    for node in (prompt or {}).values():
+        if not isinstance(node, dict):
+            continue
+        for name, value in (node.get("inputs") or {}).items():
+            if name not in LOADER_INPUTS or not isinstance(value, str):
+                continue
+            if value.lower().endswith(MODEL_EXTENSIONS):
+                found.append((name, value))
+    return found
+
+
+def match_entries(catalog, references):
+    """
+    Catalog entries for the files referenced by a prompt. ComfyUI names files
+    relative to their models/ folder, possibly with a subdirectory, so they
+    are matched on the file name and then narrowed down by folder and path.
+    """
+    matched = []
+    for input_name, value in references:
+        value = value.replace("\\", "/")
+        basename = os.path.basename(value)
+        # Only the on-disk name counts; the Hub filename is often a generic "model.safetensors"
+        candidates = [
+            entry for entry in catalog.candidates(basename)
+            if not is_repo_entry(entry) and model_key(entry) == basename
+        ]
+        folders = LOADER_INPUTS.get(input_name)
+        if folders:
+            candidates = [entry for entry in candidates if model_folder(entry) in folders] or candidates
+        exact = [entry for entry in candidates if entry.get("local_path", "").replace("\\", "/").endswith(value)]
+        for entry in exact or candidates[:1]:
+            if not any(entry is seen for seen in matched):
+                matched.append(entry)
+    return matched
+
+
+def missing_models(catalog, prompt):
+    """Catalog entries a prompt needs that are not downloaded yet"""
+    status = catalog.status()
+    entries = match_entries(catalog, referenced_models(prompt))
+    missing = [entry for entry in entries if not status.get(model_key(entry), {}).get("downloaded")]
+    if missing:
+        logger.debug(f"Prompt references {len(entries)} catalog models, {len(missing)} missing")
+    return missing
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import threading
+import time
+
+
+class ProgressTracker:
+    """
+    Thread-safe byte counter for a single job.
+
+    update()/set_done() may be called from download threads. The emit
+    callback receives a snapshot at most once per interval, so callers can
+    report every chunk without flooding the websocket.
+    """
+
+    def __init__(self, total=None, emit=None, interval=0.5, smoothing=0.3):
+        self.total = total
+        self.bytes_done = 0
+        self.speed = 0.0
+        self.emit = emit
+        self.interval = interval
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._last_sample = (self._started_at, 0)
+        self._last_emit = 0.0
+
+    def set_total(self, total):
+        with self._lock:
+            self.total = total
+        self._maybe_emit()
+
+    def update(self, nbytes):
+        with self._lock:
+            self.bytes_done += nbytes
+        self._maybe_emit()
+
+    def set_done(self, bytes_done):
+        with self._lock:
+            self.bytes_done = bytes_done
+        self._maybe_emit()
+
+    def _sample_speed(self, now):
+        last_time, last_bytes = self._last_sample
+        elapsed = now - last_time
+        if elapsed <= 0:
+            return
+        current = max(0, self.bytes_done - last_bytes) / elapsed
+        if self.speed:
+            self.speed = self.smoothing * current + (1 - self.smoothing) * self.speed
+        else:
+            self.speed = current
+        self._last_sample = (now, self.bytes_done)
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sample[0] >= self.interval:
+                self._sample_speed(now)
+            eta = None
+            if self.total and self.speed > 0:
+                eta = max(0.0, (self.total - self.bytes_done) / self.speed)
+            return {
+                "bytes_done": self.bytes_done,
+                "total": self.total,
+                "speed": round(self.speed, 1),
+                "eta": round(eta, 1) if eta is not None else None,
+                "elapsed": round(now - self._started_at, 1),
+            }
+
+    def _maybe_emit(self, force=False):
+        if self.emit is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_emit < self.interval:
+                return
+            self._last_emit = now
+        self.emit(self.snapshot())
+
+    def flush(self):
+        """Emit the current state regardless of the rate limit"""
+        self._maybe_emit(force=True)
+
+
+class FileProgress:
+    """
+    Progress of one file inside a multi-file job.
+
+    Has the same update()/set_total()/set_done() interface as
+    ProgressTracker, so a download engine can report into it directly.
+    Bytes are forwarded to the job's tracker and also recorded in state,
+    a dict that is exposed as per-file progress.
+    """
+
+    def __init__(self, parent, state):
+        self.parent = parent
+        self.state = state
+        self._lock = threading.Lock()
+        self.state.setdefault("bytes_done", 0)
+
+    def set_total(self, total):
+        self.state["size"] = total
+
+    def update(self, nbytes):
+        with self._lock:
+            self.state["bytes_done"] += nbytes
+        if self.parent is not None:
+            self.parent.update(nbytes)
+
+    def set_done(self, bytes_done):
+        with self._lock:
+            delta = bytes_done - self.state["bytes_done"]
+            self.state["bytes_done"] = bytes_done
+        if self.parent is not None and delta:
+            self.parent.update(delta)
+
+
+def _incomplete_bytes(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(".incomplete"):
+                try:
+                    total += os.stat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+    return total
+
+
+async def watch_download_dir(tracker, local_dir, interval=1.0):
+    """
+    Feed tracker from the files huggingface_hub writes while downloading.
+
+    hf_hub_download does not report progress to callers, but it streams
+    into *.incomplete files under local_dir, so a cheap periodic stat of
+    those files gives bytes done.
+    """
+    cache_dir = os.path.join(local_dir, ".cache", "huggingface")
+    while True:
+        done = await asyncio.to_thread(_incomplete_bytes, cache_dir)
+        tracker.set_done(done)
+        await asyncio.sleep(interval)
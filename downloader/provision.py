@@ -0,0 +1,375 @@
+import asyncio
+import json
+import logging
+import os
+import posixpath
+import re
+import tempfile
+import time
+import uuid
+
+from .blobs import link_or_copy
+from .catalog import is_repo_entry, resolve_path
+from .errors import INTEGRITY, classify, describe
+from .fetcher import SOURCE_BLOB_STORE, SOURCE_HUB, SOURCE_LOCAL, SOURCE_MIRROR
+from .integrity import as_sha256, verify_files
+from .snapshot import entry_patterns, remote_manifest
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+LOCKFILE_VERSION = 1
+
+# Keys kept when an entry is locked; the rest of a catalog entry (names, licenses, UI hints) is dropped
+LOCK_FIELDS = ("repo_id", "revision", "subfolder", "filename", "sha256", "size", "local_path", "allow_patterns", "ignore_patterns")
+
+_COMMIT_RE = re.compile(r"^[0-9a-f]{40}$")
+
+# Item states in a provisioning report
+PRESENT = "present"
+MISSING = "missing"
+DOWNLOADED = "downloaded"
+LINKED = "linked"
+FAILED = "failed"
+
+# States of a ProvisioningRun
+RUN_RUNNING = "running"
+RUN_FINISHED = "finished"
+RUN_FAILED = "failed"
+
+OUTCOMES = {
+    SOURCE_LOCAL: PRESENT,
+    SOURCE_BLOB_STORE: LINKED,
+    SOURCE_MIRROR: DOWNLOADED,
+    SOURCE_HUB: DOWNLOADED,
+}
+
+
+class LockfileError(ValueError):
+    pass
+
+
+def entry_problems(entry, strict=True):
+    """Reasons a lock file entry cannot be provisioned reproducibly"""
+    if not isinstance(entry, dict):
+        return ["not an object"]
+    problems = []
+    if not entry.get("repo_id"):
+        problems.append("missing repo_id")
+    local_path = entry.get("local_path")
+    if not local_path:
+        problems.append("missing local_path")
+    elif not os.path.isabs(local_path) and ".." in posixpath.normpath(local_path.replace("\\", "/")).split("/"):
+        problems.append(f"local_path {local_path!r} leaves the models directory")
+    if entry.get("sha256") and not as_sha256(entry["sha256"]):
+        problems.append(f"sha256 {entry['sha256']!r} is not a sha256 hex digest")
+    if strict:
+        if not _COMMIT_RE.match(entry.get("revision") or ""):
+            problems.append(f"revision {entry.get('revision')!r} is not a full commit hash")
+        if entry.get("filename") and not entry.get("sha256"):
+            problems.append("missing sha256")
+    return problems
+
+
+def parse_lockfile(data, strict=True):
+    """
+    Entries of a lock file: {"version": 1, "models": [...]} or a bare list.
+    Each entry is a model_config.json entry pinned to a commit and, for
+    single files, a sha256. With strict=False floating revisions and
+    missing hashes are accepted.
+    """
+    if isinstance(data, dict):
+        if data.get("version", LOCKFILE_VERSION) != LOCKFILE_VERSION:
+            raise LockfileError(f"Unsupported lock file version {data.get('version')!r}, expected {LOCKFILE_VERSION}")
+        models = data.get("models")
+    else:
+        models = data
+    if not isinstance(models, list):
+        raise LockfileError("Lock file must contain a list of models")
+    problems = [f"models[{i}]: {problem}" for i, entry in enumerate(models) for problem in entry_problems(entry, strict)]
+    if problems:
+        raise LockfileError("Invalid lock file:\n  " + "\n  ".join(problems))
+    return models
+
+
+def read_lockfile(path, strict=True):
+    with open(path, "r") as f:
+        return parse_lockfile(json.load(f), strict)
+
+
+def source_key(entry):
+    """What an entry downloads; single files with equal keys have equal bytes"""
+    sha256 = as_sha256(entry.get("sha256"))
+    if sha256 and not is_repo_entry(entry):
+        return sha256
+    fields = {key: entry.get(key) for key in LOCK_FIELDS if key not in ("local_path", "size")}
+    return json.dumps(fields, sort_keys=True)
+
+
+def _item(entry, path):
+    return {
+        "repo_id": entry["repo_id"],
+        "revision": entry.get("revision"),
+        "subfolder": entry.get("subfolder", ""),
+        "filename": entry.get("filename"),
+        "sha256": as_sha256(entry.get("sha256")),
+        "local_path": entry["local_path"],
+        "path": path,
+        "status": None,
+        "message": None,
+    }
+
+
+def plan_provisioning(entries, models_dir, resolve=None):
+    """
+    Group lock file entries into downloads. Destinations are resolved
+    against models_dir, or by resolve(entry) if given.
+
+    Entries with the same destination and source are duplicates and
+    dropped; the same destination with different sources is an error.
+    Single files with the same sha256 (or repo, revision and path) are
+    downloaded once and linked to their other destinations afterwards.
+    Returns {"downloads": [{"entry", "path", "item", "copies"}], "duplicates": n}.
+    """
+    by_path = {}
+    by_source = {}
+    downloads = []
+    duplicates = 0
+    for index, entry in enumerate(entries):
+        path = (resolve(entry) if resolve is not None else resolve_path(entry, models_dir)).rstrip("/")
+        key = source_key(entry)
+        if path in by_path:
+            if by_path[path] != key:
+                raise LockfileError(f"models[{index}]: {path} is already the destination of a different model")
+            duplicates += 1
+            continue
+        by_path[path] = key
+
+        group = by_source.get(key)
+        if group is not None and not is_repo_entry(entry):
+            group["copies"].append({"entry": entry, "path": path, "item": _item(entry, path)})
+            continue
+        group = {"entry": entry, "path": path, "item": _item(entry, path), "copies": []}
+        by_source[key] = group
+        downloads.append(group)
+    return {"downloads": downloads, "duplicates": duplicates}
+
+
+def _exists(entry, path):
+    return os.path.isdir(path) if is_repo_entry(entry) else os.path.isfile(path)
+
+
+def _place_copy(source, dest):
+    """Link a finished download to a second destination, replacing a stale file"""
+    if os.path.isfile(dest) and os.path.getsize(dest) == os.path.getsize(source):
+        return None
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp_path = f"{dest}.provision.tmp"
+    try:
+        method = link_or_copy(source, tmp_path)
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return method
+
+
+async def provision(plan, run, concurrency=4, dry_run=False, verify=False, verify_workers=4):
+    """
+    Carry out a plan from plan_provisioning() and return a report.
+
+    run(entry, path, details) downloads one entry and returns its status
+    string (failures start with "Error"), filling details with what the
+    download reported. At most concurrency downloads run at once. With
+    verify, files that were already present or linked are hashed against
+    their sha256 too; fresh downloads are verified while streaming.
+    """
+    started_at = time.time()
+    downloads = plan["downloads"]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_group(group):
+        item = group["item"]
+        async with semaphore:
+            started = time.monotonic()
+            details = {}
+            try:
+                status = await run(group["entry"], group["path"], details)
+            except Exception as e:
+                details["error_kind"] = classify(e)
+                status = f"Error downloading {group['entry'].get('filename') or group['entry']['repo_id']}: {describe(e)}"
+            item["seconds"] = round(time.monotonic() - started, 3)
+        item["message"] = status
+        if details.get("job_id"):
+            item["job_id"] = details["job_id"]
+        if isinstance(status, str) and status.startswith("Error"):
+            item["status"] = FAILED
+            item["error_kind"] = details.get("error_kind")
+        else:
+            item["status"] = OUTCOMES.get(details.get("source"), DOWNLOADED)
+            item["size"] = details.get("size")
+            if details.get("commit"):
+                item["commit"] = details["commit"]
+            if details.get("sha256"):
+                item["verified"] = details["sha256"]["verified"]
+        logger.info(f"{item['local_path']}: {item['status']}")
+
+        for copy in group["copies"]:
+            copy_item = copy["item"]
+            if item["status"] == FAILED:
+                copy_item.update(status=FAILED, message=f"Not linked, {item['local_path']} failed", error_kind=item.get("error_kind"))
+                continue
+            try:
+                method = await asyncio.to_thread(_place_copy, group["path"], copy["path"])
+                if method is None:
+                    copy_item.update(status=PRESENT, message=f"File already exists at {copy['path']}")
+                else:
+                    copy_item.update(status=LINKED, message=f"Linked from {group['path']} ({method})")
+                copy_item["size"] = item.get("size")
+            except Exception as e:
+                copy_item.update(status=FAILED, message=str(e), error_kind=classify(e))
+
+    if dry_run:
+        for group in downloads:
+            for target in [group] + group["copies"]:
+                target["item"]["status"] = PRESENT if _exists(target["entry"], target["path"]) else MISSING
+    else:
+        await asyncio.gather(*(run_group(group) for group in downloads))
+
+    items = plan_items(plan)
+    if verify and not dry_run:
+        await _verify_items(items, verify_workers)
+
+    counts = {}
+    for item in items:
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+    finished_at = time.time()
+    return {
+        "version": LOCKFILE_VERSION,
+        "ok": FAILED not in counts,
+        "dry_run": dry_run,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "duration_seconds": round(finished_at - started_at, 3),
+        "summary": {
+            "total": len(items),
+            "duplicates": plan["duplicates"],
+            "bytes_downloaded": sum(item.get("size") or 0 for item in items if item["status"] == DOWNLOADED),
+            **counts,
+        },
+        "items": items,
+    }
+
+
+def plan_items(plan):
+    """Report items of a plan, in report order; provision() fills them in as it goes"""
+    return [target["item"] for group in plan["downloads"] for target in [group] + group["copies"]]
+
+
+class ProvisioningRun:
+    """
+    A provision() call running in the background, so an API request can
+    return the plan at once and the report can be fetched later.
+    """
+
+    def __init__(self, plan):
+        self.id = uuid.uuid4().hex[:12]
+        self.plan = plan
+        self.state = RUN_RUNNING
+        self.report = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._task = None
+
+    @property
+    def finished(self):
+        return self.state != RUN_RUNNING
+
+    def start(self, run, **options):
+        """Start provision(plan, run, **options); must be called from the event loop"""
+        self._task = asyncio.ensure_future(self._provision(run, options))
+        return self
+
+    async def _provision(self, run, options):
+        try:
+            self.report = await provision(self.plan, run, **options)
+            self.state = RUN_FINISHED
+        except Exception as e:
+            logger.error(f"Provisioning run {self.id} failed: {e}", exc_info=True)
+            self.error = str(e)
+            self.state = RUN_FAILED
+        self.finished_at = time.time()
+
+    async def wait(self):
+        """Wait for the run to finish; cancelling the waiter does not cancel the run"""
+        await asyncio.shield(self._task)
+        return self
+
+    def to_dict(self):
+        data = {
+            "id": self.id,
+            "state": self.state,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+        if self.report is not None:
+            data["report"] = self.report
+        else:
+            data["items"] = plan_items(self.plan)
+        return data
+
+
+async def _verify_items(items, workers):
+    """Hash present and linked files; downloads were already checked while streaming"""
+    targets = [item for item in items if item["status"] in (PRESENT, LINKED) and item["filename"] and item["sha256"]]
+    results = await asyncio.to_thread(verify_files, [(item["path"], item["sha256"]) for item in targets], workers)
+    for item, result in zip(targets, results):
+        item["verified"] = result["verified"]
+        if result["error"] or not result["verified"]:
+            item.update(
+                status=FAILED,
+                error_kind=INTEGRITY,
+                message=result["error"] or f"sha256 mismatch for {item['path']}: expected {item['sha256']}, got {result['actual']}",
+            )
+
+
+async def lock_entries(fetcher, entries, token=None):
+    """
+    Pin entries (e.g. from model_config.json) to the commit their revision
+    points at now, with each single file's sha256. Small files have no LFS
+    sha256 on the Hub, so they are downloaded once and hashed.
+    """
+    locked = []
+    for entry in entries:
+        pinned = {key: entry[key] for key in LOCK_FIELDS if entry.get(key) not in (None, "", [])}
+        if is_repo_entry(entry):
+            allow_patterns, ignore_patterns = entry_patterns(entry)
+            commit, _ = await asyncio.to_thread(
+                remote_manifest, entry["repo_id"], entry.get("revision"), token, allow_patterns, ignore_patterns
+            )
+            pinned["revision"] = commit
+        else:
+            metadata = await asyncio.to_thread(
+                fetcher.file_metadata, entry["repo_id"], entry.get("subfolder", ""), entry["filename"], token, entry.get("revision")
+            )
+            if metadata is None or not metadata.commit_hash:
+                raise LockfileError(f"Could not resolve {entry['repo_id']}/{entry['filename']} on the Hub")
+            pinned["revision"] = metadata.commit_hash
+            pinned["size"] = metadata.size
+            pinned["sha256"] = as_sha256(metadata.etag) or await _hash_remote(fetcher, entry, metadata.commit_hash, token)
+        locked.append({key: pinned[key] for key in LOCK_FIELDS if key in pinned})
+        logger.info(f"Locked {entry['local_path']} at {pinned['revision'][:12]}")
+    return {"version": LOCKFILE_VERSION, "models": locked}
+
+
+async def _hash_remote(fetcher, entry, revision, token):
+    from huggingface_hub import hf_hub_url
+    from huggingface_hub.utils import build_hf_headers
+
+    url = hf_hub_url(entry["repo_id"], entry["filename"], subfolder=entry.get("subfolder") or None, revision=revision)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        _, digest = await fetcher.chunked.download(
+            url, os.path.join(tmp_dir, os.path.basename(entry["filename"])), headers=build_hf_headers(token=token)
+        )
+    return digest
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from .errors import RETRY_LIMITS, RETRYABLE, TRANSIENT, DownloadError, classify, retry_after
+from .metrics import CIRCUIT_OPENED, RETRIES
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: attempt n waits uniform(0, min(max_delay, base_delay * 2**n))"""
+
+    def __init__(self, attempts=5, base_delay=1.0, max_delay=60.0):
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, hint=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if hint:
+            # A server's Retry-After (or an open circuit) is a lower bound
+            delay = max(delay, min(hint, self.max_delay))
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+
+    After threshold consecutive transient failures against a host the
+    circuit opens and requests fail immediately for reset_after seconds.
+    Then a single trial request is let through (half-open); its success
+    closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, threshold=5, reset_after=60.0):
+        self.threshold = max(1, int(threshold))
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._failures = {}
+        self._opened_at = {}
+        self._trial = {}
+
+    def before_request(self, host):
+        """Raise DownloadError if the circuit for host is open"""
+        with self._lock:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return
+            now = time.monotonic()
+            remaining = opened_at + self.reset_after - now
+            # One trial at a time; a trial that never reported back (e.g. cancelled) expires
+            if remaining <= 0 and now - self._trial.get(host, 0) > self.reset_after:
+                self._trial[host] = now
+                return
+            raise DownloadError(
+                TRANSIENT,
+                f"{host} is failing, requests paused for {max(0, round(remaining))}s",
+                retry_after=max(remaining, 1.0),
+            )
+
+    def record_success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._trial.pop(host, None)
+
+    def record_failure(self, host):
+        with self._lock:
+            self._trial.pop(host, None)
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if failures >= self.threshold:
+                if host not in self._opened_at:
+                    logger.warning(f"Opening circuit for {host} after {failures} consecutive failures")
+                    CIRCUIT_OPENED.inc(host=host)
+                self._opened_at[host] = time.monotonic()
+
+    def open_hosts(self):
+        with self._lock:
+            now = time.monotonic()
+            return [host for host, opened_at in self._opened_at.items() if now - opened_at < self.reset_after]
+
+
+async def retry_call(func, policy, breaker=None, host=None, description="request"):
+    """
+    Await func() until it succeeds, retrying transient failures with backoff.
+
+    Only failures classified as retryable are retried; auth, gated,
+    not-found and disk errors are raised straight away. Transient failures
+    count against host's circuit breaker.
+    """
+    retries = {}
+    for attempt in range(policy.attempts):
+        try:
+            if breaker is not None and host:
+                breaker.before_request(host)
+            result = await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            kind = classify(e)
+            if breaker is not None and host and not isinstance(e, DownloadError):
+                # Any answer other than a transient failure means the host itself is up
+                if kind == TRANSIENT:
+                    breaker.record_failure(host)
+                else:
+                    breaker.record_success(host)
+            if kind not in RETRYABLE or attempt + 1 >= policy.attempts:
+                raise
+            retries[kind] = retries.get(kind, 0) + 1
+            if retries[kind] > RETRY_LIMITS.get(kind, policy.attempts):
+                raise
+            delay = policy.delay(attempt, retry_after(e))
+            RETRIES.inc(kind=kind)
+            logger.warning(f"{description} failed ({kind}: {e}), retry {attempt + 1}/{policy.attempts - 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        else:
+            if breaker is not None and host:
+                breaker.record_success(host)
+            return result
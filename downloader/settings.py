@@ -0,0 +1,66 @@
+import json
+
+# Defaults for user/default/hal.fun-downloader/settings.json, also read by the provisioning CLI
+DEFAULT_SETTINGS = {
+    "max_concurrent_downloads": 2,
+    "max_downloads_per_host": 2,
+    "host_limits": {},
+    "progress_interval": 0.5,
+    # "hub" uses hf_hub_download, "chunked" uses parallel range requests
+    "download_engine": "hub",
+    "connections_per_file": 8,
+    "chunk_size_mb": 64,
+    "resume_jobs_on_startup": True,
+    "status_poll_interval": 10,
+    # Content-addressed store; defaults to models/.hf-blobs so hardlinks stay on one filesystem
+    "blob_store": True,
+    "blob_store_dir": None,
+    # Check sha256 against model_config.json or the Hub's LFS metadata
+    "verify_downloads": True,
+    "verify_workers": 4,
+    # Gated-model access checks (HEAD requests only)
+    "license_cache_ttl": 3600,
+    "probe_concurrency": 16,
+    # Sizes, hashes and latest commits from the Hub API, revalidated after this many seconds
+    "hub_metadata_ttl": 3600,
+    # Read the header of each downloaded safetensors file into a local index
+    "index_safetensors": True,
+    # Bytes per second shared by all downloads; null for unlimited
+    "bandwidth_limit": None,
+    # Start downloading catalog models referenced by a prompt as soon as it is queued
+    "prefetch_on_prompt": True,
+    "prefetch_priority": "prompt",
+    # Files fetched at once for full-repository entries
+    "snapshot_workers": 4,
+    # Tried in order before the Hub: blob store paths, peer ComfyUI URLs or {"type": "http", "url": ...} caches
+    "mirrors": [],
+    # Let other workers fetch from this blob store via GET /hal-fun-downloader/blobs/{key}.
+    # Off by default, and only served to requests carrying blob_token, which peers send too
+    "serve_blobs": False,
+    "blob_token": None,
+    # Space that must stay free on the models volume, and an optional cap on catalog models
+    "min_free_space_gb": 5,
+    "storage_quota_gb": None,
+    # Delete least recently used models when a download does not fit
+    "auto_evict": False,
+    "pinned_models": [],
+    # Transient failures (connection errors, 429/5xx) are retried, resuming partial files
+    "retry_attempts": 5,
+    "retry_base_delay": 1.0,
+    "retry_max_delay": 60.0,
+    # Consecutive transient failures before requests to a host pause, and for how long
+    "circuit_breaker_threshold": 5,
+    "circuit_breaker_reset": 60.0,
+}
+
+
+def read_settings(path):
+    """DEFAULT_SETTINGS updated with a settings.json file, if it exists"""
+    settings = dict(DEFAULT_SETTINGS)
+    if path:
+        try:
+            with open(path, "r") as f:
+                settings.update(json.load(f))
+        except FileNotFoundError:
+            pass
+    return settings
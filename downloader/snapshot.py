@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+
+from .fsutil import write_json_atomic
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+# Written into the snapshot directory; records what was downloaded from which commit
+MANIFEST_NAME = ".hf-manifest.json"
+
+
+def entry_patterns(entry):
+    """allow_patterns / ignore_patterns for a repo entry; a subfolder limits the snapshot to it"""
+    allow = entry.get("allow_patterns")
+    ignore = entry.get("ignore_patterns")
+    if isinstance(allow, str):
+        allow = [allow]
+    if isinstance(ignore, str):
+        ignore = [ignore]
+    subfolder = (entry.get("subfolder") or "").strip("/")
+    if not allow and subfolder:
+        allow = [f"{subfolder}/*"]
+    return allow or None, ignore or None
+
+
+def _file_etag(sibling):
+    lfs = getattr(sibling, "lfs", None)
+    if lfs:
+        sha256 = lfs.get("sha256") if isinstance(lfs, dict) else getattr(lfs, "sha256", None)
+        if sha256:
+            return sha256
+    return getattr(sibling, "blob_id", None)
+
+
+def remote_manifest(repo_id, revision=None, token=None, allow_patterns=None, ignore_patterns=None):
+    """
+    (commit, files) for a repository at revision, where files maps each
+    path that passes the patterns to {"size", "etag"}. The etag is the LFS
+    sha256 for large files and the git blob id otherwise.
+    """
+    from huggingface_hub import HfApi
+    from huggingface_hub.utils import filter_repo_objects
+
+    info = HfApi().model_info(repo_id, revision=revision, files_metadata=True, token=token)
+    siblings = filter_repo_objects(
+        info.siblings or [],
+        allow_patterns=allow_patterns,
+        ignore_patterns=ignore_patterns,
+        key=lambda sibling: sibling.rfilename,
+    )
+    files = {sibling.rfilename: {"size": sibling.size, "etag": _file_etag(sibling)} for sibling in siblings}
+    return info.sha, files
+
+
+def load_manifest(local_dir):
+    path = os.path.join(local_dir, MANIFEST_NAME)
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable snapshot manifest {path}: {e}")
+        return {}
+
+
+def save_manifest(local_dir, repo_id, commit, files):
+    write_json_atomic(os.path.join(local_dir, MANIFEST_NAME), {
+        "repo_id": repo_id,
+        "commit": commit,
+        "files": files,
+    })
+
+
+def diff_manifest(local_dir, remote_files, local_manifest):
+    """
+    Paths that have to be fetched: missing on disk, the wrong size, or
+    recorded with a different etag than the remote has now. Files on disk
+    that predate the manifest are trusted when their size matches.
+    """
+    recorded = local_manifest.get("files", {})
+    needed = []
+    for path, remote in remote_files.items():
+        local_path = os.path.join(local_dir, path)
+        try:
+            size = os.path.getsize(local_path)
+        except OSError:
+            needed.append(path)
+            continue
+        if remote["size"] is not None and size != remote["size"]:
+            needed.append(path)
+        elif path in recorded and recorded[path].get("etag") != remote["etag"]:
+            needed.append(path)
+    return needed
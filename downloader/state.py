@@ -0,0 +1,118 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+
+from .fsutil import write_text_atomic
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+
+class StateFile:
+    """
+    A small JSON file (active config, license states, settings) that is
+    written atomically and off the event loop.
+
+    save() serializes the data right away, so later changes by the caller
+    cannot leak into the write, and schedules a write delay seconds later.
+    Saves within that window replace the pending data, so a burst of
+    updates costs one write, and the newest data always wins. Writes run in
+    a worker thread one at a time. Outside an event loop save() writes
+    immediately.
+
+    Use get_state_file() to get the one instance for a path: two instances
+    would each hold their own pending data, and an older write could land
+    after a newer one. Those instances are flushed at interpreter exit.
+    """
+
+    def __init__(self, path, delay=0.5):
+        self.path = str(path)
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = None
+        self._timer = None
+        # Keeps the running write referenced until it finishes
+        self._task = None
+
+    def load(self, default=None):
+        """Parsed contents, pending data included, or default if the file is missing or unreadable"""
+        with self._lock:
+            pending = self._pending
+        if pending is not None:
+            return json.loads(pending)
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read {self.path}, using defaults: {e}")
+            return default
+
+    def save(self, data):
+        """Schedule a write of data and return without waiting for it"""
+        text = json.dumps(data, indent=2)
+        with self._lock:
+            self._pending = text
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_sync()
+            return
+        if self._timer is None:
+            self._timer = loop.call_later(self.delay, self._start_write)
+
+    def _start_write(self):
+        self._timer = None
+        self._task = asyncio.ensure_future(asyncio.to_thread(self.flush_sync))
+
+    def flush_sync(self):
+        """Write pending data now, from any thread"""
+        with self._write_lock:
+            with self._lock:
+                text, self._pending = self._pending, None
+            if text is None:
+                return
+            try:
+                write_text_atomic(self.path, text)
+            except Exception as e:
+                logger.error(f"Error saving {self.path}: {e}")
+                with self._lock:
+                    # Keep it for the next attempt unless newer data arrived meanwhile
+                    if self._pending is None:
+                        self._pending = text
+
+    async def flush(self):
+        """Write pending data now and wait for any write in progress"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await asyncio.to_thread(self.flush_sync)
+
+
+_state_files = {}
+_state_files_lock = threading.Lock()
+
+
+def get_state_file(path, delay=0.5):
+    """The shared StateFile for path; delay only applies to the first call"""
+    key = os.path.abspath(path)
+    with _state_files_lock:
+        state_file = _state_files.get(key)
+        if state_file is None:
+            state_file = _state_files[key] = StateFile(path, delay)
+        return state_file
+
+
+def flush_all():
+    """Write the pending data of every shared StateFile"""
+    with _state_files_lock:
+        state_files = list(_state_files.values())
+    for state_file in state_files:
+        state_file.flush_sync()
+
+
+atexit.register(flush_all)
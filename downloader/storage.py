@@ -0,0 +1,232 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from .catalog import is_repo_entry, model_key
+from .fsutil import write_json_atomic
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+GiB = 1024 * 1024 * 1024
+
+
+class InsufficientSpaceError(Exception):
+    pass
+
+
+def free_bytes(path):
+    """Free space on the volume holding path, or the nearest parent that exists"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return shutil.disk_usage(path).free
+
+
+def _volume(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return os.stat(path).st_dev
+
+
+def _entry_files(path, repo):
+    """(stat, path) for every file of an entry on disk"""
+    if not repo:
+        try:
+            return [(os.stat(path), path)]
+        except FileNotFoundError:
+            return []
+    files = []
+    for root, dirs, names in os.walk(path):
+        if ".cache" in dirs:
+            dirs.remove(".cache")
+        for name in names:
+            file_path = os.path.join(root, name)
+            try:
+                files.append((os.stat(file_path), file_path))
+            except FileNotFoundError:
+                pass
+    return files
+
+
+class StorageManager:
+    """
+    Keeps downloads from filling the disk.
+
+    Before a download writes anything, admit() checks that the volume will
+    still have min_free bytes left once the file is complete, counting
+    space already promised to other running downloads. Catalog entries on
+    disk are ranked by when they were last used, recorded by touch() (e.g.
+    when a queued prompt references them) or taken from the file's atime.
+    plan_eviction() picks least-recently-used, non-pinned entries until the
+    catalog fits in quota and the requested space is free; evict() deletes
+    them.
+
+    Without a catalog (e.g. the provisioning CLI) only admission applies;
+    without a state_path usage is not persisted.
+    """
+
+    def __init__(self, catalog, state_path, min_free=0, quota=None, pinned=None, blob_store=None):
+        self.catalog = catalog
+        self.state_path = str(state_path) if state_path else None
+        self.min_free = int(min_free or 0)
+        self.quota = int(quota) if quota else None
+        self.pinned = set(pinned or [])
+        self.blob_store = blob_store
+        self._reserved = {}
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        if self.state_path is None:
+            return
+        try:
+            with open(self.state_path, "r") as f:
+                self._last_used = json.load(f)
+        except FileNotFoundError:
+            self._last_used = {}
+        except Exception as e:
+            logger.error(f"Error loading model usage from {self.state_path}: {e}")
+            self._last_used = {}
+
+    def save(self):
+        if self.state_path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = dict(self._last_used)
+            self._dirty = False
+        try:
+            write_json_atomic(self.state_path, data)
+        except Exception as e:
+            logger.error(f"Error saving model usage: {e}")
+
+    def touch(self, entry, when=None):
+        """Record that an entry was used now"""
+        name = model_key(entry)
+        if name:
+            with self._lock:
+                self._last_used[name] = when or time.time()
+                self._dirty = True
+
+    def is_pinned(self, entry):
+        return bool(entry.get("pinned")) or model_key(entry) in self.pinned
+
+    def reserved_bytes(self, path):
+        volume = _volume(path)
+        with self._lock:
+            return sum(size for (dev, _), size in self._reserved.items() if dev == volume)
+
+    def admit(self, path, size):
+        """
+        Reserve size bytes for a download to path, or raise InsufficientSpaceError.
+        Call release(path) when the download finishes or fails.
+        """
+        size = max(0, int(size or 0))
+        available = free_bytes(path) - self.reserved_bytes(path)
+        if available - size < self.min_free:
+            raise InsufficientSpaceError(
+                f"Not enough disk space for {os.path.basename(path)}: needs {size} bytes, "
+                f"{available} free and {self.min_free} must stay free"
+            )
+        with self._lock:
+            self._reserved[(_volume(path), path)] = size
+
+    def release(self, path):
+        with self._lock:
+            for key in [key for key in self._reserved if key[1] == path]:
+                del self._reserved[key]
+
+    def usage(self):
+        """Every catalog entry on disk with its size, last use and pinned flag, least recently used first"""
+        rows = []
+        if self.catalog is None:
+            return rows
+        for entry in self.catalog.entries():
+            path = self.catalog.resolve_path(entry).rstrip("/")
+            files = _entry_files(path, is_repo_entry(entry))
+            if not files:
+                continue
+            name = model_key(entry)
+            atime = max(st.st_atime for st, _ in files)
+            rows.append({
+                "model_name": name,
+                "path": path,
+                "size": sum(st.st_size for st, _ in files),
+                "last_used": max(self._last_used.get(name, 0), atime),
+                "pinned": self.is_pinned(entry),
+                "repo": is_repo_entry(entry),
+                "inodes": [(st.st_dev, st.st_ino, st.st_size) for st, _ in files],
+            })
+        rows.sort(key=lambda row: row["last_used"])
+        return rows
+
+    def plan_eviction(self, need_bytes=0, path=None):
+        """
+        Entries to delete, least recently used first, so that the catalog fits
+        within quota and need_bytes more can be admitted at path. Files shared
+        by several entries (hardlinks) only count as freed once all of those
+        entries are in the plan.
+        """
+        rows = self.usage()
+        links = {}
+        for row in rows:
+            for dev, ino, _ in row["inodes"]:
+                links[(dev, ino)] = links.get((dev, ino), 0) + 1
+        used = sum(size for (dev, ino, size) in {inode for row in rows for inode in row["inodes"]})
+
+        shortfall = 0
+        if path is not None and need_bytes:
+            shortfall = max(0, need_bytes + self.min_free + self.reserved_bytes(path) - free_bytes(path))
+        over_quota = max(0, used - self.quota) if self.quota else 0
+
+        plan, freed = [], 0
+        removed = {}
+        for row in rows:
+            if freed >= max(shortfall, over_quota):
+                break
+            if row["pinned"]:
+                continue
+            plan.append(row)
+            for dev, ino, size in row["inodes"]:
+                removed[(dev, ino)] = removed.get((dev, ino), 0) + 1
+                if removed[(dev, ino)] == links[(dev, ino)]:
+                    freed += size
+
+        return {
+            "evict": [{key: row[key] for key in ("model_name", "path", "size", "last_used")} for row in plan],
+            "freed_bytes": freed,
+            "used_bytes": used,
+            "quota_bytes": self.quota,
+            "shortfall_bytes": max(shortfall, over_quota),
+            "satisfied": freed >= max(shortfall, over_quota),
+        }
+
+    def evict(self, plan):
+        """Delete the entries in a plan from plan_eviction()"""
+        evicted = []
+        for row in plan["evict"]:
+            try:
+                if os.path.isdir(row["path"]):
+                    shutil.rmtree(row["path"])
+                else:
+                    os.remove(row["path"])
+                evicted.append(row["model_name"])
+                logger.info(f"Evicted {row['model_name']} ({row['size']} bytes, last used {time.ctime(row['last_used'])})")
+            except FileNotFoundError:
+                pass
+            for entry in self.catalog.candidates(row["model_name"]):
+                self.catalog.refresh_entry(entry)
+        if self.blob_store is not None:
+            # Evicted files were the last links to their blobs
+            self.blob_store.gc()
+        return evicted
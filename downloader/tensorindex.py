@@ -0,0 +1,256 @@
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+
+from .catalog import is_repo_entry, model_key
+from .fsutil import write_text_atomic
+
+logger = logging.getLogger("hal.fun.model.downloader")
+
+# The safetensors format refuses larger headers too
+MAX_HEADER_BYTES = 100 * 1024 * 1024
+
+# Context dimension of the UNet's cross-attention, which tells the Stable Diffusion families apart
+CONTEXT_DIMS = {768: "sd1", 1024: "sd2", 1280: "sdxl_refiner", 2048: "sdxl"}
+CROSS_ATTENTION_SUFFIXES = (
+    "attn2.to_k.weight",
+    "attn2.to_k.lora_down.weight",
+    "attn2.to_k.lora_A.weight",
+    "attn2_to_k.lora_down.weight",
+    "attn2_to_k.lora_A.weight",
+)
+LORA_MARKERS = (".lora_down.", ".lora_up.", ".lora_A.", ".lora_B.", ".hada_w1_a", ".lokr_w1")
+
+
+def read_header(path):
+    """
+    Tensor entries and __metadata__ of a safetensors file. Only the header
+    is mapped, so this costs the same for a 100 KB LoRA and a 20 GB
+    checkpoint. Raises ValueError if the file is not valid safetensors.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        prefix = f.read(8)
+        if len(prefix) < 8:
+            raise ValueError("file is too short for a safetensors header")
+        (length,) = struct.unpack("<Q", prefix)
+        if length > MAX_HEADER_BYTES or 8 + length > size:
+            raise ValueError(f"header length {length} does not fit the file")
+        with mmap.mmap(f.fileno(), 8 + length, access=mmap.ACCESS_READ) as header:
+            data = json.loads(header[8:])
+    if not isinstance(data, dict):
+        raise ValueError("header is not a JSON object")
+    metadata = data.pop("__metadata__", None) or {}
+    tensors = {}
+    for name, info in data.items():
+        try:
+            start, end = info["data_offsets"]
+            tensors[name] = (str(info["dtype"]), [int(d) for d in info["shape"]], int(end) - int(start))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"bad entry for tensor {name!r}")
+    return tensors, metadata
+
+
+def detect_architecture(tensors):
+    """
+    (kind, architecture) guessed from tensor names and shapes. kind is one
+    of checkpoint, diffusion_model, lora, controlnet, vae or text_encoder;
+    architecture is sd1, sd2, sdxl, sdxl_refiner, sd3 or flux. Either is
+    None when the names do not say.
+    """
+    names = tensors.keys()
+
+    def has(*parts):
+        return any(part in name for name in names for part in parts)
+
+    architecture = None
+    if has("double_blocks.", "double_blocks_", "single_transformer_blocks."):
+        architecture = "flux"
+    elif has("joint_blocks.", "joint_blocks_"):
+        architecture = "sd3"
+    else:
+        for name, (_, shape, _) in tensors.items():
+            if name.endswith(CROSS_ATTENTION_SUFFIXES) and len(shape) == 2:
+                architecture = CONTEXT_DIMS.get(shape[-1])
+                break
+
+    if has(*LORA_MARKERS):
+        kind = "lora"
+    elif has("control_model.", "zero_convs.", "controlnet_down_blocks."):
+        kind = "controlnet"
+    elif has("model.diffusion_model."):
+        text_encoder = has("cond_stage_model.", "conditioner.embedders.", "text_encoders.")
+        kind = "checkpoint" if text_encoder or has("first_stage_model.") else "diffusion_model"
+    elif architecture or has("input_blocks.", "down_blocks.0.attentions."):
+        kind = "diffusion_model"
+    elif has("encoder.down.", "encoder.down_blocks.") and has("decoder.up.", "decoder.up_blocks."):
+        kind = "vae"
+    elif has("text_model.encoder.layers.", "encoder.block.", "transformer.resblocks."):
+        kind = "text_encoder"
+    else:
+        kind = None
+    return kind, architecture
+
+
+def summarize(tensors, metadata):
+    """Index record for a parsed header: counts, bytes per dtype, the main dtype and a guessed architecture"""
+    parameters = 0
+    dtype_bytes = {}
+    for dtype, shape, nbytes in tensors.values():
+        parameters += math.prod(shape)
+        dtype_bytes[dtype] = dtype_bytes.get(dtype, 0) + nbytes
+    kind, architecture = detect_architecture(tensors)
+    return {
+        "kind": kind,
+        "architecture": architecture,
+        "dtype": max(dtype_bytes, key=dtype_bytes.get) if dtype_bytes else None,
+        "dtypes": dtype_bytes,
+        "tensors": len(tensors),
+        "parameters": parameters,
+        "parameter_bytes": sum(dtype_bytes.values()),
+        # Set by the safetensors "modelspec" convention, e.g. stable-diffusion-xl-v1-base/lora
+        "modelspec": metadata.get("modelspec.architecture"),
+    }
+
+
+def safetensors_files(path, repo):
+    """safetensors files of an entry on disk"""
+    if not repo:
+        return [path] if path.endswith(".safetensors") and os.path.isfile(path) else []
+    files = []
+    for root, dirs, names in os.walk(path):
+        if ".cache" in dirs:
+            dirs.remove(".cache")
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith(".safetensors"))
+    return files
+
+
+class TensorIndex:
+    """
+    What downloaded safetensors files contain, read from their headers.
+
+    The summary of every file (kind, architecture, main dtype, parameter
+    count and bytes) is kept in memory and in one state file, keyed by
+    path, so lookups are a dict access. The full tensor list of a file
+    (name, dtype and shape of each tensor) and its __metadata__ go to a
+    separate compact JSON file in tensor_dir, read only when asked for.
+    A record is reused while the file's size and mtime are unchanged.
+    """
+
+    def __init__(self, store, tensor_dir):
+        self.store = store
+        self.tensor_dir = str(tensor_dir)
+        self._lock = threading.Lock()
+        data = store.load({})
+        self.files = data.get("files", {}) if isinstance(data, dict) else {}
+        self.version = 0
+
+    def _tensor_path(self, path):
+        return os.path.join(self.tensor_dir, hashlib.sha1(path.encode("utf-8")).hexdigest()[:20] + ".json")
+
+    def get(self, path):
+        return self.files.get(os.path.abspath(path))
+
+    def index_file(self, path, model=None, force=False):
+        """
+        Record for a safetensors file, reading its header unless the record
+        is current. Returns None if the file is missing or not valid; call
+        save() afterwards.
+        """
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        record = self.files.get(path)
+        if not force and record and record["size"] == st.st_size and record["mtime_ns"] == st.st_mtime_ns:
+            if model and record.get("model") != model:
+                with self._lock:
+                    self.files = {**self.files, path: {**record, "model": model}}
+                    self.version += 1
+            return self.files[path]
+        try:
+            tensors, metadata = read_header(path)
+            rows = [[name, dtype, shape] for name, (dtype, shape, _) in tensors.items()]
+            os.makedirs(self.tensor_dir, exist_ok=True)
+            write_text_atomic(
+                self._tensor_path(path), json.dumps({"metadata": metadata, "tensors": rows}, separators=(",", ":"))
+            )
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not index the safetensors header of {path}: {e}")
+            return None
+        record = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "model": model, **summarize(tensors, metadata)}
+        with self._lock:
+            self.files = {**self.files, path: record}
+            self.version += 1
+        return record
+
+    def index_entry(self, entry, path, force=False):
+        """Index the safetensors files of a downloaded catalog entry; returns {path: record}"""
+        records = {}
+        for file_path in safetensors_files(path, is_repo_entry(entry)):
+            record = self.index_file(file_path, model_key(entry), force)
+            if record is not None:
+                records[os.path.abspath(file_path)] = record
+        return records
+
+    def tensors(self, path):
+        """Full tensor list and __metadata__ of an indexed file, or None"""
+        try:
+            with open(self._tensor_path(os.path.abspath(path)), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def backfill(self, catalog, force=False):
+        """
+        Index every downloaded catalog entry and drop records of files that
+        are gone. Blocking; returns how many files were read, kept or removed.
+        """
+        seen = set()
+        indexed = failed = 0
+        for entry in catalog.entries():
+            path = catalog.resolve_path(entry)
+            for file_path in safetensors_files(path, is_repo_entry(entry)):
+                file_path = os.path.abspath(file_path)
+                seen.add(file_path)
+                version = self.version
+                if self.index_file(file_path, model_key(entry), force) is None:
+                    failed += 1
+                elif self.version != version:
+                    indexed += 1
+        removed = [path for path in self.files if path not in seen and not os.path.isfile(path)]
+        if removed:
+            with self._lock:
+                self.files = {path: record for path, record in self.files.items() if path not in removed}
+                self.version += 1
+            for path in removed:
+                try:
+                    os.remove(self._tensor_path(path))
+                except FileNotFoundError:
+                    pass
+        self.save()
+        return {"indexed": indexed, "unchanged": len(seen) - indexed - failed, "failed": failed, "removed": len(removed)}
+
+    def query(self, model=None, kind=None, architecture=None, dtype=None):
+        """Records, with their path, matching every given filter"""
+        results = []
+        for path, record in self.files.items():
+            if model and record.get("model") != model:
+                continue
+            if kind and record["kind"] != kind:
+                continue
+            if architecture and record["architecture"] != architecture:
+                continue
+            if dtype and record["dtype"] != dtype:
+                continue
+            results.append({"path": path, **record})
+        return results
+
+    def save(self):
+        self.store.save({"files": self.files})
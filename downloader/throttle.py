@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Async token bucket limiting throughput to rate bytes per second.
+
+    A rate of None or 0 means unlimited. The rate can be changed at any
+    time with set_rate(); transfers that are already running pick up the
+    new rate on their next consume() call.
+    """
+
+    def __init__(self, rate=None, burst_seconds=1.0):
+        self.burst_seconds = burst_seconds
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.rate = None
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        rate = float(rate) if rate else None
+        if rate is not None and rate <= 0:
+            rate = None
+        self._refill()
+        self.rate = rate
+        if rate is not None:
+            self._tokens = min(self._tokens, rate * self.burst_seconds)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.rate * self.burst_seconds)
+        self._updated = now
+
+    async def consume(self, nbytes):
+        """Take nbytes from the bucket, sleeping as long as needed to stay under rate"""
+        if self.rate is None:
+            return
+        self._refill()
+        # Spend now and sleep off any debt, so large reads are not starved by small ones
+        self._tokens -= nbytes
+        while self._tokens < 0 and self.rate is not None:
+            await asyncio.sleep(min(-self._tokens / self.rate, 1.0))
+            self._refill()
+
+
+class Throttle:
+    """Applies several token buckets (e.g. global and per-job) to one transfer"""
+
+    def __init__(self, *buckets):
+        self.buckets = [bucket for bucket in buckets if bucket is not None]
+
+    @property
+    def limited(self):
+        return any(bucket.rate is not None for bucket in self.buckets)
+
+    async def __call__(self, nbytes):
+        for bucket in self.buckets:
+            await bucket.consume(nbytes)
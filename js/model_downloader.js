@@ -2,11 +2,45 @@ import { app } from "/scripts/app.js";
 import { api } from "/scripts/api.js";
 import { $el } from "/scripts/ui.js";
 
+// Latest progress event per download job, pushed by the server
+const jobProgress = {};
+
+function formatBytes(bytes) {
+  if (!bytes) return "0 B";
+  const units = ["B", "KB", "MB", "GB", "TB"];
+  const i = Math.min(Math.floor(Math.log(bytes) / Math.log(1024)), units.length - 1);
+  return `${(bytes / Math.pow(1024, i)).toFixed(i ? 1 : 0)} ${units[i]}`;
+}
+
+function formatProgress(progress) {
+  if (!progress) return "waiting";
+  const parts = [];
+  if (progress.total) {
+    parts.push(`${Math.floor((progress.bytes_done / progress.total) * 100)}%`);
+  } else {
+    parts.push(formatBytes(progress.bytes_done));
+  }
+  if (progress.speed) parts.push(`${formatBytes(progress.speed)}/s`);
+  if (progress.eta != null) parts.push(`ETA ${Math.ceil(progress.eta)}s`);
+  return parts.join(", ");
+}
+
 // Create a new extension
 app.registerExtension({
   name: "hal.fun.model.downloader",
   
   async setup() {
+    api.addEventListener("hal-fun-downloader.progress", ({ detail }) => {
+      jobProgress[detail.job_id] = detail;
+    });
+
+    // A download landed in a ComfyUI model folder: update loader dropdowns, once per burst of downloads
+    let refreshTimer = null;
+    api.addEventListener("hal-fun-downloader.models", () => {
+      clearTimeout(refreshTimer);
+      refreshTimer = setTimeout(() => app.refreshComboInNodes?.(), 1000);
+    });
+
     // Register a dockable panel
     const panelId = "hal-fun-model-downloader";
     
@@ -110,6 +144,41 @@ app.registerExtension({
           ])
         ]),
         
+        // Search
+        $el("div.model-filters", {
+          style: {
+            padding: "12px 20px 0",
+            display: "flex",
+            gap: "8px"
+          }
+        }, [
+          $el("input.model-search", {
+            type: "search",
+            placeholder: "Search by name, repository or folder",
+            style: {
+              flex: "1",
+              padding: "6px 12px",
+              border: "1px solid var(--border-color)",
+              borderRadius: "4px",
+              background: "var(--comfy-input-bg)",
+              color: "var(--fg-color)"
+            }
+          }),
+          $el("select.model-downloaded-filter", {
+            style: {
+              padding: "6px 12px",
+              border: "1px solid var(--border-color)",
+              borderRadius: "4px",
+              background: "var(--comfy-input-bg)",
+              color: "var(--fg-color)"
+            }
+          }, [
+            $el("option", { value: "", textContent: "All models" }),
+            $el("option", { value: "true", textContent: "Downloaded" }),
+            $el("option", { value: "false", textContent: "Not downloaded" })
+          ])
+        ]),
+
         // Model controls
         $el("div.model-controls", {
           style: {
@@ -144,7 +213,7 @@ app.registerExtension({
         ]),
         
         // Model list
-        $el("div", {
+        $el("div.model-scroll", {
           style: {
             flex: "1",
             overflow: "auto"
@@ -152,6 +221,7 @@ app.registerExtension({
         }, [
           $el("ul.model-list", {
             style: {
+              position: "relative",
               listStyle: "none",
               padding: "0",
               margin: "0"
@@ -191,6 +261,11 @@ app.registerExtension({
     panel.style.zIndex = "1000";
     document.body.appendChild(panel);
 
+    // Hub metadata was refreshed in the background: show new sizes and updates
+    api.addEventListener("hal-fun-downloader.catalog", () => {
+      if (panel.style.display !== "none") loadModels(panel);
+    });
+
     // Add button to the menu using the new ComfyUI button API
     try {
       const { ComfyButton } = await import("../../scripts/ui/components/button.js");
@@ -239,8 +314,9 @@ function setupPanelHandlers(container) {
   const tokenNote = container.querySelector(".token-note");
   const selectAllBtn = container.querySelector(".select-all-btn");
   const downloadSelectedBtn = container.querySelector(".download-selected-btn");
-  const modelList = container.querySelector(".model-list");
   const status = container.querySelector(".download-status");
+  const searchInput = container.querySelector(".model-search");
+  const downloadedFilter = container.querySelector(".model-downloaded-filter");
 
   // Check login status
   async function checkLoginStatus() {
@@ -323,22 +399,36 @@ function setupPanelHandlers(container) {
     }
   };
 
-  // Select all handler
-  selectAllBtn.onclick = () => {
-    const checkboxes = modelList.querySelectorAll('input[type="checkbox"]');
-    const allChecked = Array.from(checkboxes).every((cb) => cb.checked);
-    checkboxes.forEach((cb) => {
-      cb.checked = !allChecked;
-      cb.dispatchEvent(new Event("change"));
-    });
-    selectAllBtn.textContent = allChecked ? "Select All" : "Deselect All";
+  // Select all handler: applies to every model matching the current search
+  selectAllBtn.onclick = async () => {
+    const list = container.listState;
+    if (!list?.activeConfig) return;
+    try {
+      await loadAllPages(container);
+      const enabled = new Set(list.activeConfig.enabled_models || []);
+      const allChecked = list.items.every((model) => isSelected(enabled, model));
+      list.items.forEach((model) => {
+        enabled.delete(displayName(model));
+        if (allChecked) enabled.delete(modelRef(model));
+        else enabled.add(modelRef(model));
+      });
+      list.activeConfig.enabled_models = Array.from(enabled);
+      const updateResponse = await api.fetchApi("/hal-fun-downloader/active", {
+        method: "POST",
+        body: JSON.stringify(list.activeConfig),
+      });
+      if (!updateResponse.ok) throw new Error("Failed to update config");
+      selectAllBtn.textContent = allChecked ? "Select All" : "Deselect All";
+      renderRows(container);
+    } catch (error) {
+      console.error("Error selecting models:", error);
+      status.textContent = `Error: ${error.message}`;
+    }
   };
 
   // Download selected handler
   downloadSelectedBtn.onclick = async () => {
-    const selectedModels = Array.from(
-      modelList.querySelectorAll('input[type="checkbox"]:checked')
-    ).map((cb) => cb.dataset.modelName);
+    const selectedModels = container.listState?.activeConfig?.enabled_models || [];
 
     if (selectedModels.length === 0) {
       status.textContent = "Please select models to download";
@@ -355,11 +445,12 @@ function setupPanelHandlers(container) {
       });
       
       if (!response.ok) {
-        throw new Error(`Failed to download models: ${response.status}`);
+        throw await downloadError(response, "Failed to download models");
       }
       
       const result = await response.json();
       status.textContent = result.status;
+      await waitForJobs(result.jobs, status);
       await loadModels(container);
     } catch (error) {
       console.error("Download error:", error);
@@ -369,139 +460,309 @@ function setupPanelHandlers(container) {
     }
   };
 
+  // Search on the server as the user types
+  let searchTimer = null;
+  searchInput.oninput = () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => loadModels(container), 250);
+  };
+  downloadedFilter.onchange = () => loadModels(container);
+
+  // Re-render on scroll, and when the panel is shown or resized
+  const scroller = container.querySelector(".model-scroll");
+  let renderPending = false;
+  const scheduleRender = () => {
+    if (renderPending) return;
+    renderPending = true;
+    requestAnimationFrame(() => {
+      renderPending = false;
+      renderRows(container);
+    });
+  };
+  scroller.addEventListener("scroll", scheduleRender);
+  new ResizeObserver(scheduleRender).observe(scroller);
+
   // Load models initially
   checkLoginStatus();
   loadModels(container);
 }
 
+// Poll queued download jobs until they have all finished
+async function waitForJobs(jobs, status, interval = 2000) {
+  let pending = (jobs || []).map((job) => job.id);
+  const results = {};
+
+  while (pending.length > 0) {
+    await new Promise((resolve) => setTimeout(resolve, interval));
+    const stillPending = [];
+    for (const jobId of pending) {
+      try {
+        const response = await api.fetchApi(`/hal-fun-downloader/jobs/${jobId}`);
+        if (!response.ok) throw new Error(`Job status error: ${response.status}`);
+        const job = await response.json();
+        if (["completed", "failed", "cancelled"].includes(job.state)) {
+          results[jobId] = `${job.model_name}: ${job.result || job.error || job.state}`;
+        } else {
+          stillPending.push(jobId);
+        }
+      } catch (error) {
+        console.error("Error polling download job:", error);
+        results[jobId] = `Error: ${error.message}`;
+      }
+    }
+    pending = stillPending;
+    const done = Object.keys(results).length;
+    const active = pending
+      .filter((jobId) => ["running", "cancelling"].includes(jobProgress[jobId]?.state))
+      .map((jobId) => {
+        const progress = jobProgress[jobId];
+        return `${progress.model_name}: ${progress.state === "cancelling" ? "cancelling" : formatProgress(progress)}`;
+      });
+    status.textContent = pending.length > 0
+      ? [`Downloading... ${done}/${done + pending.length} finished`, ...active].join("\n")
+      : Object.values(results).join("\n");
+  }
+}
+
+// Rows have a fixed height, so only the visible ones need to exist in the DOM
+const ROW_HEIGHT = 48;
+const OVERSCAN_ROWS = 10;
+const PAGE_SIZE = 100;
+
+// Display name: the filename for single files, the repo name for whole repositories
+function displayName(model) {
+  return model.filename || model.repo_id.split("/").pop();
+}
+
+// What the server is sent for a model: Hub file names like model.safetensors repeat across entries
+function modelRef(model) {
+  return model.local_path || displayName(model);
+}
+
+// Selections saved before models were referenced by local_path hold display names
+function isSelected(enabled, model) {
+  return enabled.has(modelRef(model)) || enabled.has(displayName(model));
+}
+
+async function downloadError(response, fallback) {
+  const result = await response.json().catch(() => null);
+  return new Error(result?.error || `${fallback}: ${response.status}`);
+}
+
+// Start the model list over with the current search; pages are fetched as they scroll into view
 async function loadModels(container) {
   const modelList = container.querySelector(".model-list");
   const status = container.querySelector(".download-status");
+  const params = new URLSearchParams({ limit: PAGE_SIZE });
+  const search = container.querySelector(".model-search").value.trim();
+  const downloaded = container.querySelector(".model-downloaded-filter").value;
+  if (search) params.set("q", search);
+  if (downloaded) params.set("downloaded", downloaded);
+  if (container.listState && container.listState.params.toString() !== params.toString()) {
+    // A new search starts at the top; a reload of the same one keeps its place
+    container.querySelector(".model-scroll").scrollTop = 0;
+  }
+
+  const list = {
+    params,
+    items: [],
+    total: 0,
+    cursor: null,
+    done: false,
+    loading: null,
+    activeConfig: container.listState?.activeConfig
+  };
+  container.listState = list;
 
   try {
-    const [configResponse, activeResponse] = await Promise.all([
-      api.fetchApi("/hal-fun-downloader/config"),
-      api.fetchApi("/hal-fun-downloader/active")
-    ]);
+    const activeResponse = await api.fetchApi("/hal-fun-downloader/active");
+    if (!activeResponse.ok) throw new Error("Failed to load configuration");
+    list.activeConfig = await activeResponse.json();
+    await loadNextPage(container, list);
+    renderRows(container);
+  } catch (error) {
+    if (container.listState !== list) return;
+    console.error("Error loading models:", error);
+    modelList.style.height = "";
+    modelList.innerHTML = `<li style="padding: 20px; text-align: center; color: var(--error-color);">Error: ${error.message}</li>`;
+    status.textContent = `Error: ${error.message}`;
+  }
+}
 
-    if (!configResponse.ok || !activeResponse.ok) {
-      throw new Error("Failed to load configuration");
-    }
+async function loadNextPage(container, list) {
+  if (list.done) return;
+  if (!list.loading) {
+    list.loading = (async () => {
+      const params = new URLSearchParams(list.params);
+      if (list.cursor) params.set("cursor", list.cursor);
+      const response = await api.fetchApi(`/hal-fun-downloader/config?${params}`);
+      if (response.status === 409) {
+        // model_config.json changed under the cursor
+        list.done = true;
+        if (container.listState === list) await loadModels(container);
+        return;
+      }
+      if (!response.ok) throw new Error("Failed to load configuration");
+      const page = await response.json();
+      list.items.push(...page.items.filter((model) => model?.local_path));
+      list.total = page.next_cursor ? page.total : list.items.length;
+      list.cursor = page.next_cursor;
+      list.done = !page.next_cursor;
+    })().finally(() => {
+      list.loading = null;
+    });
+  }
+  await list.loading;
+}
 
-    const config = await configResponse.json();
-    const activeConfig = await activeResponse.json();
+async function loadAllPages(container) {
+  const list = container.listState;
+  while (container.listState === list && !list.done) {
+    await loadNextPage(container, list);
+  }
+}
 
-    modelList.innerHTML = "";
+// Render the rows in and near the visible part of the list, fetching more pages when needed
+function renderRows(container) {
+  const list = container.listState;
+  if (!list?.activeConfig) return;
+  const modelList = container.querySelector(".model-list");
+  const scroller = container.querySelector(".model-scroll");
 
-    if (!Array.isArray(config) || config.length === 0) {
-      modelList.innerHTML = '<li style="padding: 20px; text-align: center;">No models found</li>';
-      return;
-    }
+  if (list.total === 0) {
+    modelList.style.height = "";
+    modelList.innerHTML = '<li style="padding: 20px; text-align: center;">No models found</li>';
+    return;
+  }
 
-    for (const model of config) {
-      if (!model || !model.local_path) continue;
+  const first = Math.max(0, Math.floor(scroller.scrollTop / ROW_HEIGHT) - OVERSCAN_ROWS);
+  const last = Math.min(list.total, Math.ceil((scroller.scrollTop + scroller.clientHeight) / ROW_HEIGHT) + OVERSCAN_ROWS);
+  if (last > list.items.length && !list.done) {
+    loadNextPage(container, list)
+      .then(() => container.listState === list && renderRows(container))
+      .catch((error) => console.error("Error loading models:", error));
+  }
 
-      // Determine display name: use filename if present, otherwise use repo name
-      let modelName;
-      if (model.filename) {
-        // Single file download: use filename
-        modelName = model.filename;
-      } else {
-        // Full repo download: use repo name (last part of repo_id)
-        modelName = model.repo_id.split("/").pop();
-      }
-      
-      const isEnabled = activeConfig?.enabled_models?.includes(modelName);
-      const isDownloaded = activeConfig.model_status?.[modelName]?.downloaded;
+  modelList.style.height = `${list.total * ROW_HEIGHT}px`;
+  modelList.replaceChildren(
+    ...list.items.slice(first, last).map((model, i) => createModelRow(container, model, first + i))
+  );
+}
 
-      const modelItem = $el("li.model-item", {
-        style: {
-          display: "flex",
-          alignItems: "center",
-          justifyContent: "space-between",
-          padding: "12px 20px",
-          borderBottom: "1px solid var(--border-color)"
-        }
-      }, [
-        $el("label", {
-          style: {
-            display: "flex",
-            alignItems: "center",
-            gap: "12px",
-            flex: "1",
-            cursor: "pointer"
-          }
-        }, [
-          $el("input", {
-            type: "checkbox",
-            checked: isEnabled,
-            dataset: { modelName },
-            onchange: async (e) => {
-              try {
-                if (e.target.checked) {
-                  activeConfig.enabled_models.push(modelName);
-                } else {
-                  activeConfig.enabled_models = activeConfig.enabled_models.filter(
-                    (m) => m !== modelName
-                  );
-                }
-                const updateResponse = await api.fetchApi("/hal-fun-downloader/active", {
-                  method: "POST",
-                  body: JSON.stringify(activeConfig),
-                });
-                if (!updateResponse.ok) throw new Error("Failed to update config");
-              } catch (error) {
-                console.error("Error updating model status:", error);
-                e.target.checked = !e.target.checked;
-                status.textContent = `Error: ${error.message}`;
-              }
-            }
-          }),
-          $el("span", {
-            textContent: isDownloaded ? "✓ " : model.license?.required ? "🔒 " : ""
-          }),
-          $el("span", { textContent: modelName })
-        ]),
-        $el("button.download-btn", {
-          textContent: isDownloaded ? "Downloaded" : "Download",
-          disabled: isDownloaded,
-          style: {
-            padding: "4px 12px",
-            border: "1px solid var(--border-color)",
-            borderRadius: "4px",
-            background: "var(--comfy-input-bg)",
-            cursor: isDownloaded ? "not-allowed" : "pointer",
-            opacity: isDownloaded ? "0.5" : "1"
-          },
-          onclick: async () => {
-            status.textContent = "Starting download...";
-            
-            try {
-              const response = await api.fetchApi("/hal-fun-downloader/download", {
-                method: "POST",
-                body: JSON.stringify({ model_name: modelName }),
-              });
-              
-              if (!response.ok) throw new Error(`Download failed: ${response.status}`);
-              
-              const result = await response.json();
-              status.textContent = result.status;
-              await loadModels(container);
-            } catch (error) {
-              console.error("Download error:", error);
-              status.textContent = `Error: ${error.message}`;
-            }
-          }
-        })
-      ]);
+// Size on the Hub, plus architecture and dtype once the file's header is indexed, e.g. "6.5 GB · sdxl · F16"
+function describeModel(model) {
+  const parts = [];
+  if (model.hub?.size) parts.push(formatBytes(model.hub.size));
+  if (model.index?.architecture) parts.push(model.index.architecture);
+  if (model.index?.dtype) parts.push(model.index.dtype);
+  return parts.join(" · ");
+}
 
-      modelList.appendChild(modelItem);
+function createModelRow(container, model, index) {
+  const status = container.querySelector(".download-status");
+  const activeConfig = container.listState.activeConfig;
+  const modelName = displayName(model);
+  const ref = modelRef(model);
+  const isEnabled = isSelected(new Set(activeConfig?.enabled_models || []), model);
+  const isDownloaded = model.downloaded;
+  const canUpdate = isDownloaded && model.hub?.update_available === true;
+  const isDisabled = isDownloaded && !canUpdate;
+
+  return $el("li.model-item", {
+    style: {
+      position: "absolute",
+      top: `${index * ROW_HEIGHT}px`,
+      left: "0",
+      right: "0",
+      height: `${ROW_HEIGHT}px`,
+      boxSizing: "border-box",
+      display: "flex",
+      alignItems: "center",
+      justifyContent: "space-between",
+      padding: "0 20px",
+      borderBottom: "1px solid var(--border-color)"
     }
-  } catch (error) {
-    console.error("Error loading models:", error);
-    modelList.innerHTML = `<li style="padding: 20px; text-align: center; color: var(--error-color);">Error: ${error.message}</li>`;
-    status.textContent = `Error: ${error.message}`;
-  }
+  }, [
+    $el("label", {
+      style: {
+        display: "flex",
+        alignItems: "center",
+        gap: "12px",
+        flex: "1",
+        minWidth: "0",
+        cursor: "pointer"
+      }
+    }, [
+      $el("input", {
+        type: "checkbox",
+        checked: isEnabled,
+        dataset: { modelName },
+        onchange: async (e) => {
+          try {
+            activeConfig.enabled_models = activeConfig.enabled_models.filter(
+              (m) => m !== ref && m !== modelName
+            );
+            if (e.target.checked) {
+              activeConfig.enabled_models.push(ref);
+            }
+            const updateResponse = await api.fetchApi("/hal-fun-downloader/active", {
+              method: "POST",
+              body: JSON.stringify(activeConfig),
+            });
+            if (!updateResponse.ok) throw new Error("Failed to update config");
+          } catch (error) {
+            console.error("Error updating model status:", error);
+            e.target.checked = !e.target.checked;
+            status.textContent = `Error: ${error.message}`;
+          }
+        }
+      }),
+      $el("span", {
+        textContent: isDownloaded ? "✓ " : model.license?.required ? "🔒 " : ""
+      }),
+      $el("span", {
+        textContent: modelName,
+        title: model.local_path,
+        style: { overflow: "hidden", textOverflow: "ellipsis", whiteSpace: "nowrap" }
+      }),
+      $el("span", {
+        textContent: describeModel(model),
+        style: { opacity: "0.6", fontSize: "0.85rem", whiteSpace: "nowrap" }
+      })
+    ]),
+    $el("button.download-btn", {
+      textContent: canUpdate ? "Update" : isDownloaded ? "Downloaded" : "Download",
+      disabled: isDisabled,
+      style: {
+        padding: "4px 12px",
+        border: "1px solid var(--border-color)",
+        borderRadius: "4px",
+        background: "var(--comfy-input-bg)",
+        cursor: isDisabled ? "not-allowed" : "pointer",
+        opacity: isDisabled ? "0.5" : "1"
+      },
+      onclick: async () => {
+        status.textContent = "Starting download...";
+
+        try {
+          const response = await api.fetchApi("/hal-fun-downloader/download", {
+            method: "POST",
+            body: JSON.stringify({ model_name: ref, update: canUpdate }),
+          });
+
+          if (!response.ok) throw await downloadError(response, "Download failed");
+
+          const result = await response.json();
+          status.textContent = result.status;
+          await waitForJobs(result.jobs, status);
+          await loadModels(container);
+        } catch (error) {
+          console.error("Download error:", error);
+          status.textContent = `Error: ${error.message}`;
+        }
+      }
+    })
+  ]);
 }
 
 // Legacy fallback for older ComfyUI versions
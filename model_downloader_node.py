@@ -1,24 +1,45 @@
+import hashlib
 import json
 import os
-from huggingface_hub import hf_hub_download, login, snapshot_download
-from server import PromptServer
-import aiohttp
 import asyncio
 from pathlib import Path
 from aiohttp import web
 import logging
+import time
+import uuid
+import folder_paths
 from server import PromptServer
-from execution import PromptExecutor
+from .downloader.access import AccessProber
+from .downloader.blobs import normalize_key
+from .downloader.catalog import AmbiguousModelError, ModelCatalog, is_repo_entry, model_folder, model_key, parse_cursor
+from .downloader.fetcher import ModelFetcher
+from .downloader.fsutil import write_text_atomic
+from .downloader.hubmeta import HubMetadataCache
+from .downloader.integrity import as_sha256, verify_files
+from .downloader.jobs import DEFAULT_PRIORITY, PRIORITIES, DownloadScheduler
+from .downloader.metrics import CACHE_REQUESTS, REGISTRY
+from .downloader.mirrors import peer_authorized
+from .downloader.prefetch import match_entries, missing_models, referenced_models
+from .downloader.provision import LockfileError, ProvisioningRun, parse_lockfile, plan_provisioning, provision
+from .downloader.settings import DEFAULT_SETTINGS
+from .downloader.state import get_state_file
+from .downloader.storage import free_bytes
+from .downloader.tensorindex import TensorIndex
 
-# Set up logging with a more visible format
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Handlers and format are left to ComfyUI's logging setup
 logger = logging.getLogger("hal.fun.model.downloader")
 
+# Used when a model_config.json entry has no base_model_path and its folder is not one ComfyUI knows
+DEFAULT_MODELS_DIR = folder_paths.models_dir
+
 # Create a global instance of ModelDownloader
 model_downloader = None
+download_scheduler = None
+model_catalog = None
+model_fetcher = None
+access_prober = None
+hub_metadata = None
+tensor_index = None
 
 def get_model_downloader():
     global model_downloader
@@ -26,6 +47,190 @@ def get_model_downloader():
         model_downloader = ModelDownloader()
     return model_downloader
 
+def _is_within(path, directory):
+    path, directory = os.path.normcase(os.path.abspath(path)), os.path.normcase(os.path.abspath(directory))
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+def comfy_folder_dirs(folder):
+    """
+    Directories ComfyUI searches for a model folder, including those from
+    extra_model_paths.yaml, download destination first. That is ComfyUI's
+    first directory, except that under models/ the folder named in
+    local_path is kept (models/unet and models/diffusion_models are both
+    "diffusion_models"). Empty for folders ComfyUI does not know.
+    """
+    name = getattr(folder_paths, "map_legacy", lambda name: name)(folder)
+    if name not in folder_paths.folder_names_and_paths:
+        return []
+    dirs = list(folder_paths.get_folder_paths(name))
+    default = os.path.join(folder_paths.models_dir, folder)
+    if dirs and _is_within(dirs[0], folder_paths.models_dir) and default in dirs:
+        dirs.remove(default)
+        dirs.insert(0, default)
+    return dirs
+
+def refresh_comfy_file_lists(path):
+    """
+    Drop ComfyUI's cached file lists of the folders containing path, so
+    loader nodes list a new model without a restart; returns their names
+    """
+    cache = getattr(folder_paths, "filename_list_cache", None)
+    folders = [
+        name for name, (dirs, _) in list(folder_paths.folder_names_and_paths.items())
+        if any(_is_within(path, directory) for directory in dirs)
+    ]
+    if isinstance(cache, dict):
+        for name in folders:
+            cache.pop(name, None)
+    return folders
+
+def get_model_catalog():
+    global model_catalog
+    if model_catalog is None:
+        model_catalog = ModelCatalog(
+            Path(__file__).parent / "model_config.json", DEFAULT_MODELS_DIR, folder_dirs=comfy_folder_dirs
+        )
+    return model_catalog
+
+def get_model_fetcher():
+    """Download engine shared by all jobs; it builds the blob store, mirrors etc. from settings"""
+    global model_fetcher
+    if model_fetcher is None:
+        downloader = get_model_downloader()
+        model_fetcher = ModelFetcher(downloader.settings, DEFAULT_MODELS_DIR, str(downloader.config_dir), get_model_catalog())
+    return model_fetcher
+
+def get_blob_store():
+    """Shared BlobStore, or None when deduplication is disabled"""
+    return get_model_fetcher().blob_store
+
+def download_from_executor(model_name, model_config):
+    """
+    Run a download for a node and return its status string.
+
+    Nodes execute on ComfyUI's prompt worker thread, so the job is submitted
+    to the scheduler on the server's event loop and this thread waits for
+    it. A prompt that needs a model already being downloaded (by the UI or
+    another prompt) attaches to that job instead of starting a second one.
+    """
+    server = PromptServer.instance
+    loop = getattr(server, "loop", None)
+
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is not None:
+        raise RuntimeError("download_from_executor must not be called from the event loop thread")
+
+    if loop is None or not loop.is_running():
+        # No server (e.g. a script importing the node): download directly
+        downloader = get_model_downloader()
+        status = asyncio.run(downloader.download_model(model_config))
+        downloader.catalog.refresh_entry(model_config)
+        refresh_comfy_file_lists(downloader.catalog.resolve_path(model_config))
+        index_downloaded(model_config)
+        return status
+
+    async def submit_and_wait():
+        scheduler = get_download_scheduler()
+        job = await scheduler.submit(model_name, model_config, priority="prompt")
+        get_storage_manager().touch(model_config)
+        return await scheduler.wait(job.id)
+
+    job = asyncio.run_coroutine_threadsafe(submit_and_wait(), loop).result()
+    return job.result or job.error or job.state
+
+def get_access_prober():
+    global access_prober
+    if access_prober is None:
+        access_prober = AccessProber(concurrency=get_model_downloader().settings["probe_concurrency"])
+    return access_prober
+
+def get_hub_metadata():
+    global hub_metadata
+    if hub_metadata is None:
+        downloader = get_model_downloader()
+        hub_metadata = HubMetadataCache(
+            get_state_file(downloader.config_dir / "hub_metadata.json"),
+            ttl=downloader.settings["hub_metadata_ttl"],
+            concurrency=downloader.settings["probe_concurrency"],
+        )
+    return hub_metadata
+
+def get_tensor_index():
+    global tensor_index
+    if tensor_index is None:
+        config_dir = get_model_downloader().config_dir
+        tensor_index = TensorIndex(get_state_file(config_dir / "tensor_index.json"), config_dir / "tensors")
+    return tensor_index
+
+def index_downloaded(entry):
+    """Read the safetensors headers of a finished download into the tensor index (blocking)"""
+    if not get_model_downloader().settings["index_safetensors"]:
+        return
+    try:
+        index = get_tensor_index()
+        index.index_entry(entry, get_model_catalog().resolve_path(entry))
+        index.save()
+    except Exception as e:
+        logger.error(f"Error indexing {model_key(entry)}: {e}")
+
+async def run_download_job(job):
+    storage = get_storage_manager()
+    try:
+        return await get_model_downloader().download_model(
+            job.model_config, progress=job.progress, report=job.details, throttle=job.throttle
+        )
+    finally:
+        catalog = get_model_catalog()
+        catalog.refresh_entry(job.model_config)
+        send_models_event(refresh_comfy_file_lists(catalog.resolve_path(job.model_config)))
+        storage.touch(job.model_config)
+        await asyncio.to_thread(storage.save)
+        await asyncio.to_thread(index_downloaded, job.model_config)
+
+def send_progress_event(job, snapshot):
+    server = PromptServer.instance
+    if server is None:
+        return
+    server.send_sync("hal-fun-downloader.progress", {
+        "job_id": job.id,
+        "model_name": job.model_name,
+        "state": job.state,
+        **snapshot,
+    })
+
+def send_models_event(folders):
+    """Tell the UI which model folders changed, so it can refresh loader dropdowns"""
+    server = PromptServer.instance
+    if server is not None and folders:
+        server.send_sync("hal-fun-downloader.models", {"folders": folders})
+
+def get_download_scheduler():
+    global download_scheduler
+    if download_scheduler is None:
+        downloader = get_model_downloader()
+        settings = downloader.settings
+        download_scheduler = DownloadScheduler(
+            run_download_job,
+            downloader.config_dir / "jobs.json",
+            max_concurrent=settings["max_concurrent_downloads"],
+            max_per_host=settings["max_downloads_per_host"],
+            host_limits=settings["host_limits"],
+            on_progress=send_progress_event,
+            progress_interval=settings["progress_interval"],
+            resume_unfinished=settings["resume_jobs_on_startup"],
+            bandwidth_limit=settings["bandwidth_limit"],
+        )
+    return download_scheduler
+
+def get_storage_manager():
+    return get_model_fetcher().storage
+
+def get_circuit_breaker():
+    return get_model_fetcher().breaker
+
 class ModelDownloader:
     """
     A node for managing and downloading models from Hugging Face
@@ -35,48 +240,70 @@ class ModelDownloader:
         self.config_dir.mkdir(parents=True, exist_ok=True)
         self.active_config_path = self.config_dir / "active_config.json"
         self.model_config_path = Path(__file__).parent / "model_config.json"
+        self.catalog = get_model_catalog()
         self.token_path = self.config_dir / "hf_token.txt"
+        self.settings_path = self.config_dir / "settings.json"
+        # Written atomically, debounced and off the event loop; node instances share one store per file
+        self.settings_store = get_state_file(self.settings_path)
+        self.license_store = get_state_file(self.config_dir / "license_states.json")
+        self.active_config_store = get_state_file(self.active_config_path)
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.load_settings()
         self.license_states = {}  # Store license states for each model
         self.load_license_states()
+        self._token = self._read_token()
         
         # Load or create active configuration
-        if self.active_config_path.exists():
-            with open(self.active_config_path, 'r') as f:
-                self.active_config = json.load(f)
-        else:
+        self.active_config_version = 0
+        self.active_config = self.active_config_store.load()
+        if not isinstance(self.active_config, dict):
             self.active_config = {"enabled_models": []}
             self._save_active_config()
 
     def _save_active_config(self):
-        with open(self.active_config_path, 'w') as f:
-            json.dump(self.active_config, f, indent=2)
+        self.active_config_store.save(self.active_config)
+
+    def load_settings(self):
+        """Load download settings from file, falling back to defaults"""
+        settings = self.settings_store.load()
+        if isinstance(settings, dict):
+            self.settings.update(settings)
+
+    def save_settings(self):
+        """Persist settings changed at runtime"""
+        self.settings_store.save(self.settings)
 
     def is_logged_in(self):
-        return self.token_path.exists()
+        return self._token is not None
 
     def save_token(self, token):
+        """Write the token (blocking, call it off the event loop); only the owner may read it"""
         try:
-            with open(self.token_path, 'w') as f:
-                f.write(token)
+            write_text_atomic(self.token_path, token, mode=0o600)
+            self._token = token
             return True
         except Exception as e:
             logger.error(f"Error saving token: {e}")
             return False
 
-    def get_token(self):
+    def _read_token(self):
         try:
-            if self.token_path.exists():
-                with open(self.token_path, 'r') as f:
-                    return f.read().strip()
+            with open(self.token_path, 'r') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
             return None
         except Exception as e:
             logger.error(f"Error reading token: {e}")
             return None
 
+    def get_token(self):
+        return self._token
+
     def logout(self):
         try:
             if self.token_path.exists():
                 self.token_path.unlink()
+            self._token = None
             self.license_states = {}  # Clear license states on logout
             self.save_license_states()
             return True
@@ -86,55 +313,55 @@ class ModelDownloader:
 
     def load_license_states(self):
         """Load license states from file"""
-        license_states_path = self.config_dir / "license_states.json"
-        if license_states_path.exists():
-            try:
-                with open(license_states_path, "r") as f:
-                    self.license_states = json.load(f)
-            except Exception as e:
-                logger.error(f"Error loading license states: {e}")
-                self.license_states = {}
+        states = self.license_store.load({})
+        if not isinstance(states, dict):
+            states = {}
+        # Older files stored a bare bool; treat those as expired
+        self.license_states = {
+            key: value if isinstance(value, dict) else {"accepted": bool(value), "checked_at": 0}
+            for key, value in states.items()
+        }
 
     def save_license_states(self):
         """Save license states to file"""
-        license_states_path = self.config_dir / "license_states.json"
-        try:
-            with open(license_states_path, "w") as f:
-                json.dump(self.license_states, f)
-        except Exception as e:
-            logger.error(f"Error saving license states: {e}")
+        self.license_store.save(self.license_states)
 
-    def update_license_states(self):
-        """Update license states for all gated models"""
+    def set_license_state(self, key, accepted):
+        self.license_states[key] = {"accepted": accepted, "checked_at": time.time()}
+
+    def cached_license_state(self, key):
+        """Cached accepted flag for key, or None if unknown or older than license_cache_ttl"""
+        state = self.license_states.get(key)
+        if state is None or time.time() - state.get("checked_at", 0) > self.settings["license_cache_ttl"]:
+            CACHE_REQUESTS.inc(cache="license", result="miss")
+            return None
+        CACHE_REQUESTS.inc(cache="license", result="hit")
+        return state["accepted"]
+
+    async def update_license_states(self, force=False):
+        """Probe access to all gated models concurrently; only stale entries unless force"""
         if not self.is_logged_in():
             self.license_states = {}
             self.save_license_states()
             return
 
         try:
-            with open(self.model_config_path, "r") as f:
-                config = json.load(f)
-
-            for model in config:
+            items = {}
+            for model in self.catalog.entries():
                 if model.get("license", {}).get("required"):
                     key = f"{model['repo_id']}/{model['filename']}"
-                    try:
-                        # Check if user has accepted the license
-                        hf_hub_download(
-                            repo_id=model["repo_id"],
-                            filename=model["filename"],
-                            token=self.get_token(),
-                            local_dir=os.path.dirname(os.path.join(self.config_dir, model["local_path"])),
-                            force_download=False,
-                            resume_download=False,
-                        )
-                        self.license_states[key] = True
-                    except Exception as e:
-                        if "401" in str(e) or "403" in str(e):
-                            self.license_states[key] = False
-                        else:
-                            logger.error(f"Error checking license for {key}: {e}")
+                    if force or self.cached_license_state(key) is None:
+                        path = "/".join(p for p in (model.get("subfolder"), model["filename"]) if p)
+                        items[key] = (model["repo_id"], path, model.get("revision"))
 
+            if not items:
+                return
+            results = await get_access_prober().probe_many(items, token=self.get_token())
+            for key, accepted in results.items():
+                if accepted is not None:
+                    self.set_license_state(key, accepted)
+                else:
+                    logger.error(f"Could not check license for {key}")
             self.save_license_states()
         except Exception as e:
             logger.error(f"Error updating license states: {e}")
@@ -153,138 +380,47 @@ class ModelDownloader:
     FUNCTION = "execute"
     CATEGORY = "model_downloader"
 
-    async def download_model(self, model_config):
-        repo_id = model_config['repo_id']
-        subfolder = model_config.get('subfolder', '')
-        filename = model_config.get('filename')  # May be None for full repo downloads
-        local_path = model_config['local_path']
-        base_model_path = model_config.get('base_model_path', os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'models'))
-        
-        # Prepend base_model_path to local_path if it's not an absolute path
-        if not os.path.isabs(local_path):
-            local_path = os.path.join(base_model_path, local_path)
-        
+    async def download_model(self, model_config, progress=None, report=None, throttle=None):
         # Check if the model is protected (gated)
         is_protected = model_config.get('protected', False) or model_config.get('license', {}).get('required', False)
         
-        # Get the token if we're logged in and the model is protected
-        token = None
-        if is_protected:
-            token = self.get_token()
-            if not token:
-                return f"Error: Not logged in. Please log in first to download protected models."
+        # Send the token whenever we're logged in; lock file entries carry no gated flag
+        token = self.get_token()
+        if is_protected and not token:
+            return f"Error: Not logged in. Please log in first to download protected models."
         
-        try:
-            # Detect download mode: full repository or single file
-            if not filename:
-                # Full repository download mode
-                logger.info(f"Starting full repository download of {repo_id} to {local_path}")
-                
-                # Strip trailing slash for existence check
-                check_path = local_path.rstrip('/')
-                if os.path.isdir(check_path):
-                    return f"Repository already exists at {local_path}"
-                
-                # Create parent directory
-                os.makedirs(local_path, exist_ok=True)
-                
-                # Use asyncio.to_thread to run the blocking snapshot_download in a separate thread
-                await asyncio.to_thread(
-                    snapshot_download,
-                    repo_id=repo_id,
-                    local_dir=local_path,
-                    local_dir_use_symlinks=False,
-                    token=token
-                )
-                
-                return f"Successfully downloaded repository {repo_id} to {local_path}"
-            else:
-                # Single file download mode (original behavior)
-                logger.info(f"Starting single file download of {filename} from {repo_id}")
-                
-                if os.path.exists(local_path):
-                    return f"File already exists at {local_path}"
-                
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                
-                # Use asyncio.to_thread to run the blocking hf_hub_download in a separate thread
-                await asyncio.to_thread(
-                    hf_hub_download,
-                    repo_id=repo_id,
-                    subfolder=subfolder,
-                    filename=filename,
-                    local_dir=os.path.dirname(local_path),
-                    token=token
-                )
-                
-                downloaded_path = os.path.join(os.path.dirname(local_path), subfolder, filename)
-                if downloaded_path != local_path:
-                    os.rename(downloaded_path, local_path)
-                    
-                return f"Successfully downloaded {filename} to {local_path}"
-        except Exception as e:
-            error_detail = filename if filename else f"repository {repo_id}"
-            return f"Error downloading {error_detail}: {str(e)}"
+        return await get_model_fetcher().download(
+            model_config, self.catalog.resolve_path(model_config), token, progress, report, throttle
+        )
 
     def execute(self, action, model_name):
+        try:
+            models = self.catalog.find(model_name)
+        except (FileNotFoundError, AmbiguousModelError) as e:
+            return (f"Error: {e}",)
+        
         if action == "check_downloads":
-            if not self.model_config_path.exists():
-                return (f"Error: Model config file not found at {self.model_config_path}",)
-            
-            with open(self.model_config_path, 'r') as f:
-                config = json.load(f)
-            
+            model_status = self.catalog.status()
             status = []
-            for model in config:
-                if model_name in model.get("local_path", ""):
-                    local_path = model["local_path"]
-                    base_model_path = model.get('base_model_path', os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'models'))
-                    
-                    # Prepend base_model_path if not absolute
-                    if not os.path.isabs(local_path):
-                        local_path = os.path.join(base_model_path, local_path)
-                    
-                    # Check if it's a repo download (no filename) or single file
-                    if 'filename' not in model or not model.get('filename'):
-                        # Full repo: check if directory exists
-                        check_path = local_path.rstrip('/')
-                        if os.path.isdir(check_path):
-                            status.append(f"✓ {model_name} is downloaded (repository)")
-                        else:
-                            status.append(f"✗ {model_name} is not downloaded (repository)")
-                    else:
-                        # Single file: check if file exists
-                        if os.path.exists(local_path):
-                            status.append(f"✓ {model_name} is downloaded")
-                        else:
-                            status.append(f"✗ {model_name} is not downloaded")
+            for model in models:
+                entry_status = model_status.get(model_key(model), {})
+                suffix = " (repository)" if is_repo_entry(model) else ""
+                if entry_status.get("downloaded"):
+                    status.append(f"✓ {model_name} is downloaded{suffix}")
+                else:
+                    status.append(f"✗ {model_name} is not downloaded{suffix}")
             
             return ("\n".join(status) if status else f"No matching models found for {model_name}",)
         
         elif action == "download_selected":
-            if not self.model_config_path.exists():
-                return (f"Error: Model config file not found at {self.model_config_path}",)
-            
-            with open(self.model_config_path, 'r') as f:
-                config = json.load(f)
-            
-            for model in config:
-                if model_name in model.get("local_path", ""):
-                    try:
-                        # Create event loop if it doesn't exist
-                        try:
-                            loop = asyncio.get_event_loop()
-                        except RuntimeError:
-                            loop = asyncio.new_event_loop()
-                            asyncio.set_event_loop(loop)
-                        
-                        # Run the download
-                        status = loop.run_until_complete(self.download_model(model))
-                        return (status,)
-                    except Exception as e:
-                        error_msg = f"Error downloading {model_name}: {str(e)}"
-                        logger.error(error_msg, exc_info=True)
-                        return (error_msg,)
+            for model in models:
+                try:
+                    # Hand off to the shared scheduler and block this executor thread only
+                    return (download_from_executor(model_name, model),)
+                except Exception as e:
+                    error_msg = f"Error downloading {model_name}: {str(e)}"
+                    logger.error(error_msg, exc_info=True)
+                    return (error_msg,)
             
             return (f"No matching models found for {model_name}",)
 
@@ -305,18 +441,8 @@ class DownloadModelNode:
 
     def execute(self, model_config):
         try:
-            logger.info(f"Starting download for model config: {model_config}")
-            downloader = get_model_downloader()
-            
-            # Create event loop if it doesn't exist
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-            
-            # Run the download
-            status = loop.run_until_complete(downloader.download_model(model_config))
+            logger.debug(f"Starting download for model config: {model_config}")
+            status = download_from_executor(model_key(model_config), model_config)
             logger.info(f"Download completed with status: {status}")
             return (status,)
         except Exception as e:
@@ -325,70 +451,241 @@ class DownloadModelNode:
             return (error_msg,)
 
 # API route handlers
+def send_catalog_event():
+    server = PromptServer.instance
+    if server is not None:
+        server.send_sync("hal-fun-downloader.catalog", {"version": get_hub_metadata().version})
+
+# Fields of a tensor index record shown with each catalog entry
+INDEX_SUMMARY_FIELDS = ("kind", "architecture", "dtype", "parameters")
+
+def describe_contents(index, entry, path):
+    """kind, architecture, dtype and parameters of a downloaded single-file entry, or None if not indexed"""
+    record = None if is_repo_entry(entry) else index.get(path)
+    return {field: record[field] for field in INDEX_SUMMARY_FIELDS} if record else None
+
+def enrich_entries(entries):
+    """
+    Catalog entries with whether they are downloaded, their cached Hub
+    size, sha256, commit and update_available under "hub", and what the
+    file contains under "index"
+    """
+    catalog = get_model_catalog()
+    status = catalog.status()
+    metadata = get_hub_metadata()
+    blobs = get_blob_store()
+    index = get_tensor_index()
+    results = []
+    for entry in entries:
+        path = catalog.resolve_path(entry)
+        results.append({
+            **entry,
+            "downloaded": status.get(model_key(entry), {}).get("downloaded", False),
+            "hub": metadata.describe(entry, path, blobs),
+            "index": describe_contents(index, entry, path),
+        })
+    return results
+
+# Part of every ETag, so responses from an earlier run whose versions started over never match
+_etag_prefix = uuid.uuid4().hex[:8]
+
+def make_etag(version):
+    return f'W/"{_etag_prefix}-{version}"'
+
+def not_modified(request, etag):
+    """A 304 response if the client already has etag, else None"""
+    if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+        return web.Response(status=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+def conditional_json_response(request, body, etag):
+    """JSON body with its ETag, or 304 if the client has it; larger bodies are gzipped if the client accepts it"""
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    response = web.Response(
+        body=body, content_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"}
+    )
+    if len(body) > 1024 and "gzip" in request.headers.get("Accept-Encoding", ""):
+        response.enable_compression(web.ContentCoding.gzip)
+    return response
+
+CONFIG_PAGE_SIZE = 100
+CONFIG_MAX_PAGE_SIZE = 1000
+
+def parse_catalog_query(query):
+    """Search filters and page bounds from /config query parameters; raises ValueError"""
+    downloaded = query.get("downloaded")
+    if downloaded not in (None, "", "true", "false"):
+        raise ValueError("downloaded must be true or false")
+    limit = int(query.get("limit", CONFIG_PAGE_SIZE))
+    if not 1 <= limit <= CONFIG_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {CONFIG_MAX_PAGE_SIZE}")
+    version, offset = parse_cursor(query.get("cursor"))
+    return {
+        "filters": {
+            "query": query.get("q"),
+            "folder": query.get("folder"),
+            "repo_id": query.get("repo"),
+            "downloaded": None if not downloaded else downloaded == "true",
+        },
+        "version": version,
+        "offset": offset,
+        "limit": limit,
+    }
+
+def catalog_page(filters, version, offset, limit):
+    """One page of matching entries, or None if the catalog changed since the cursor was issued"""
+    page = get_model_catalog().page(version, offset, limit, **filters)
+    if page is None:
+        return None
+    entries, total, next_cursor = page
+    return {"items": enrich_entries(entries), "total": total, "next_cursor": next_cursor}
+
 async def get_config(request):
-    logger.info(f"Config endpoint called: {request.path}")
-    downloader = get_model_downloader()
+    """
+    The catalog. Without query parameters, every entry as a list. With any
+    of q, folder, repo, downloaded, limit or cursor, one page of matches as
+    {"items", "total", "next_cursor"}; pass next_cursor back for the next page.
+    """
+    logger.debug(f"Config endpoint called: {request.path}")
     try:
-        with open(downloader.model_config_path, 'r') as f:
-            config = json.load(f)
-        return web.json_response(config)
+        catalog = get_model_catalog()
+        entries = catalog.entries()
+        metadata = get_hub_metadata()
+        # Stale metadata is refreshed in the background; the UI hears about it over the websocket
+        metadata.refresh_in_background(
+            entries, token=get_model_downloader().get_token(), on_done=send_catalog_event
+        )
+        query_hash = hashlib.sha1(request.query_string.encode("utf-8")).hexdigest()[:12]
+        versions = (catalog.version, catalog.status_version, metadata.version, get_tensor_index().version)
+        etag = make_etag(f"{'-'.join(map(str, versions))}-{query_hash}")
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+
+        if not request.query:
+            result = await asyncio.to_thread(enrich_entries, entries)
+        else:
+            try:
+                page = parse_catalog_query(request.query)
+            except ValueError as e:
+                return web.json_response({"error": f"Invalid query: {e}"}, status=400)
+            result = await asyncio.to_thread(catalog_page, **page)
+            if result is None:
+                return web.json_response({"error": "The model list changed; start again without a cursor"}, status=409)
+        return conditional_json_response(request, json.dumps(result).encode("utf-8"), etag)
     except Exception as e:
         logger.error(f"Error in config endpoint: {str(e)}")
         return web.json_response({"error": str(e)}, status=500)
 
+async def refresh_metadata_handler(request):
+    """Fetch Hub metadata now (all of it with "force": true) and wait for the result"""
+    try:
+        data = await request.json() if request.can_read_body else {}
+        changed = await get_hub_metadata().refresh(
+            get_model_catalog().entries(), token=get_model_downloader().get_token(), force=bool(data.get("force"))
+        )
+        if changed:
+            send_catalog_event()
+        return web.json_response({"changed": changed, "version": get_hub_metadata().version})
+    except Exception as e:
+        logger.error(f"Error refreshing Hub metadata: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+def index_entries(entries):
+    """Index records of catalog entries, reading headers that are not indexed yet (blocking)"""
+    index = get_tensor_index()
+    catalog = get_model_catalog()
+    records = {}
+    for entry in entries:
+        records.update(index.index_entry(entry, catalog.resolve_path(entry)))
+    index.save()
+    return records
+
+async def tensor_index_handler(request):
+    """
+    Indexed safetensors files, filtered by model, kind, architecture and
+    dtype. With model and tensors=true, also every tensor's name, dtype and
+    shape and the file's __metadata__.
+    """
+    try:
+        query = request.query
+        index = get_tensor_index()
+        model = query.get("model")
+        with_tensors = query.get("tensors") == "true"
+        if with_tensors and not model:
+            return web.json_response({"error": "tensors=true needs a model"}, status=400)
+        if model:
+            try:
+                entries = get_model_catalog().find(model)
+            except AmbiguousModelError as e:
+                return web.json_response({"error": str(e)}, status=409)
+            if not entries:
+                return web.json_response({"error": f"No matching model found for {model}"}, status=404)
+            # Files downloaded before indexing existed are read now, which only touches their headers
+            records = await asyncio.to_thread(index_entries, entries)
+            files = [{"path": path, **record} for path, record in records.items()]
+        else:
+            files = index.query()
+        filters = {key: query[key] for key in ("kind", "architecture", "dtype") if query.get(key)}
+        files = [item for item in files if all(item[key] == value for key, value in filters.items())]
+
+        query_hash = hashlib.sha1(request.query_string.encode("utf-8")).hexdigest()[:12]
+        etag = make_etag(f"index-{index.version}-{query_hash}")
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+        if with_tensors:
+            details = await asyncio.gather(*(asyncio.to_thread(index.tensors, item["path"]) for item in files))
+            for item, detail in zip(files, details):
+                item.update(detail or {"metadata": None, "tensors": None})
+        return conditional_json_response(request, json.dumps({"files": files}).encode("utf-8"), etag)
+    except Exception as e:
+        logger.error(f"Error in tensor index endpoint: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+async def tensor_index_backfill_handler(request):
+    """Index every downloaded model now (all of them again with "force": true) and report the counts"""
+    try:
+        data = await request.json() if request.can_read_body else {}
+        result = await asyncio.to_thread(get_tensor_index().backfill, get_model_catalog(), bool(data.get("force")))
+        return web.json_response(result)
+    except Exception as e:
+        logger.error(f"Error in tensor index backfill: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+# Serialized /active response, reused until the active config or model status changes
+_active_response_cache = {"key": None, "body": None}
+
 async def get_active_config(request):
-    logger.info(f"Active config endpoint called: {request.path}")
+    logger.debug(f"Active config endpoint called: {request.path}")
     downloader = get_model_downloader()
+    catalog = downloader.catalog
     
-    # Get active config and add download status
-    active_config = downloader.active_config.copy()
-    
-    # Check if each enabled model is downloaded
-    if not downloader.model_config_path.exists():
+    try:
+        model_status = catalog.status()
+    except FileNotFoundError:
         logger.error("Model config file not found")
         return web.json_response({"error": "Model config file not found"}, status=500)
-        
-    with open(downloader.model_config_path, 'r') as f:
-        config = json.load(f)
     
-    # Add download status for each model
-    model_status = {}
-    for model in config:
-        model_name = os.path.basename(model.get("local_path", "").rstrip('/'))
-        if model_name:
-            # Get the full path for the model
-            local_path = model.get("local_path", "")
-            base_model_path = model.get('base_model_path', os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'models'))
-            
-            # Prepend base_model_path to local_path if it's not an absolute path
-            if not os.path.isabs(local_path):
-                local_path = os.path.join(base_model_path, local_path)
-            
-            # Check if it's a repo download (no filename) or single file
-            if 'filename' not in model or not model.get('filename'):
-                # Full repo: check if directory exists
-                check_path = local_path.rstrip('/')
-                downloaded = os.path.isdir(check_path)
-                logger.info(f"Checking repository {model_name} at path: {local_path} - {'exists' if downloaded else 'not found'}")
-            else:
-                # Single file: check if file exists
-                downloaded = os.path.exists(local_path)
-                logger.info(f"Checking model file {model_name} at path: {local_path} - {'exists' if downloaded else 'not found'}")
-            
-            model_status[model_name] = {
-                "downloaded": downloaded,
-                "path": local_path
-            }
-    
-    active_config["model_status"] = model_status
-    return web.json_response(active_config)
+    key = (downloader.active_config_version, catalog.status_version)
+    CACHE_REQUESTS.inc(cache="active_response", result="hit" if _active_response_cache["key"] == key else "miss")
+    if _active_response_cache["key"] != key:
+        # Get active config and add download status
+        active_config = downloader.active_config.copy()
+        active_config["model_status"] = model_status
+        _active_response_cache["body"] = json.dumps(active_config).encode("utf-8")
+        _active_response_cache["key"] = key
+    return conditional_json_response(request, _active_response_cache["body"], make_etag("-".join(map(str, key))))
 
 async def update_active_config(request):
-    logger.info(f"Update active config endpoint called: {request.path}")
+    logger.debug(f"Update active config endpoint called: {request.path}")
     downloader = get_model_downloader()
     try:
         data = await request.json()
         downloader.active_config = data
+        downloader.active_config_version += 1
         downloader._save_active_config()
         return web.json_response({"status": "success"})
     except Exception as e:
@@ -396,15 +693,16 @@ async def update_active_config(request):
         return web.json_response({"error": str(e)}, status=500)
 
 async def download_model_handler(request):
-    logger.info(f"Download endpoint called: {request.path}")
+    logger.debug(f"Download endpoint called: {request.path}")
     downloader = get_model_downloader()
+    scheduler = get_download_scheduler()
     try:
         data = await request.json()
-        logger.info(f"Received data: {data}")
+        logger.debug(f"Received data: {data}")
         
         # Handle both single model and multiple models
         model_names = data.get("model_names", [data.get("model_name")])
-        if not model_names:
+        if not model_names or not all(model_names):
             logger.error("No model names provided in request")
             return web.json_response({"status": "Error: No model names provided"}, status=400)
         
@@ -412,42 +710,411 @@ async def download_model_handler(request):
             logger.error(f"Model config file not found at {downloader.model_config_path}")
             return web.json_response({"status": f"Error: Model config file not found at {downloader.model_config_path}"}, status=500)
         
-        with open(downloader.model_config_path, 'r') as f:
-            config = json.load(f)
-            logger.info(f"Loaded config: {config}")
+        priority = data.get("priority", DEFAULT_PRIORITY)
+        if priority not in PRIORITIES:
+            return web.json_response({"status": f"Error: Unknown priority {priority}"}, status=400)
+        
+        # Resolve every name before queuing anything, so an ambiguous name queues nothing
+        try:
+            matches = [(model_name, downloader.catalog.find(model_name)) for model_name in model_names]
+        except AmbiguousModelError as e:
+            logger.error(f"Refusing ambiguous model name: {e}")
+            return web.json_response({"status": f"Error: {e}", "error": str(e)}, status=409)
         
         results = []
-        for model_name in model_names:
-            model_found = False
-            for model in config:
-                if model_name in model.get("local_path", ""):
-                    model_found = True
-                    logger.info(f"Found matching model: {model}")
-                    
-                    try:
-                        # Run the download directly since we're already in an async context
-                        status = await downloader.download_model(model)
-                        logger.info(f"Download completed with status: {status}")
-                        results.append(f"{model_name}: {status}")
-                    except Exception as e:
-                        error_msg = f"Error downloading {model_name}: {str(e)}"
-                        logger.error(error_msg, exc_info=True)
-                        results.append(error_msg)
-            
-            if not model_found:
+        jobs = []
+        for model_name, models in matches:
+            if not models:
                 logger.error(f"No matching model found for {model_name}")
                 results.append(f"No matching model found for {model_name}")
+            for model in models:
+                if data.get("update"):
+                    model = {**model, "update": True}
+                job = await scheduler.submit(model_name, model, priority=priority, bandwidth_limit=data.get("bandwidth_limit"))
+                jobs.append(job)
+                results.append(f"{model_name}: queued as job {job.id}")
+        
+        # Optionally keep the old blocking behaviour for scripted callers
+        if data.get("wait"):
+            results = []
+            for job in jobs:
+                await scheduler.wait(job.id)
+                results.append(f"{job.model_name}: {job.result or job.error}")
         
-        # Return combined results
-        return web.json_response({"status": "\n".join(results)})
+        return web.json_response({
+            "status": "\n".join(results),
+            "jobs": [job.to_dict() for job in jobs],
+        })
             
     except Exception as e:
         logger.error(f"Error in download endpoint: {str(e)}", exc_info=True)
         return web.json_response({"error": str(e)}, status=500)
 
+async def list_jobs_handler(request):
+    scheduler = get_download_scheduler()
+    return web.json_response({
+        "jobs": [job.to_dict() for job in scheduler.list_jobs()],
+        "queue_depth": scheduler.queue_depth(),
+    })
+
+async def get_job_handler(request):
+    job = get_download_scheduler().get(request.match_info["job_id"])
+    if job is None:
+        return web.json_response({"error": "Job not found"}, status=404)
+    return web.json_response(job.to_dict())
+
+async def blob_store_handler(request):
+    blobs = get_blob_store()
+    if blobs is None:
+        return web.json_response({"error": "Blob store is disabled"}, status=404)
+    return web.json_response(await asyncio.to_thread(blobs.stats))
+
+async def serve_blob_handler(request):
+    """
+    Read-only access to a stored blob, so other workers can use this one as
+    a mirror. Only with serve_blobs on and a blob_token set, and only to
+    requests carrying that token: blob keys are public Hub hashes, so
+    anyone could otherwise fetch gated weights.
+    """
+    blobs = get_blob_store()
+    settings = get_model_downloader().settings
+    if blobs is None or not settings["serve_blobs"] or not settings["blob_token"]:
+        return web.json_response({"error": "Blob serving is disabled"}, status=404)
+    if not peer_authorized(request.headers.get("Authorization"), settings["blob_token"]):
+        return web.json_response({"error": "Missing or wrong blob token"}, status=401)
+    key = request.match_info["key"]
+    if normalize_key(key) != key:
+        return web.json_response({"error": "Invalid blob key"}, status=400)
+    path = blobs.blob_path(key)
+    if not os.path.isfile(path):
+        return web.json_response({"error": "Blob not found"}, status=404)
+    # FileResponse handles HEAD and Range requests, so peers can use parallel range downloads
+    return web.FileResponse(path)
+
+async def storage_handler(request):
+    """Free space, quota and every downloaded catalog model, least recently used first"""
+    storage = get_storage_manager()
+    try:
+        models = await asyncio.to_thread(storage.usage)
+        for model in models:
+            del model["inodes"]
+        return web.json_response({
+            "free_bytes": free_bytes(DEFAULT_MODELS_DIR),
+            "min_free_bytes": storage.min_free,
+            "quota_bytes": storage.quota,
+            "models": models,
+        })
+    except Exception as e:
+        logger.error(f"Error in storage endpoint: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+async def evict_handler(request):
+    """
+    Report (dry_run, the default) or carry out an LRU eviction that brings
+    the catalog under quota and frees "bytes" more on the models volume.
+    """
+    storage = get_storage_manager()
+    try:
+        data = await request.json() if request.can_read_body else {}
+        plan = await asyncio.to_thread(storage.plan_eviction, int(data.get("bytes") or 0), DEFAULT_MODELS_DIR)
+        plan["dry_run"] = bool(data.get("dry_run", True))
+        if not plan["dry_run"]:
+            plan["evicted"] = await asyncio.to_thread(storage.evict, plan)
+        return web.json_response(plan)
+    except Exception as e:
+        logger.error(f"Error in evict endpoint: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+REGISTRY.gauge(
+    "hfdl_queue_depth", "Download jobs waiting to start",
+    collect=lambda: get_download_scheduler().queue_depth(),
+)
+REGISTRY.gauge(
+    "hfdl_running_jobs", "Download jobs currently running",
+    collect=lambda: len(get_download_scheduler().active_jobs()),
+)
+REGISTRY.gauge(
+    "hfdl_open_circuits", "Hosts whose requests are currently paused by the circuit breaker",
+    collect=lambda: len(get_circuit_breaker().open_hosts()),
+)
+REGISTRY.gauge(
+    "hfdl_throughput_bytes_per_second", "Combined download speed of running jobs",
+    collect=lambda: sum(job.progress.snapshot()["speed"] for job in get_download_scheduler().active_jobs()),
+)
+
+async def metrics_handler(request):
+    """Prometheus text exposition of download counters, histograms and gauges"""
+    return web.Response(
+        body=REGISTRY.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+async def blob_gc_handler(request):
+    blobs = get_blob_store()
+    if blobs is None:
+        return web.json_response({"error": "Blob store is disabled"}, status=404)
+    try:
+        data = await request.json() if request.can_read_body else {}
+        result = await asyncio.to_thread(blobs.gc, bool(data.get("dry_run", False)))
+        return web.json_response(result)
+    except Exception as e:
+        logger.error(f"Error in blob GC: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+async def verify_handler(request):
+    """Re-hash downloaded single files and compare them against their expected sha256"""
+    downloader = get_model_downloader()
+    catalog = downloader.catalog
+    try:
+        data = await request.json() if request.can_read_body else {}
+        model_names = data.get("model_names")
+        if model_names:
+            try:
+                entries = [entry for name in model_names for entry in catalog.find(name)]
+            except AmbiguousModelError as e:
+                return web.json_response({"error": str(e)}, status=409)
+        else:
+            entries = catalog.entries()
+        
+        targets = []
+        for entry in entries:
+            path = catalog.resolve_path(entry)
+            if not is_repo_entry(entry) and os.path.isfile(path):
+                targets.append((entry, path))
+        
+        token = downloader.get_token()
+        
+        def expected_for(entry):
+            metadata = None
+            if not as_sha256(entry.get('sha256')):
+                metadata = get_model_fetcher().file_metadata(entry['repo_id'], entry.get('subfolder', ''), entry['filename'], token, entry.get('revision'))
+            return as_sha256(entry.get('sha256')) or (as_sha256(metadata.etag) if metadata else None)
+        
+        expected = await asyncio.gather(*(asyncio.to_thread(expected_for, entry) for entry, _ in targets))
+        results = await asyncio.to_thread(
+            verify_files,
+            [(path, sha256) for (_, path), sha256 in zip(targets, expected)],
+            downloader.settings["verify_workers"],
+        )
+        for (entry, _), result in zip(targets, results):
+            result["model_name"] = model_key(entry)
+        
+        failed = [result for result in results if result["verified"] is False or result["error"]]
+        return web.json_response({"results": results, "failed": len(failed)})
+    except Exception as e:
+        logger.error(f"Error in verify endpoint: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+async def get_progress_handler(request):
+    scheduler = get_download_scheduler()
+    return web.json_response({
+        job.id: {"model_name": job.model_name, "state": job.state, **job.progress.snapshot()}
+        for job in scheduler.active_jobs()
+    })
+
+async def prefetch_models(prompt, priority=None):
+    """Submit download jobs for catalog models a prompt needs but that are missing"""
+    downloader = get_model_downloader()
+    scheduler = get_download_scheduler()
+    priority = priority or downloader.settings["prefetch_priority"]
+    jobs = []
+    skipped = []
+    # Every model a queued prompt loads counts as used, for LRU eviction
+    storage = get_storage_manager()
+    for entry in match_entries(downloader.catalog, referenced_models(prompt)):
+        storage.touch(entry)
+    await asyncio.to_thread(storage.save)
+    for entry in missing_models(downloader.catalog, prompt):
+        name = model_key(entry)
+        is_protected = entry.get('protected', False) or entry.get('license', {}).get('required', False)
+        if is_protected and not downloader.is_logged_in():
+            skipped.append(name)
+            continue
+        jobs.append(await scheduler.submit(name, entry, priority=priority))
+    if jobs:
+        logger.info(f"Prefetching {len(jobs)} models for queued prompt: {', '.join(job.model_name for job in jobs)}")
+    if skipped:
+        logger.warning(f"Not prefetching gated models without a login: {', '.join(skipped)}")
+    return jobs, skipped
+
+def on_prompt_handler(json_data):
+    """
+    PromptServer hook, called on the event loop for every prompt POSTed to
+    /prompt before it is validated and queued. Downloads are only submitted
+    here; the prompt itself is passed on unchanged.
+    """
+    async def prefetch(prompt):
+        try:
+            await prefetch_models(prompt)
+        except Exception as e:
+            logger.error(f"Error prefetching models for prompt: {e}")
+
+    if get_model_downloader().settings["prefetch_on_prompt"]:
+        prompt = json_data.get("prompt")
+        if isinstance(prompt, dict):
+            asyncio.ensure_future(prefetch(prompt))
+    return json_data
+
+async def prefetch_handler(request):
+    """Prefetch (or with dry_run, just list) the missing models used by an API-format prompt"""
+    downloader = get_model_downloader()
+    try:
+        data = await request.json()
+        prompt = data.get("prompt")
+        if not isinstance(prompt, dict):
+            return web.json_response({"error": "Missing prompt"}, status=400)
+        priority = data.get("priority")
+        if priority is not None and priority not in PRIORITIES:
+            return web.json_response({"error": f"Unknown priority {priority}"}, status=400)
+        if data.get("dry_run"):
+            return web.json_response({"missing": [model_key(entry) for entry in missing_models(downloader.catalog, prompt)]})
+        jobs, skipped = await prefetch_models(prompt, priority)
+        return web.json_response({"jobs": [job.to_dict() for job in jobs], "skipped": skipped})
+    except Exception as e:
+        logger.error(f"Error in prefetch endpoint: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+# Provisioning runs started through the API, by id; finished ones beyond the limit are dropped
+provision_runs = {}
+PROVISION_HISTORY = 20
+
+def remember_provision_run(provisioning):
+    provision_runs[provisioning.id] = provisioning
+    finished = sorted((run for run in provision_runs.values() if run.finished), key=lambda run: run.created_at)
+    for run in finished[:max(0, len(finished) - PROVISION_HISTORY)]:
+        del provision_runs[run.id]
+
+async def provision_handler(request):
+    """
+    Queue every entry of a lock file as a download job and return the plan
+    with its job IDs right away; the report is served by
+    GET /provision/{run_id} once all of them finished. Body:
+    {"lockfile": {...}} or {"models": [...]}, plus optional dry_run, verify,
+    priority, allow_unpinned and wait (respond with the report instead).
+    """
+    downloader = get_model_downloader()
+    scheduler = get_download_scheduler()
+    try:
+        data = await request.json()
+        priority = data.get("priority", DEFAULT_PRIORITY)
+        if priority not in PRIORITIES:
+            return web.json_response({"error": f"Unknown priority {priority}"}, status=400)
+        try:
+            entries = parse_lockfile(data.get("lockfile", data.get("models")), strict=not data.get("allow_unpinned"))
+            # Same base path the jobs resolve local_path against
+            plan = plan_provisioning(entries, downloader.catalog.default_base_path, resolve=downloader.catalog.resolve_path)
+        except LockfileError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+        if data.get("dry_run"):
+            # Only looks at the disk, so it is answered right away
+            return web.json_response(await provision(plan, None, dry_run=True))
+
+        # Queued now, so the response can name the jobs
+        jobs = {}
+        for group in plan["downloads"]:
+            job = await scheduler.submit(model_key(group["entry"]), group["entry"], priority=priority)
+            jobs[group["path"]] = job
+            group["item"]["job_id"] = job.id
+
+        async def run(entry, path, details):
+            job = jobs[path]
+            await scheduler.wait(job.id)
+            details.update(job.details)
+            details["job_id"] = job.id
+            return job.result or job.error or job.state
+
+        provisioning = ProvisioningRun(plan).start(
+            run,
+            # The scheduler applies the concurrency and per-host limits
+            concurrency=len(plan["downloads"]),
+            verify=bool(data.get("verify")),
+            verify_workers=downloader.settings["verify_workers"],
+        )
+        remember_provision_run(provisioning)
+
+        # Optionally keep the old blocking behaviour for scripted callers
+        if data.get("wait"):
+            await provisioning.wait()
+            if provisioning.report is None:
+                return web.json_response({"error": provisioning.error}, status=500)
+            return web.json_response(provisioning.report)
+        return web.json_response({
+            **provisioning.to_dict(),
+            "status_url": f"/hal-fun-downloader/provision/{provisioning.id}",
+        })
+    except Exception as e:
+        logger.error(f"Error in provision endpoint: {e}", exc_info=True)
+        return web.json_response({"error": str(e)}, status=500)
+
+async def provision_status_handler(request):
+    """A provisioning run's items and job IDs while it runs, and its report once it finished"""
+    provisioning = provision_runs.get(request.match_info["run_id"])
+    if provisioning is None:
+        return web.json_response({"error": "Provisioning run not found"}, status=404)
+    return web.json_response(provisioning.to_dict())
+
+async def update_job_handler(request):
+    """Change a job's priority or bandwidth limit while it is queued or running"""
+    scheduler = get_download_scheduler()
+    try:
+        data = await request.json()
+        job = await scheduler.update_job(
+            request.match_info["job_id"],
+            priority=data.get("priority"),
+            bandwidth_limit=data.get("bandwidth_limit"),
+        )
+        if job is None:
+            return web.json_response({"error": "Job not found"}, status=404)
+        return web.json_response(job.to_dict())
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+# Settings that /limits may change at runtime
+LIMIT_SETTINGS = ("bandwidth_limit", "max_concurrent_downloads", "max_downloads_per_host", "host_limits")
+
+async def get_limits_handler(request):
+    settings = get_model_downloader().settings
+    return web.json_response({key: settings[key] for key in LIMIT_SETTINGS})
+
+async def update_limits_handler(request):
+    """Adjust bandwidth and concurrency limits without restarting running downloads"""
+    downloader = get_model_downloader()
+    scheduler = get_download_scheduler()
+    try:
+        data = await request.json()
+        changes = {key: data[key] for key in LIMIT_SETTINGS if key in data}
+        await scheduler.configure(
+            max_concurrent=changes.get("max_concurrent_downloads"),
+            max_per_host=changes.get("max_downloads_per_host"),
+            host_limits=changes.get("host_limits"),
+            # 0 lifts the limit; None would mean "unchanged"
+            bandwidth_limit=(changes["bandwidth_limit"] or 0) if "bandwidth_limit" in changes else None,
+        )
+        downloader.settings.update(changes)
+        downloader.save_settings()
+        return web.json_response({key: downloader.settings[key] for key in LIMIT_SETTINGS})
+    except Exception as e:
+        logger.error(f"Error updating limits: {e}")
+        return web.json_response({"error": str(e)}, status=400)
+
+async def cancel_job_handler(request):
+    scheduler = get_download_scheduler()
+    job_id = request.match_info["job_id"]
+    if scheduler.get(job_id) is None:
+        return web.json_response({"error": "Job not found"}, status=404)
+    if not await scheduler.cancel(job_id):
+        return web.json_response({"error": "Job already finished"}, status=409)
+    return web.json_response(scheduler.get(job_id).to_dict())
+
+def hub_login(token):
+    # huggingface_hub is imported here, in the worker thread, rather than at startup
+    from huggingface_hub import login
+    login(token=token)
+
 # Add new login endpoint
 async def login_handler(request):
-    logger.info("Login endpoint called")
+    logger.debug("Login endpoint called")
     try:
         data = await request.json()
         token = data.get("token")
@@ -457,10 +1124,11 @@ async def login_handler(request):
 
         # Try to login with the token
         try:
-            login(token=token)
+            # login() validates the token over the network, keep it off the event loop
+            await asyncio.to_thread(hub_login, token)
             downloader = get_model_downloader()
-            if downloader.save_token(token):
-                downloader.update_license_states()  # Update license states after login
+            if await asyncio.to_thread(downloader.save_token, token):
+                await downloader.update_license_states(force=True)  # Update license states after login
                 return web.json_response({"status": "success", "token": token})
             else:
                 return web.json_response({"error": "Failed to save token"}, status=500)
@@ -473,17 +1141,15 @@ async def login_handler(request):
         return web.json_response({"error": str(e)}, status=500)
 
 async def logout_handler(request):
-    logger.info("Logout endpoint called")
+    logger.debug("Logout endpoint called")
     try:
         downloader = get_model_downloader()
         
         # Set all license states to false for gated models
-        with open(downloader.model_config_path, 'r') as f:
-            config = json.load(f)
-            for model in config:
-                if model.get("license", {}).get("required"):
-                    key = f"{model['repo_id']}/{model['filename']}"
-                    downloader.license_states[key] = False
+        for model in downloader.catalog.entries():
+            if model.get("license", {}).get("required"):
+                key = f"{model['repo_id']}/{model['filename']}"
+                downloader.set_license_state(key, False)
         
         # Save the updated license states
         downloader.save_license_states()
@@ -498,7 +1164,7 @@ async def logout_handler(request):
         return web.json_response({"error": str(e)}, status=500)
 
 async def get_login_status(request):
-    logger.info("Login status endpoint called")
+    logger.debug("Login status endpoint called")
     try:
         downloader = get_model_downloader()
         is_logged_in = downloader.is_logged_in()
@@ -509,7 +1175,7 @@ async def get_login_status(request):
 
 # Add new check-license endpoint
 async def check_license_handler(request):
-    logger.info("Check license endpoint called")
+    logger.debug("Check license endpoint called")
     try:
         data = await request.json()
         repo_id = data.get("repo_id")
@@ -526,31 +1192,24 @@ async def check_license_handler(request):
             
         key = f"{repo_id}/{filename}"
         
-        # Check if we have a stored state
-        if key in downloader.license_states:
-            return web.json_response({"accepted": downloader.license_states[key]})
-            
-        # If no stored state, check the license status
-        try:
-            hf_hub_download(
-                repo_id=repo_id,
-                filename=filename,
-                token=downloader.get_token(),
-                local_dir=os.path.dirname(os.path.join(downloader.config_dir, filename)),
-                force_download=False,
-                resume_download=False,
-            )
-            downloader.license_states[key] = True
-            downloader.save_license_states()
-            return web.json_response({"accepted": True})
-        except Exception as e:
-            if "401" in str(e) or "403" in str(e):
-                downloader.license_states[key] = False
-                downloader.save_license_states()
-                return web.json_response({"accepted": False})
-            else:
-                logger.error(f"Error checking license for {key}: {e}")
-                return web.json_response({"error": str(e)}, status=500)
+        # Check if we have a fresh stored state
+        accepted = downloader.cached_license_state(key)
+        if accepted is not None:
+            return web.json_response({"accepted": accepted})
+        
+        # If no stored state, probe the file's metadata (no download)
+        path = filename
+        for model in downloader.catalog.by_repo(repo_id):
+            if model.get("filename") == filename:
+                path = "/".join(p for p in (model.get("subfolder"), filename) if p)
+                break
+        accepted = await get_access_prober().probe(repo_id, path, token=downloader.get_token())
+        if accepted is None:
+            logger.error(f"Error checking license for {key}")
+            return web.json_response({"error": f"Could not check license for {key}"}, status=502)
+        downloader.set_license_state(key, accepted)
+        downloader.save_license_states()
+        return web.json_response({"accepted": accepted})
                 
     except Exception as e:
         logger.error(f"Check license handler error: {e}")
@@ -560,28 +1219,84 @@ async def check_license_handler(request):
 logger.info("=== Initializing hal.fun model downloader ===")
 
 def register_routes(server):
+    # A second import of this module (e.g. under another name) must not add every route again
+    if getattr(server, "_hal_fun_downloader_routes", False):
+        logger.debug("Routes already registered")
+        return
+    server._hal_fun_downloader_routes = True
     logger.info("Registering routes with server")
     server.routes.get("/hal-fun-downloader/config")(get_config)
+    server.routes.post("/hal-fun-downloader/metadata/refresh")(refresh_metadata_handler)
     server.routes.get("/hal-fun-downloader/active")(get_active_config)
     server.routes.post("/hal-fun-downloader/active")(update_active_config)
     server.routes.post("/hal-fun-downloader/download")(download_model_handler)
+    server.routes.get("/hal-fun-downloader/jobs")(list_jobs_handler)
+    server.routes.get("/hal-fun-downloader/jobs/{job_id}")(get_job_handler)
+    server.routes.post("/hal-fun-downloader/jobs/{job_id}/cancel")(cancel_job_handler)
+    server.routes.post("/hal-fun-downloader/jobs/{job_id}/update")(update_job_handler)
+    server.routes.get("/hal-fun-downloader/limits")(get_limits_handler)
+    server.routes.post("/hal-fun-downloader/limits")(update_limits_handler)
+    server.routes.get("/hal-fun-downloader/progress")(get_progress_handler)
+    server.routes.get("/hal-fun-downloader/metrics")(metrics_handler)
+    server.routes.get("/hal-fun-downloader/blobs")(blob_store_handler)
+    server.routes.post("/hal-fun-downloader/blobs/gc")(blob_gc_handler)
+    server.routes.get("/hal-fun-downloader/blobs/{key}")(serve_blob_handler)
+    server.routes.get("/hal-fun-downloader/storage")(storage_handler)
+    server.routes.post("/hal-fun-downloader/storage/evict")(evict_handler)
+    server.routes.post("/hal-fun-downloader/verify")(verify_handler)
+    server.routes.get("/hal-fun-downloader/index")(tensor_index_handler)
+    server.routes.post("/hal-fun-downloader/index/backfill")(tensor_index_backfill_handler)
+    server.routes.post("/hal-fun-downloader/prefetch")(prefetch_handler)
+    server.routes.post("/hal-fun-downloader/provision")(provision_handler)
+    server.routes.get("/hal-fun-downloader/provision/{run_id}")(provision_status_handler)
     server.routes.post("/hal-fun-downloader/login")(login_handler)
     server.routes.post("/hal-fun-downloader/logout")(logout_handler)
     server.routes.get("/hal-fun-downloader/login-status")(get_login_status)
     server.routes.post("/hal-fun-downloader/check-license")(check_license_handler)  # Add new route
     logger.info("Routes registered successfully")
+    if hasattr(server, "add_on_prompt_handler"):
+        server.add_on_prompt_handler(on_prompt_handler)
+    # Reading settings and job state waits until the server is running, off the import path
+    if getattr(server, "loop", None) is not None:
+        server.loop.call_soon_threadsafe(start_background_work)
+
+def start_background_work():
+    """Resume unfinished downloads, keep model status fresh and index existing files; runs on the server's loop"""
+    try:
+        resume_download_jobs()
+        start_status_polling()
+        if get_model_downloader().settings["index_safetensors"]:
+            asyncio.ensure_future(backfill_tensor_index())
+    except Exception as e:
+        logger.error(f"Error starting background work: {e}", exc_info=True)
 
-# Wait for server to be ready
+async def backfill_tensor_index():
+    """Index models downloaded before the tensor index existed; already indexed files cost a stat"""
+    try:
+        result = await asyncio.to_thread(get_tensor_index().backfill, get_model_catalog())
+        if result["indexed"] or result["removed"]:
+            logger.info(f"Tensor index: read {result['indexed']} headers, removed {result['removed']} files")
+    except Exception as e:
+        logger.error(f"Error backfilling the tensor index: {e}")
+
+def start_status_polling():
+    """Keep cached model status fresh with a cheap periodic stat of each entry"""
+    interval = get_model_downloader().settings["status_poll_interval"]
+    get_model_catalog().start_polling(interval)
+
+def resume_download_jobs():
+    """Restart jobs that were still queued or running when ComfyUI last stopped"""
+    scheduler = get_download_scheduler()
+    if scheduler.queue_depth():
+        logger.info(f"Resuming {scheduler.queue_depth()} unfinished download jobs")
+        scheduler.start()
+
+# ComfyUI creates its server before it loads custom nodes
 server = PromptServer.instance
 if server:
     register_routes(server)
 else:
-    logger.warning("No server instance found, will register routes when server is ready")
-    # Register a callback to be called when the server is ready
-    PromptServer.instance = None
-    def on_server_ready(server):
-        register_routes(server)
-    PromptServer.on_server_ready = on_server_ready
+    logger.warning("No server instance found, routes not registered")
 
 # A dictionary that contains all nodes you want to export with their names
 NODE_CLASS_MAPPINGS = {
@@ -605,12 +1320,6 @@ def register_download_node():
     else:
         logger.warning("Could not register download node - server or nodes not ready")
 
-# Wait for server to be ready and register the download node
-server = PromptServer.instance
+# Register the download node with the server
 if server:
     register_download_node()
-else:
-    logger.warning("No server instance found, will register download node when server is ready")
-    def on_server_ready(server):
-        register_download_node()
-    PromptServer.on_server_ready = on_server_ready 
\ No newline at end of file
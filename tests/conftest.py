@@ -0,0 +1,45 @@
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+import downloader.fetcher
+from downloader.fetcher import ModelFetcher
+from downloader.settings import DEFAULT_SETTINGS
+
+HUB_COMMIT = "c0ffee" * 6 + "c0ff"
+
+
+@pytest.fixture
+def make_fetcher(tmp_path, monkeypatch):
+    """
+    Factory for a ModelFetcher on tmp_path whose Hub is faked:
+    make_fetcher(files, contents) lists files ({path: {"size", "etag"}}) at
+    HUB_COMMIT and serves contents[path] for each download. Returns the
+    fetcher and the list of paths it downloaded, in order.
+    """
+
+    def make(files, contents):
+        settings = dict(DEFAULT_SETTINGS, min_free_space_gb=0, retry_attempts=1, blob_store_dir=str(tmp_path / "blobs"))
+        fetcher = ModelFetcher(settings, str(tmp_path / "models"))
+        monkeypatch.setattr(downloader.fetcher, "remote_manifest", lambda *args: (HUB_COMMIT, files))
+
+        def file_metadata(repo_id, subfolder, filename, token, revision=None):
+            listed = files["/".join(p for p in (subfolder, filename) if p)]
+            return SimpleNamespace(size=listed["size"], etag=f'"{listed["etag"]}"')
+
+        downloads = []
+
+        async def download_from_hub(model_config, local_path, token, expected_sha256, progress=None, throttle=None):
+            path = "/".join(p for p in (model_config.get("subfolder"), model_config["filename"]) if p)
+            downloads.append(path)
+            with open(local_path, "wb") as f:
+                f.write(contents[path])
+            # Like the hub engine: the file is only hashed when there is a sha256 to check
+            return hashlib.sha256(contents[path]).hexdigest() if expected_sha256 else None
+
+        fetcher.file_metadata = file_metadata
+        fetcher._download_from_hub = download_from_hub
+        return fetcher, downloads
+
+    return make
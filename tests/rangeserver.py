@@ -0,0 +1,82 @@
+import hashlib
+
+from aiohttp import web
+
+
+class RangeServer:
+    """
+    A local HTTP stand-in for the Hub's file server: serves one file at
+    /file with Range support and records every request it answers.
+
+    ranges=False stops advertising Accept-Ranges and answers range requests
+    with the whole file (200). ignore_ranges keeps advertising ranges but
+    still answers 200. short_ranges and failed_ranges are sets of range
+    start offsets that get a truncated body or an HTTP 500. /redirect sends
+    the client to /file on "localhost" instead of 127.0.0.1, i.e. another host.
+    """
+
+    def __init__(self, data, etag='"v1"', ranges=True, ignore_ranges=False, short_ranges=(), failed_ranges=()):
+        self.data = data
+        self.etag = etag
+        self.ranges = ranges
+        self.ignore_ranges = ignore_ranges
+        self.short_ranges = set(short_ranges)
+        self.failed_ranges = set(failed_ranges)
+        self.requests = []
+        self._runner = None
+        self.port = None
+
+    @property
+    def sha256(self):
+        return hashlib.sha256(self.data).hexdigest()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/file"
+
+    @property
+    def redirect_url(self):
+        return f"http://127.0.0.1:{self.port}/redirect"
+
+    def range_requests(self):
+        return [request["range"] for request in self.requests if request["method"] == "GET" and request["range"]]
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_route("*", "/file", self.file_handler)
+        app.router.add_route("*", "/redirect", self.redirect_handler)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._runner.cleanup()
+
+    async def redirect_handler(self, request):
+        self.requests.append({"method": request.method, "path": "/redirect", "range": None, "headers": dict(request.headers)})
+        raise web.HTTPFound(f"http://localhost:{self.port}/file")
+
+    async def file_handler(self, request):
+        byte_range = request.headers.get("Range")
+        self.requests.append({"method": request.method, "path": "/file", "range": byte_range, "headers": dict(request.headers)})
+        headers = {"ETag": self.etag}
+        if self.ranges:
+            headers["Accept-Ranges"] = "bytes"
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(self.data))
+            return web.Response(status=200, headers=headers)
+
+        if not byte_range or not self.ranges or self.ignore_ranges:
+            return web.Response(status=200, body=self.data, headers=headers)
+
+        start, end = (int(value) for value in byte_range.split("=", 1)[1].split("-"))
+        if start in self.failed_ranges:
+            return web.Response(status=500, text="injected failure")
+        body = self.data[start:end + 1]
+        if start in self.short_ranges:
+            body = body[: len(body) // 2]
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(self.data)}"
+        return web.Response(status=206, body=body, headers=headers)
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from downloader.blobs import BlobStore
+from downloader.integrity import git_blob_sha1
+
+DATA = b"safetensors bytes " * 1000
+KEY = hashlib.sha256(DATA).hexdigest()
+
+
+def stored(tmp_path, data=DATA, key=KEY):
+    """A blob store holding data under key, and a model file hardlinked to it"""
+    store = BlobStore(tmp_path / "blobs")
+    model = tmp_path / "models" / "model.safetensors"
+    model.parent.mkdir(parents=True)
+    model.write_bytes(data)
+    assert store.ingest(str(model), key)
+    return store, model
+
+
+def test_check_accepts_intact_blobs(tmp_path):
+    store, model = stored(tmp_path)
+    assert store.check(KEY, len(DATA))
+
+    small = tmp_path / "config.json"
+    small.write_bytes(b"{}")
+    sha1 = git_blob_sha1(str(small))
+    assert store.ingest(str(small), sha1)
+    assert store.check(sha1, 2)
+
+
+def test_check_removes_blob_of_damaged_model_file(tmp_path):
+    store, model = stored(tmp_path)
+    with open(model, "r+b") as f:
+        f.truncate(10)
+
+    assert not store.check(KEY, len(DATA), damaged=str(model))
+    assert not os.path.exists(store.blob_path(KEY))
+    # The model file itself is left for the download to replace
+    assert model.stat().st_size == 10
+
+
+def test_check_removes_blob_with_wrong_size_or_contents(tmp_path):
+    store, model = stored(tmp_path)
+    assert not store.check(KEY, len(DATA) + 1)
+    assert not store.has(KEY)
+
+    store, model = stored(tmp_path / "again")
+    with open(model, "r+b") as f:
+        f.write(b"X")
+    assert not store.check(KEY, len(DATA))
+    assert not store.has(KEY)
+
+
+def test_ingest_replaces_damaged_blob(tmp_path):
+    store, model = stored(tmp_path)
+    with open(store.blob_path(KEY), "r+b") as f:
+        f.write(b"X")
+    os.remove(model)
+
+    fresh = tmp_path / "fresh.safetensors"
+    fresh.write_bytes(DATA)
+    assert store.ingest(str(fresh), KEY)
+    assert os.path.samefile(store.blob_path(KEY), fresh)
+    assert fresh.read_bytes() == DATA
+
+
+def test_ingest_links_intact_blob_over_copy(tmp_path):
+    store, model = stored(tmp_path)
+    copy = tmp_path / "copy.safetensors"
+    copy.write_bytes(DATA)
+    assert store.ingest(str(copy), KEY)
+    assert os.path.samefile(store.blob_path(KEY), copy)
+
+
+@pytest.fixture
+def hub_fetcher(make_fetcher):
+    return make_fetcher({"model.safetensors": {"size": len(DATA), "etag": KEY}}, {"model.safetensors": DATA})
+
+
+def test_truncated_model_file_is_downloaded_again(tmp_path, hub_fetcher):
+    fetcher, downloads = hub_fetcher
+    entry = {"repo_id": "org/repo", "filename": "model.safetensors"}
+    local_path = str(tmp_path / "models" / "checkpoints" / "model.safetensors")
+
+    status = asyncio.run(fetcher.download(entry, local_path))
+    assert status.startswith("Successfully downloaded")
+    assert os.path.samefile(fetcher.blob_store.blob_path(KEY), local_path)
+
+    with open(local_path, "r+b") as f:
+        f.truncate(10)
+    status = asyncio.run(fetcher.download(entry, local_path))
+
+    assert status.startswith("Successfully downloaded")
+    assert len(downloads) == 2
+    with open(local_path, "rb") as f:
+        assert f.read() == DATA
+    assert fetcher.blob_store.check(KEY, len(DATA))
+
+
+def test_second_entry_is_linked_from_checked_blob(tmp_path, hub_fetcher):
+    fetcher, downloads = hub_fetcher
+    first = str(tmp_path / "models" / "checkpoints" / "model.safetensors")
+    second = str(tmp_path / "models" / "unet" / "model.safetensors")
+    entry = {"repo_id": "org/repo", "filename": "model.safetensors"}
+    asyncio.run(fetcher.download(entry, first))
+
+    status = asyncio.run(fetcher.download(entry, second))
+    assert "from blob store" in status
+    assert len(downloads) == 1
+
+    # Same size, different bytes: only the hash shows the damage
+    with open(first, "r+b") as f:
+        f.write(b"X")
+    third = str(tmp_path / "models" / "diffusion_models" / "model.safetensors")
+    status = asyncio.run(fetcher.download(entry, third))
+    assert status.startswith("Successfully downloaded")
+    assert len(downloads) == 2
+    with open(third, "rb") as f:
+        assert f.read() == DATA
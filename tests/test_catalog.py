@@ -0,0 +1,130 @@
+import json
+import os
+
+import pytest
+
+from downloader.catalog import AmbiguousModelError, ModelCatalog, parse_cursor
+
+MODELS = [
+    {"repo_id": "h94/IP-Adapter", "subfolder": "models/image_encoder", "filename": "model.safetensors", "local_path": "clip_vision/ip-adapter-sd15.safetensors"},
+    {"repo_id": "h94/IP-Adapter", "subfolder": "sdxl_models/image_encoder", "filename": "model.safetensors", "local_path": "clip_vision/ip-adapter-sdxl.safetensors"},
+    {"repo_id": "org/style", "filename": "style.safetensors", "local_path": "loras/style.safetensors"},
+    {"repo_id": "org/style", "filename": "style.safetensors", "local_path": "loras/style.safetensors"},
+]
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = tmp_path / "model_config.json"
+    path.write_text(json.dumps(MODELS))
+    return ModelCatalog(path, str(tmp_path / "models"))
+
+
+def test_local_path_selects_one_entry(catalog):
+    assert catalog.find("clip_vision/ip-adapter-sdxl.safetensors") == [MODELS[1]]
+
+
+def test_shared_file_name_is_refused(catalog):
+    with pytest.raises(AmbiguousModelError) as e:
+        catalog.find("model.safetensors")
+    assert e.value.local_paths == ["clip_vision/ip-adapter-sd15.safetensors", "clip_vision/ip-adapter-sdxl.safetensors"]
+    with pytest.raises(AmbiguousModelError):
+        catalog.find("ip-adapter")
+    assert len(catalog.candidates("model.safetensors")) == 2
+
+
+def test_unique_names_still_match(catalog):
+    # Duplicate entries for one destination are a single model
+    assert len(catalog.find("style.safetensors")) == 2
+    assert len(catalog.find("style")) == 2
+    assert catalog.find("ip-adapter-sd15") == [MODELS[0]]
+    assert catalog.find("missing") == []
+
+
+def folder_catalog(tmp_path, entries):
+    dirs = {"loras": [str(tmp_path / "models" / "loras"), str(tmp_path / "extra" / "loras")]}
+    path = tmp_path / "model_config.json"
+    path.write_text(json.dumps(entries))
+    return ModelCatalog(path, str(tmp_path / "models"), lambda folder: dirs.get(folder))
+
+
+def test_candidate_paths_span_folder_directories(tmp_path):
+    lora = {"repo_id": "org/style", "filename": "style.safetensors", "local_path": "loras/sub/style.safetensors"}
+    vae = {"repo_id": "org/vae", "filename": "vae.safetensors", "local_path": "vae/vae.safetensors"}
+    pinned = dict(lora, base_model_path=str(tmp_path / "elsewhere"))
+    catalog = folder_catalog(tmp_path, [lora, vae])
+
+    assert catalog.candidate_paths(lora) == [
+        str(tmp_path / "models" / "loras" / "sub" / "style.safetensors"),
+        str(tmp_path / "extra" / "loras" / "sub" / "style.safetensors"),
+    ]
+    # Folders ComfyUI does not know and base_model_path resolve as they always did
+    assert catalog.candidate_paths(vae) == [str(tmp_path / "models" / "vae" / "vae.safetensors")]
+    assert catalog.candidate_paths(pinned) == [str(tmp_path / "elsewhere" / "loras" / "sub" / "style.safetensors")]
+
+
+def test_model_in_extra_directory_counts_as_downloaded(tmp_path):
+    lora = {"repo_id": "org/style", "filename": "style.safetensors", "local_path": "loras/style.safetensors"}
+    catalog = folder_catalog(tmp_path, [lora])
+    assert catalog.resolve_path(lora) == str(tmp_path / "models" / "loras" / "style.safetensors")
+
+    (tmp_path / "extra" / "loras").mkdir(parents=True)
+    (tmp_path / "extra" / "loras" / "style.safetensors").write_bytes(b"x")
+    catalog.refresh_status()
+
+    assert catalog.status()["style.safetensors"]["downloaded"]
+    assert catalog.resolve_path(lora) == str(tmp_path / "extra" / "loras" / "style.safetensors")
+
+
+def write_config(path, entries):
+    # A later mtime than the previous write, however coarse the filesystem's timestamps are
+    mtime = os.stat(path).st_mtime_ns + 10**9 if path.exists() else None
+    path.write_text(json.dumps(entries))
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+
+
+def lora(i):
+    return {"repo_id": "org/loras", "filename": f"lora-{i}.safetensors", "local_path": f"loras/lora-{i}.safetensors"}
+
+
+def test_cursor_pages_through_search_results(tmp_path):
+    path = tmp_path / "model_config.json"
+    write_config(path, [lora(i) for i in range(5)] + [{"repo_id": "org/vae", "filename": "vae.safetensors", "local_path": "vae/vae.safetensors"}])
+    catalog = ModelCatalog(path, str(tmp_path / "models"))
+
+    names, cursor = [], None
+    while True:
+        version, offset = parse_cursor(cursor)
+        entries, total, cursor = catalog.page(version, offset, 2, folder="loras")
+        names += [entry["filename"] for entry in entries]
+        assert total == 5
+        if cursor is None:
+            break
+    assert names == [f"lora-{i}.safetensors" for i in range(5)]
+
+    with pytest.raises(ValueError, match="bad cursor"):
+        parse_cursor("1:x")
+
+
+def test_reload_invalidates_cursors_and_versions(tmp_path):
+    path = tmp_path / "model_config.json"
+    write_config(path, [lora(i) for i in range(3)])
+    catalog = ModelCatalog(path, str(tmp_path / "models"))
+    _, _, cursor = catalog.page(*parse_cursor(None), 2)
+    assert cursor is not None
+    versions = (catalog.version, catalog.status_version)
+
+    # An unchanged config and unchanged files keep every version, and so the /config ETag
+    catalog.refresh_status()
+    assert catalog.page(*parse_cursor(cursor), 2) is not None
+    assert (catalog.version, catalog.status_version) == versions
+
+    (tmp_path / "models" / "loras").mkdir(parents=True)
+    (tmp_path / "models" / "loras" / "lora-0.safetensors").write_bytes(b"x")
+    catalog.refresh_status()
+    assert catalog.status_version == versions[1] + 1
+
+    write_config(path, [lora(i) for i in range(4)])
+    assert catalog.page(*parse_cursor(cursor), 2) is None
+    assert catalog.version == versions[0] + 1
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import os
+import random
+
+import aiohttp
+import pytest
+
+from downloader.chunked import MiB, ChunkedDownloader, RangeDownloadError, split_ranges
+from downloader.integrity import IntegrityError
+from downloader.journal import ChunkJournal
+from rangeserver import RangeServer
+
+# Four ranges with MiB chunks, the last one partial
+DATA = random.Random(3).randbytes(3 * MiB + 12345)
+RANGES = split_ranges(len(DATA), MiB)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def fetch(server_kwargs, dest, url_attr="url", **download_kwargs):
+    """Download DATA from a fresh RangeServer; returns (server, result or exception)"""
+    downloader = ChunkedDownloader(connections=4, chunk_size=MiB, write_block=256 * 1024)
+    async with RangeServer(DATA, **server_kwargs) as server:
+        try:
+            result = await downloader.download(getattr(server, url_attr), str(dest), **download_kwargs)
+        except Exception as e:
+            result = e
+        finally:
+            await downloader.close()
+    return server, result
+
+
+def test_split_ranges():
+    assert split_ranges(10, 4) == [(0, 3), (4, 7), (8, 9)]
+    assert split_ranges(8, 4) == [(0, 3), (4, 7)]
+    assert split_ranges(3, 4) == [(0, 2)]
+    assert split_ranges(0, 4) == []
+
+
+def test_parallel_ranges(tmp_path):
+    dest = tmp_path / "model.safetensors"
+    server, result = run(fetch({}, dest))
+
+    assert result == (len(DATA), hashlib.sha256(DATA).hexdigest())
+    assert dest.read_bytes() == DATA
+    assert sorted(server.range_requests()) == sorted(f"bytes={start}-{end}" for start, end in RANGES)
+    assert not os.path.exists(f"{dest}.part")
+    assert not ChunkJournal.for_part_file(f"{dest}.part").exists()
+
+
+def test_resume_from_journal(tmp_path):
+    dest = tmp_path / "model.safetensors"
+    part_path = f"{dest}.part"
+    done = RANGES[:2]
+    with open(part_path, "wb") as f:
+        f.write(DATA[: done[-1][1] + 1])
+    journal = ChunkJournal.for_part_file(part_path)
+    journal.size, journal.etag, journal.chunk_size = len(DATA), '"v1"', MiB
+    for start, end in done:
+        journal.mark_done(start, end)
+
+    server, result = run(fetch({}, dest))
+
+    assert result == (len(DATA), hashlib.sha256(DATA).hexdigest())
+    assert dest.read_bytes() == DATA
+    assert sorted(server.range_requests()) == sorted(f"bytes={start}-{end}" for start, end in RANGES[2:])
+
+
+def test_journal_for_another_etag_restarts(tmp_path):
+    dest = tmp_path / "model.safetensors"
+    part_path = f"{dest}.part"
+    with open(part_path, "wb") as f:
+        f.write(b"\0" * MiB)
+    journal = ChunkJournal.for_part_file(part_path)
+    journal.size, journal.etag, journal.chunk_size = len(DATA), '"v0"', MiB
+    journal.mark_done(*RANGES[0])
+
+    server, result = run(fetch({}, dest))
+
+    assert dest.read_bytes() == DATA
+    assert len(server.range_requests()) == len(RANGES)
+
+
+def test_redirect_drops_credentials(tmp_path):
+    dest = tmp_path / "model.safetensors"
+    server, result = run(fetch({}, dest, url_attr="redirect_url", headers={"Authorization": "Bearer secret"}))
+
+    assert dest.read_bytes() == DATA
+    redirects = [request for request in server.requests if request["path"] == "/redirect"]
+    assert redirects and redirects[0]["headers"].get("Authorization") == "Bearer secret"
+    ranged = [request for request in server.requests if request["range"]]
+    assert len(ranged) == len(RANGES)
+    assert all(request["headers"]["Host"].startswith("localhost") for request in ranged)
+    assert all("Authorization" not in request["headers"] for request in ranged)
+
+
+def test_single_stream_without_range_support(tmp_path):
+    dest = tmp_path / "model.safetensors"
+    server, result = run(fetch({"ranges": False}, dest))
+
+    assert result == (len(DATA), hashlib.sha256(DATA).hexdigest())
+    assert dest.read_bytes() == DATA
+    gets = [request for request in server.requests if request["method"] == "GET"]
+    assert len(gets) == 1 and gets[0]["range"] is None
+
+
+def test_ignored_range_request_fails(tmp_path):
+    dest = tmp_path / "model.safetensors"
+    server, result = run(fetch({"ignore_ranges": True}, dest))
+
+    assert isinstance(result, RangeDownloadError)
+    assert "ignored range request" in str(result)
+    assert not dest.exists()
+
+
+def test_short_range_fails_then_resumes(tmp_path):
+    dest = tmp_path / "model.safetensors"
+    short = RANGES[1]
+    server, result = run(fetch({"short_ranges": {short[0]}}, dest))
+
+    assert isinstance(result, RangeDownloadError)
+    assert not dest.exists()
+    journal = ChunkJournal.for_part_file(f"{dest}.part")
+    assert journal.load(len(DATA), '"v1"', MiB)
+    assert short not in journal.completed
+
+    # The ranges that completed are kept; the retry fetches only the rest
+    server, result = run(fetch({}, dest))
+    assert dest.read_bytes() == DATA
+    assert f"bytes={short[0]}-{short[1]}" in server.range_requests()
+    assert len(server.range_requests()) == len(RANGES) - len(journal.completed)
+
+
+def test_failed_range_raises(tmp_path):
+    dest = tmp_path / "model.safetensors"
+    server, result = run(fetch({"failed_ranges": {RANGES[2][0]}}, dest))
+
+    assert isinstance(result, aiohttp.ClientResponseError)
+    assert result.status == 500
+    assert not dest.exists()
+    assert os.path.exists(f"{dest}.part")
+
+
+def test_sha256_mismatch_discards_partial_file(tmp_path):
+    dest = tmp_path / "model.safetensors"
+    server, result = run(fetch({}, dest, expected_sha256="0" * 64))
+
+    assert isinstance(result, IntegrityError)
+    assert not dest.exists()
+    assert not os.path.exists(f"{dest}.part")
+    assert not ChunkJournal.for_part_file(f"{dest}.part").exists()
@@ -0,0 +1,72 @@
+import asyncio
+import hashlib
+import os
+import socket
+
+import huggingface_hub.constants
+from aiohttp import web
+
+from benchmarks.fakehub import COMMIT, FakeHub, make_files
+from downloader.fetcher import ModelFetcher
+from downloader.settings import DEFAULT_SETTINGS
+from downloader.snapshot import MANIFEST_NAME, remote_manifest
+
+FILES = make_files(3, 200_000, gated=0)
+
+
+async def serve(hub):
+    runner = web.AppRunner(hub.app, access_log=None)
+    await runner.setup()
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    await web.SockSite(runner, sock).start()
+    return runner, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def with_hub(monkeypatch, test):
+    """Run test(hub) with huggingface_hub pointed at a fake Hub"""
+    hub = FakeHub(FILES)
+
+    async def main():
+        runner, url = await serve(hub)
+        monkeypatch.setattr(huggingface_hub.constants, "ENDPOINT", url)
+        monkeypatch.setattr(huggingface_hub.constants, "HUGGINGFACE_CO_URL_TEMPLATE", url + "/{repo_id}/resolve/{revision}/{filename}")
+        try:
+            return await test(hub)
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_model_info_reads_listings(monkeypatch):
+    async def test(hub):
+        return [await asyncio.to_thread(remote_manifest, "bench/models", revision) for revision in (None, COMMIT)]
+
+    for commit, files in with_hub(monkeypatch, test):
+        assert commit == COMMIT
+        assert sorted(files) == [spec["path"] for spec in FILES]
+        assert all(listed == {"size": 200_000, "etag": FakeHub(FILES).files[("bench/models", path)].sha256} for path, listed in files.items())
+
+
+def test_repository_download(tmp_path, monkeypatch):
+    settings = dict(DEFAULT_SETTINGS, min_free_space_gb=0, retry_attempts=1, blob_store_dir=str(tmp_path / "blobs"))
+    fetcher = ModelFetcher(settings, str(tmp_path / "models"))
+    repo_dir = str(tmp_path / "models" / "diffusers" / "models")
+
+    async def test(hub):
+        try:
+            first = await fetcher.download({"repo_id": "bench/models"}, repo_dir)
+            second = await fetcher.download({"repo_id": "bench/models"}, repo_dir)
+        finally:
+            await fetcher.close()
+        return hub, first, second
+
+    hub, first, second = with_hub(monkeypatch, test)
+
+    assert first.startswith("Successfully downloaded 3 files")
+    assert second.startswith("Repository already up to date")
+    assert sorted(os.listdir(repo_dir)) == sorted([MANIFEST_NAME] + [spec["path"] for spec in FILES])
+    for (_, path), hub_file in hub.files.items():
+        with open(os.path.join(repo_dir, path), "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == hub_file.sha256
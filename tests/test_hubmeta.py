@@ -0,0 +1,77 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+from benchmarks.fakehub import COMMIT, FakeHub, make_files
+from downloader.hubmeta import HubMetadataCache, repo_key
+from downloader.metrics import CACHE_REQUESTS
+from downloader.state import StateFile
+
+FILES = make_files(2, 1000, gated=0)
+ENTRY = {"repo_id": "bench/models", "filename": "file-0000.safetensors"}
+
+
+async def serve(hub, monkeypatch):
+    runner = web.AppRunner(hub.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    monkeypatch.setenv("HF_ENDPOINT", f"http://127.0.0.1:{runner.addresses[0][1]}")
+    return runner
+
+
+def test_listing_is_cached_and_revalidated(tmp_path, monkeypatch):
+    hub = FakeHub(FILES)
+    store = StateFile(tmp_path / "hub_metadata.json")
+
+    async def main():
+        runner = await serve(hub, monkeypatch)
+        try:
+            cache = HubMetadataCache(store)
+            assert await cache.refresh([ENTRY]) == 1
+            # Fresh listings are not fetched again; a forced refresh of an unchanged one is a 304
+            assert await cache.refresh([ENTRY]) == 0
+            hits = CACHE_REQUESTS.value(cache="hub_metadata", result="hit")
+            assert await cache.refresh([ENTRY], force=True) == 0
+            assert CACHE_REQUESTS.value(cache="hub_metadata", result="hit") == hits + 1
+            await store.flush()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(main())
+
+    record = json.loads((tmp_path / "hub_metadata.json").read_text())["repos"][repo_key(ENTRY)]
+    assert record["commit"] == COMMIT
+    assert record["files"]["file-0000.safetensors"] == {
+        "size": 1000,
+        "sha256": hub.files[("bench/models", "file-0000.safetensors")].sha256,
+        "blob_id": hub.files[("bench/models", "file-0000.safetensors")].sha256[:40],
+    }
+
+
+def test_describe_compares_the_file_on_disk(tmp_path):
+    (tmp_path / "hub_metadata.json").write_text(json.dumps({"repos": {repo_key(ENTRY): {
+        "commit": COMMIT,
+        "etag": f'"{COMMIT}"',
+        "fetched_at": time.time(),
+        "files": {"file-0000.safetensors": {"size": 4, "sha256": "a" * 64, "blob_id": "b" * 40}},
+    }}}))
+    cache = HubMetadataCache(StateFile(tmp_path / "hub_metadata.json"))
+    local_path = tmp_path / "file-0000.safetensors"
+
+    assert cache.describe(ENTRY, str(local_path))["update_available"] is None
+    local_path.write_bytes(b"1234")
+    assert cache.describe(ENTRY, str(local_path)) == {
+        "commit": COMMIT,
+        "fetched_at": cache.repos[repo_key(ENTRY)]["fetched_at"],
+        "size": 4,
+        "sha256": "a" * 64,
+        "update_available": False,
+    }
+    local_path.write_bytes(b"12345")
+    assert cache.describe(ENTRY, str(local_path))["update_available"] is True
+    assert cache.describe(dict(ENTRY, filename="gone.safetensors"), str(local_path))["missing"]
+    assert cache.describe({"repo_id": "other/repo", "filename": "x"}, str(local_path)) is None
+    # Nothing is stale, so no background refresh starts
+    assert not cache.refresh_in_background([ENTRY])
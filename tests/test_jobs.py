@@ -0,0 +1,124 @@
+import asyncio
+import json
+import threading
+import time
+
+import downloader.state
+from downloader.fetcher import ModelFetcher
+from downloader.jobs import CANCELLED, CANCELLING, COMPLETED, QUEUED, DownloadJob, DownloadScheduler
+from downloader.settings import DEFAULT_SETTINGS
+
+
+def record_writes(monkeypatch):
+    """Threads that wrote state files, in order"""
+    writers = []
+    real_write = downloader.state.write_text_atomic
+
+    def write(path, text):
+        writers.append(threading.current_thread())
+        real_write(path, text)
+
+    monkeypatch.setattr(downloader.state, "write_text_atomic", write)
+    return writers
+
+
+def test_job_state_is_written_off_the_loop(tmp_path, monkeypatch):
+    writers = record_writes(monkeypatch)
+    state_path = tmp_path / "jobs.json"
+
+    async def runner(job):
+        await asyncio.sleep(0.01)
+        return f"Successfully downloaded {job.model_name}"
+
+    async def main():
+        scheduler = DownloadScheduler(runner, state_path, max_concurrent=4, max_per_host=4, progress_interval=0)
+        jobs = [await scheduler.submit(f"model-{i}", {"repo_id": "org/repo", "filename": f"model-{i}.safetensors"}) for i in range(20)]
+        for job in jobs:
+            await scheduler.wait(job.id)
+        await scheduler.state_file.flush()
+        return scheduler
+
+    asyncio.run(main())
+
+    # 20 submits, 20 starts and 20 finishes collapse into a few writes, none on the loop thread
+    assert 0 < len(writers) < 10
+    assert threading.main_thread() not in writers
+    data = json.loads(state_path.read_text())
+    assert [job["state"] for job in data["jobs"]] == [COMPLETED] * 20
+
+
+def test_unfinished_jobs_are_queued_again_after_restart(tmp_path):
+    state_path = tmp_path / "jobs.json"
+    release = None
+
+    async def runner(job):
+        await release.wait()
+        return "done"
+
+    async def first_run():
+        nonlocal release
+        release = asyncio.Event()
+        scheduler = DownloadScheduler(runner, state_path, max_concurrent=1)
+        for i in range(3):
+            await scheduler.submit(f"model-{i}", {"repo_id": "org/repo", "filename": f"model-{i}.safetensors"})
+        await asyncio.sleep(0.05)
+        await scheduler.state_file.flush()
+        # What a process stopped at this point leaves behind
+        saved = state_path.read_text()
+        release.set()
+        await asyncio.sleep(0.05)
+        await scheduler.state_file.flush()
+        state_path.write_text(saved)
+
+    asyncio.run(first_run())
+
+    scheduler = DownloadScheduler(runner, state_path)
+    assert [job.state for job in scheduler.list_jobs()] == [QUEUED] * 3
+    assert scheduler.queue_depth() == 3
+
+
+def test_cancel_waits_for_blocking_download_thread(tmp_path):
+    fetcher = ModelFetcher(dict(DEFAULT_SETTINGS), str(tmp_path))
+    thread_started = threading.Event()
+    release_thread = threading.Event()
+    thread_returned = []
+
+    def blocking_download(**kwargs):
+        # Stands in for hf_hub_download, which cannot be interrupted
+        thread_started.set()
+        release_thread.wait(5)
+        thread_returned.append(time.monotonic())
+
+    async def runner(job):
+        return await fetcher._run_with_progress(blocking_download, None, str(tmp_path), local_dir=str(tmp_path))
+
+    async def main():
+        entry = {"repo_id": "org/repo", "filename": "model.safetensors"}
+        scheduler = DownloadScheduler(runner, tmp_path / "jobs.json")
+        job = await scheduler.submit("model", entry)
+        await asyncio.to_thread(thread_started.wait, 5)
+
+        assert await scheduler.cancel(job.id)
+        await asyncio.sleep(0.1)
+        assert job.state == CANCELLING
+        assert not job.finished
+        # A new request for the same model gets a new job
+        assert scheduler.find_active(entry) is None
+
+        release_thread.set()
+        await scheduler.wait(job.id)
+        assert job.state == CANCELLED
+        assert thread_returned and job.finished_at >= thread_returned[0] - 1
+
+    asyncio.run(main())
+
+
+def test_cancelling_job_is_cancelled_after_restart(tmp_path):
+    state_path = tmp_path / "jobs.json"
+    job = DownloadJob("model", {"repo_id": "org/repo", "filename": "model.safetensors"})
+    job.state = CANCELLING
+    state_path.write_text(json.dumps({"jobs": [job.to_dict()]}))
+
+    scheduler = DownloadScheduler(None, state_path)
+    assert scheduler.get(job.id).state == CANCELLED
+    assert scheduler.queue_depth() == 0
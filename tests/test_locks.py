@@ -0,0 +1,130 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+from downloader.fetcher import SOURCE_LOCAL, ModelFetcher
+from downloader.locks import FileLock, SingleFlight
+from downloader.settings import DEFAULT_SETTINGS
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Another ComfyUI process: takes the lock, and on a line from stdin writes the file and releases it
+HOLDER = '''
+import asyncio, sys
+from downloader.locks import FileLock
+
+async def main(target):
+    async with FileLock(target):
+        print("locked", flush=True)
+        sys.stdin.readline()
+        with open(target, "wb") as f:
+            f.write(b"weights")
+
+asyncio.run(main(sys.argv[1]))
+'''
+
+
+def test_callers_share_one_transfer():
+    flights = SingleFlight()
+    calls = []
+
+    async def transfer():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        return await asyncio.gather(*(flights.run("key", transfer) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["done"] * 5
+    assert sorted(leader for _, leader in results) == [False] * 4 + [True]
+
+
+def test_cancelled_transfer_is_not_joined():
+    flights = SingleFlight()
+    calls = []
+
+    async def transfer():
+        calls.append(1)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            # Winds down slowly, like a transfer waiting for its download thread
+            await asyncio.sleep(0.1)
+            raise
+        return "done"
+
+    async def quick():
+        calls.append(2)
+        return "fresh"
+
+    async def main():
+        first = asyncio.ensure_future(flights.run("key", transfer))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        # The first transfer is still winding down; this one must not attach to it
+        return await flights.run("key", quick)
+
+    result, leader = asyncio.run(main())
+    assert (result, leader) == ("fresh", True)
+    assert calls == [1, 2]
+
+
+def test_released_lock_leaves_nothing_behind(tmp_path):
+    target = str(tmp_path / "model.safetensors")
+
+    async def main():
+        first = FileLock(target, poll_interval=0.01)
+        second = FileLock(target, poll_interval=0.01)
+        assert not await first.acquire()
+        waiter = asyncio.ensure_future(second.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+
+        # The waiter had opened the file the first holder removes, so it has to open it again
+        first.release()
+        assert await waiter
+        assert os.path.exists(second.path)
+        second.release()
+
+    asyncio.run(main())
+    assert os.listdir(tmp_path) == []
+
+
+def test_download_waits_for_another_process(tmp_path):
+    target = tmp_path / "checkpoints" / "model.safetensors"
+    target.parent.mkdir()
+    fetcher = ModelFetcher(dict(DEFAULT_SETTINGS, min_free_space_gb=0, blob_store=False), str(tmp_path))
+
+    async def download_from_hub(*args, **kwargs):
+        raise AssertionError("the file was already downloaded by the other process")
+
+    fetcher._download_from_hub = download_from_hub
+    holder = subprocess.Popen(
+        [sys.executable, "-c", HOLDER, str(target)], cwd=REPO_ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+
+        async def main():
+            entry = {"repo_id": "org/repo", "filename": "model.safetensors"}
+            transfer = asyncio.ensure_future(fetcher._transfer(entry, str(target), None, len(b"weights"), None, None))
+            await asyncio.sleep(0.3)
+            # Still waiting for the other process
+            assert not transfer.done()
+            holder.stdin.write("go\n")
+            holder.stdin.flush()
+            return await asyncio.wait_for(transfer, 10)
+
+        result = asyncio.run(main())
+    finally:
+        holder.stdin.close()
+        holder.wait(10)
+
+    assert holder.returncode == 0
+    assert result["source"] == SOURCE_LOCAL
+    assert target.read_bytes() == b"weights"
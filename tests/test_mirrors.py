@@ -0,0 +1,40 @@
+import asyncio
+
+from downloader.mirrors import MirrorFetcher, peer_authorized
+
+KEY = "a" * 64
+
+
+def test_blob_token_is_required():
+    assert peer_authorized("Bearer secret", "secret")
+    assert not peer_authorized("Bearer other", "secret")
+    assert not peer_authorized(None, "secret")
+    # Serving without a configured token would authorize everyone
+    assert not peer_authorized("Bearer ", "")
+    assert not peer_authorized("Bearer None", None)
+
+
+class RecordingDownloader:
+    def __init__(self):
+        self.requests = []
+
+    async def download(self, url, dest, headers=None, **kwargs):
+        self.requests.append((url, headers))
+        raise OSError("unreachable")
+
+
+def test_peers_are_sent_their_token(tmp_path):
+    downloader = RecordingDownloader()
+    mirrors = MirrorFetcher(
+        ["http://worker-1:8188", {"type": "peer", "url": "http://worker-2:8188", "token": "own"}, {"type": "http", "url": "http://cache"}],
+        downloader,
+        token="shared",
+    )
+
+    assert asyncio.run(mirrors.fetch(str(tmp_path / "model.safetensors"), KEY, "org/repo", "model.safetensors")) is None
+    assert [headers for _, headers in downloader.requests] == [
+        {"Authorization": "Bearer shared"},
+        {"Authorization": "Bearer own"},
+        None,
+    ]
+    assert downloader.requests[0][0] == f"http://worker-1:8188/hal-fun-downloader/blobs/{KEY}"
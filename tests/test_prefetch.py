@@ -0,0 +1,29 @@
+import json
+
+from downloader.catalog import ModelCatalog
+from downloader.prefetch import match_entries, referenced_models
+
+
+def test_prompt_files_match_entries_in_their_loader_folder(tmp_path):
+    entries = [
+        {"repo_id": "org/a", "filename": "style.safetensors", "local_path": str(tmp_path / "elsewhere" / "style.safetensors")},
+        {"repo_id": "org/b", "filename": "style.safetensors", "local_path": "checkpoints/style.safetensors"},
+        {"repo_id": "org/c", "filename": "style.safetensors", "local_path": "loras/style.safetensors"},
+        {"repo_id": "org/d", "filename": "model.safetensors", "local_path": "loras/sub/detail.safetensors"},
+    ]
+    path = tmp_path / "model_config.json"
+    path.write_text(json.dumps(entries))
+    catalog = ModelCatalog(path, str(tmp_path / "models"))
+    prompt = {
+        "1": {"class_type": "LoraLoader", "inputs": {"lora_name": "style.safetensors", "model": ["2", 0]}},
+        "2": {"class_type": "LoraLoader", "inputs": {"lora_name": "sub\\detail.safetensors", "strength_model": 1.0}},
+        "3": {"class_type": "LoraLoader", "inputs": {"lora_name": "not-in-catalog.safetensors"}},
+    }
+
+    references = referenced_models(prompt)
+    assert references == [
+        ("lora_name", "style.safetensors"),
+        ("lora_name", "sub\\detail.safetensors"),
+        ("lora_name", "not-in-catalog.safetensors"),
+    ]
+    assert [entry["repo_id"] for entry in match_entries(catalog, references)] == ["org/c", "org/d"]
@@ -0,0 +1,133 @@
+import asyncio
+import copy
+import os
+
+import pytest
+
+from downloader.fetcher import SOURCE_HUB
+from downloader.provision import (
+    DOWNLOADED,
+    FAILED,
+    LINKED,
+    MISSING,
+    PRESENT,
+    RUN_FINISHED,
+    RUN_RUNNING,
+    LockfileError,
+    ProvisioningRun,
+    parse_lockfile,
+    plan_provisioning,
+    provision,
+)
+
+COMMIT = "0123456789abcdef0123456789abcdef01234567"
+SHA_A = "a" * 64
+SHA_B = "b" * 64
+
+
+def entry(local_path, sha256=SHA_A, **fields):
+    return {"repo_id": "org/repo", "revision": COMMIT, "filename": "model.safetensors", "sha256": sha256, "local_path": local_path, **fields}
+
+
+def test_lockfile_accepts_pinned_entries():
+    models = [entry("checkpoints/a.safetensors"), {"repo_id": "org/repo", "revision": COMMIT, "local_path": "diffusers/repo"}]
+    assert parse_lockfile({"version": 1, "models": models}) == models
+    assert parse_lockfile(models) == models
+
+
+@pytest.mark.parametrize("data, problem", [
+    ({"version": 2, "models": []}, "Unsupported lock file version"),
+    ({"models": "x"}, "must contain a list"),
+    ([entry("a.safetensors", revision="main")], "is not a full commit hash"),
+    ([entry("a.safetensors", sha256=None)], "missing sha256"),
+    ([entry("a.safetensors", sha256="abc")], "not a sha256 hex digest"),
+    ([entry("../../etc/a.safetensors")], "leaves the models directory"),
+    ([{"revision": COMMIT, "local_path": "a"}], "missing repo_id"),
+    ([entry(None)], "missing local_path"),
+    (["x"], "not an object"),
+])
+def test_lockfile_problems(data, problem):
+    with pytest.raises(LockfileError, match=problem):
+        parse_lockfile(data)
+
+
+def test_unpinned_entries_allowed_when_not_strict():
+    models = [entry("a.safetensors", revision="main", sha256=None)]
+    assert parse_lockfile(models, strict=False) == models
+
+
+def test_plan_groups_duplicates_and_copies(tmp_path):
+    plan = plan_provisioning([
+        entry("checkpoints/a.safetensors"),
+        entry("checkpoints/a.safetensors"),
+        entry("unet/a.safetensors"),
+        entry("vae/b.safetensors", sha256=SHA_B),
+    ], str(tmp_path))
+
+    assert plan["duplicates"] == 1
+    assert [os.path.relpath(group["path"], tmp_path) for group in plan["downloads"]] == [
+        os.path.join("checkpoints", "a.safetensors"),
+        os.path.join("vae", "b.safetensors"),
+    ]
+    assert [os.path.relpath(copy["path"], tmp_path) for copy in plan["downloads"][0]["copies"]] == [os.path.join("unet", "a.safetensors")]
+
+    with pytest.raises(LockfileError, match="different model"):
+        plan_provisioning([entry("a.safetensors"), entry("a.safetensors", sha256=SHA_B)], str(tmp_path))
+
+
+def test_provision_links_copies_and_reports(tmp_path):
+    plan = plan_provisioning([entry("checkpoints/a.safetensors"), entry("unet/a.safetensors")], str(tmp_path))
+
+    async def run(entry, path, details):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"weights")
+        details.update(source=SOURCE_HUB, size=7)
+        return f"Successfully downloaded to {path}"
+
+    report = asyncio.run(provision(plan, run))
+    assert report["ok"]
+    assert [item["status"] for item in report["items"]] == [DOWNLOADED, LINKED]
+    assert (tmp_path / "unet" / "a.safetensors").read_bytes() == b"weights"
+
+
+def test_dry_run_only_looks_at_disk(tmp_path):
+    (tmp_path / "checkpoints").mkdir()
+    (tmp_path / "checkpoints" / "a.safetensors").write_bytes(b"x")
+    plan = plan_provisioning([entry("checkpoints/a.safetensors"), entry("vae/b.safetensors", sha256=SHA_B)], str(tmp_path))
+
+    report = asyncio.run(provision(plan, None, dry_run=True))
+    assert [item["status"] for item in report["items"]] == [PRESENT, MISSING]
+
+
+def test_run_reports_items_before_it_finishes(tmp_path):
+    plan = plan_provisioning([entry("checkpoints/a.safetensors"), entry("vae/b.safetensors", sha256=SHA_B)], str(tmp_path))
+    for i, group in enumerate(plan["downloads"]):
+        group["item"]["job_id"] = f"job-{i}"
+
+    async def main():
+        release = asyncio.Event()
+
+        async def run(entry, path, details):
+            await release.wait()
+            if entry["sha256"] == SHA_B:
+                return "Error downloading b.safetensors: 404"
+            details["source"] = SOURCE_HUB
+            return "Successfully downloaded"
+
+        provisioning = ProvisioningRun(plan).start(run, concurrency=2)
+        await asyncio.sleep(0.01)
+        running = copy.deepcopy(provisioning.to_dict())
+        release.set()
+        await provisioning.wait()
+        return running, provisioning.to_dict()
+
+    running, finished = asyncio.run(main())
+
+    assert running["state"] == RUN_RUNNING
+    assert "report" not in running
+    assert [(item["job_id"], item["status"]) for item in running["items"]] == [("job-0", None), ("job-1", None)]
+
+    assert finished["state"] == RUN_FINISHED
+    assert not finished["report"]["ok"]
+    assert [item["status"] for item in finished["report"]["items"]] == [DOWNLOADED, FAILED]
@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import os
+
+from downloader.integrity import git_blob_sha1
+from downloader.snapshot import MANIFEST_NAME, load_manifest
+
+WEIGHTS = b"weights " * 4096
+CONFIG = b'{"hidden_size": 64}'
+
+
+def listing(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_bytes(CONFIG)
+    return {
+        "model.safetensors": {"size": len(WEIGHTS), "etag": hashlib.sha256(WEIGHTS).hexdigest()},
+        "config.json": {"size": len(CONFIG), "etag": git_blob_sha1(str(config_path))},
+    }
+
+
+def contents(served=None):
+    """What the Hub serves: the real contents, except for paths in served"""
+    return {"model.safetensors": WEIGHTS, "config.json": CONFIG, **(served or {})}
+
+
+def test_snapshot_records_fetched_files(tmp_path, make_fetcher):
+    files = listing(tmp_path)
+    fetcher, downloads = make_fetcher(files, contents())
+    repo_dir = str(tmp_path / "models" / "repo")
+
+    status = asyncio.run(fetcher.download({"repo_id": "org/repo"}, repo_dir))
+    assert status.startswith("Successfully downloaded 2 files")
+    assert load_manifest(repo_dir)["files"] == files
+
+    status = asyncio.run(fetcher.download({"repo_id": "org/repo"}, repo_dir))
+    assert status.startswith("Repository already up to date")
+    assert sorted(downloads) == ["config.json", "model.safetensors"]
+
+
+def test_bad_file_is_not_recorded(tmp_path, make_fetcher):
+    files = listing(tmp_path)
+    # Right size, wrong bytes: only the etag shows it
+    fetcher, downloads = make_fetcher(files, contents({"config.json": CONFIG.upper()}))
+    repo_dir = str(tmp_path / "models" / "repo")
+
+    status = asyncio.run(fetcher.download({"repo_id": "org/repo"}, repo_dir))
+
+    assert status.startswith("Error downloading 1 of 2 files")
+    assert list(load_manifest(repo_dir)["files"]) == ["model.safetensors"]
+    assert not os.path.exists(os.path.join(repo_dir, "config.json"))
+
+
+def test_damaged_file_is_fetched_again(tmp_path, make_fetcher):
+    files = listing(tmp_path)
+    fetcher, downloads = make_fetcher(files, contents())
+    repo_dir = str(tmp_path / "models" / "repo")
+    asyncio.run(fetcher.download({"repo_id": "org/repo"}, repo_dir))
+
+    # Truncating the model file truncates the blob it is linked to as well
+    weights_path = os.path.join(repo_dir, "model.safetensors")
+    with open(weights_path, "r+b") as f:
+        f.truncate(10)
+    status = asyncio.run(fetcher.download({"repo_id": "org/repo"}, repo_dir))
+
+    assert status.startswith("Successfully downloaded 1 files")
+    assert downloads.count("model.safetensors") == 2
+    with open(weights_path, "rb") as f:
+        assert f.read() == WEIGHTS
+    assert os.path.exists(os.path.join(repo_dir, MANIFEST_NAME))
@@ -0,0 +1,41 @@
+import asyncio
+import os
+
+import huggingface_hub
+
+from downloader.fetcher import ModelFetcher
+from downloader.settings import DEFAULT_SETTINGS
+
+
+def fake_hf_hub_download(calls):
+    """Writes the file and the lock and metadata files hf_hub_download keeps under local_dir"""
+
+    def download(repo_id, filename, subfolder=None, revision=None, local_dir=None, token=None, **kwargs):
+        calls.append(local_dir)
+        path = os.path.join(local_dir, subfolder or "", filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"weights")
+        metadata_dir = os.path.join(local_dir, ".cache", "huggingface", "download", subfolder or "")
+        os.makedirs(metadata_dir, exist_ok=True)
+        for suffix in (".lock", ".metadata"):
+            open(os.path.join(metadata_dir, filename + suffix), "w").close()
+        return path
+
+    return download
+
+
+def test_hub_engine_leaves_only_the_model(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(huggingface_hub, "hf_hub_download", fake_hf_hub_download(calls))
+    settings = dict(DEFAULT_SETTINGS, min_free_space_gb=0, retry_attempts=1, blob_store=False, download_engine="hub")
+    fetcher = ModelFetcher(settings, str(tmp_path))
+    entry = {"repo_id": "org/repo", "subfolder": "unet", "filename": "model.safetensors", "local_path": "loras/style.safetensors"}
+    local_path = str(tmp_path / "loras" / "style.safetensors")
+    os.makedirs(os.path.dirname(local_path))
+
+    asyncio.run(fetcher._transfer(entry, local_path, None, None, None, None))
+
+    assert calls and os.path.dirname(calls[0]) != os.path.dirname(local_path)
+    assert os.listdir(tmp_path / "loras") == ["style.safetensors"]
+    assert (tmp_path / "loras" / "style.safetensors").read_bytes() == b"weights"
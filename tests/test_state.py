@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import stat
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import downloader.fsutil
+import downloader.state
+from downloader.fsutil import write_json_atomic, write_text_atomic
+from downloader.state import StateFile, flush_all, get_state_file
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def mode_of(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_new_file_gets_umask_mode(tmp_path):
+    path = tmp_path / "settings.json"
+    write_json_atomic(path, {"a": 1})
+    umask = os.umask(0)
+    os.umask(umask)
+    assert mode_of(path) == 0o666 & ~umask
+
+
+def test_existing_mode_is_kept(tmp_path):
+    path = tmp_path / "settings.json"
+    path.write_text("{}")
+    os.chmod(path, 0o640)
+    write_json_atomic(path, {"a": 1})
+    assert mode_of(path) == 0o640
+    assert json.loads(path.read_text()) == {"a": 1}
+
+
+def test_explicit_mode(tmp_path):
+    path = tmp_path / "token"
+    write_text_atomic(path, "secret", mode=0o600)
+    assert mode_of(path) == 0o600
+
+
+def test_failed_replace_keeps_old_file(tmp_path, monkeypatch):
+    path = tmp_path / "active_config.json"
+    write_json_atomic(path, {"enabled_models": ["old"]})
+
+    def fail(src, dst):
+        raise OSError("disk went away")
+
+    monkeypatch.setattr(downloader.fsutil.os, "replace", fail)
+    with pytest.raises(OSError):
+        write_json_atomic(path, {"enabled_models": ["new"]})
+
+    assert json.loads(path.read_text()) == {"enabled_models": ["old"]}
+    assert os.listdir(tmp_path) == ["active_config.json"]
+
+
+def test_crash_before_replace_keeps_old_file(tmp_path):
+    path = tmp_path / "active_config.json"
+    write_json_atomic(path, {"enabled_models": ["old"]})
+    # The process dies after the temp file is written and synced, before the rename
+    script = (
+        "import os, sys\n"
+        "import downloader.fsutil as fsutil\n"
+        "fsutil.os.replace = lambda src, dst: os._exit(3)\n"
+        "fsutil.write_json_atomic(sys.argv[1], {'enabled_models': ['new'] * 1000})\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script, str(path)], cwd=REPO_ROOT)
+
+    assert result.returncode == 3
+    assert json.loads(path.read_text()) == {"enabled_models": ["old"]}
+
+
+def test_concurrent_saves_leave_valid_json(tmp_path):
+    store = StateFile(tmp_path / "active_config.json", delay=0.01)
+
+    async def update(i):
+        # Like POST /active: replace the whole config, then return
+        store.save({"enabled_models": [f"model-{i}-{n}.safetensors" for n in range(200)], "version": i})
+        await asyncio.sleep(0.001 * (i % 7))
+
+    async def main():
+        for burst in range(5):
+            await asyncio.gather(*(update(burst * 50 + i) for i in range(50)))
+            await asyncio.sleep(0.02)
+        await store.flush()
+
+    asyncio.run(main())
+    data = json.loads((tmp_path / "active_config.json").read_text())
+    assert data["version"] == 249
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+
+def test_saves_from_threads_leave_valid_json(tmp_path):
+    store = StateFile(tmp_path / "active_config.json")
+    errors = []
+
+    def writer(i):
+        try:
+            for n in range(20):
+                store.save({"enabled_models": [f"model-{i}-{n}"] * 100})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    data = json.loads((tmp_path / "active_config.json").read_text())
+    assert len(data["enabled_models"]) == 100
+
+
+def test_burst_of_saves_is_one_write(tmp_path, monkeypatch):
+    writes = []
+    real_write = downloader.state.write_text_atomic
+    monkeypatch.setattr(downloader.state, "write_text_atomic", lambda path, text: (writes.append(text), real_write(path, text)))
+    store = StateFile(tmp_path / "license_states.json", delay=0.05)
+
+    async def main():
+        for i in range(100):
+            store.save({"i": i})
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+    assert len(writes) == 1
+    assert json.loads(writes[0]) == {"i": 99}
+
+
+def test_one_state_file_per_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = get_state_file(tmp_path / "settings.json")
+    assert get_state_file("settings.json") is store
+    assert get_state_file(str(tmp_path / "settings.json")) is store
+    assert get_state_file(tmp_path / "other.json") is not store
+
+
+def test_pending_data_is_loaded_and_flushed_at_exit(tmp_path):
+    path = tmp_path / "active_config.json"
+
+    async def main():
+        # A second node instance must see what the first saved, before the write lands
+        get_state_file(path, delay=60).save({"enabled_models": ["new"]})
+        assert get_state_file(path).load() == {"enabled_models": ["new"]}
+        assert not path.exists()
+        flush_all()
+
+    asyncio.run(main())
+    assert json.loads(path.read_text()) == {"enabled_models": ["new"]}
@@ -0,0 +1,112 @@
+import json
+import math
+import os
+import struct
+
+import pytest
+
+from downloader.state import StateFile
+from downloader.tensorindex import TensorIndex, detect_architecture, read_header, summarize
+
+DTYPE_SIZES = {"F32": 4, "F16": 2, "BF16": 2}
+
+
+def write_safetensors(path, tensors, metadata=None, data=True):
+    """A safetensors file with zeroed tensors of {name: (dtype, shape)}; data=False leaves the data out"""
+    header, offset = {}, 0
+    for name, (dtype, shape) in tensors.items():
+        nbytes = math.prod(shape) * DTYPE_SIZES[dtype]
+        header[name] = {"dtype": dtype, "shape": shape, "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+    if metadata:
+        header["__metadata__"] = metadata
+    encoded = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(encoded)) + encoded)
+        if data:
+            f.write(bytes(offset))
+
+
+def shapes(tensors):
+    """read_header's (dtype, shape, nbytes) for {name: (dtype, shape)}"""
+    return {name: (dtype, shape, math.prod(shape) * DTYPE_SIZES[dtype]) for name, (dtype, shape) in tensors.items()}
+
+
+SD15_LORA = {
+    "lora_unet_down_blocks_0_attentions_0_transformer_blocks_0_attn2_to_k.lora_down.weight": ("F16", [4, 768]),
+    "lora_unet_down_blocks_0_attentions_0_transformer_blocks_0_attn2_to_k.lora_up.weight": ("F16", [320, 4]),
+}
+
+
+def test_read_header(tmp_path):
+    path = tmp_path / "lora.safetensors"
+    write_safetensors(path, SD15_LORA, {"modelspec.architecture": "stable-diffusion-v1/lora"})
+
+    tensors, metadata = read_header(path)
+
+    assert tensors == shapes(SD15_LORA)
+    assert metadata == {"modelspec.architecture": "stable-diffusion-v1/lora"}
+
+
+@pytest.mark.parametrize("content, problem", [
+    (b"\x01\x00", "too short"),
+    (struct.pack("<Q", 1000) + b"{}", "does not fit"),
+    (struct.pack("<Q", 2) + b"[]", "not a JSON object"),
+    (struct.pack("<Q", 23) + b'{"a": {"dtype": "F16"}}', "bad entry"),
+])
+def test_invalid_headers(tmp_path, content, problem):
+    path = tmp_path / "bad.safetensors"
+    path.write_bytes(content)
+    with pytest.raises(ValueError, match=problem):
+        read_header(path)
+
+
+@pytest.mark.parametrize("tensors, expected", [
+    (SD15_LORA, ("lora", "sd1")),
+    ({
+        "model.diffusion_model.input_blocks.4.1.transformer_blocks.0.attn2.to_k.weight": ("F16", [640, 2048]),
+        "conditioner.embedders.0.transformer.text_model.encoder.layers.0.mlp.fc1.weight": ("F16", [3072, 768]),
+        "first_stage_model.decoder.conv_in.weight": ("F32", [512, 4, 3, 3]),
+    }, ("checkpoint", "sdxl")),
+    ({"double_blocks.0.img_attn.qkv.weight": ("BF16", [9216, 3072])}, ("diffusion_model", "flux")),
+    ({"joint_blocks.0.x_block.attn.qkv.weight": ("F16", [4608, 1536])}, ("diffusion_model", "sd3")),
+    ({
+        "encoder.down.0.block.0.conv1.weight": ("F32", [128, 128, 3, 3]),
+        "decoder.up.0.block.0.conv1.weight": ("F32", [128, 128, 3, 3]),
+    }, ("vae", None)),
+    ({"text_model.encoder.layers.0.mlp.fc1.weight": ("F16", [3072, 768])}, ("text_encoder", None)),
+    ({"weight": ("F32", [10])}, (None, None)),
+])
+def test_detect_architecture(tensors, expected):
+    assert detect_architecture(shapes(tensors)) == expected
+
+
+def test_summary_counts_parameters_and_main_dtype():
+    record = summarize(shapes({"a": ("F16", [100, 10]), "b": ("F32", [10])}), {})
+    assert record["parameters"] == 1010
+    assert record["dtypes"] == {"F16": 2000, "F32": 40}
+    assert record["dtype"] == "F16"
+    assert record["parameter_bytes"] == 2040
+
+
+def test_index_reads_a_file_again_only_when_it_changes(tmp_path):
+    path = tmp_path / "lora.safetensors"
+    # Only the header is read, so the missing tensor data does not matter
+    write_safetensors(path, SD15_LORA, data=False)
+    index = TensorIndex(StateFile(tmp_path / "tensor_index.json"), tmp_path / "tensors")
+
+    record = index.index_file(path, model="lora.safetensors")
+    assert (record["kind"], record["architecture"], record["tensors"]) == ("lora", "sd1", 2)
+    version = index.version
+    assert index.index_file(path) == record
+    assert index.version == version
+
+    rows = index.tensors(path)["tensors"]
+    assert [name for name, _, _ in rows] == list(SD15_LORA)
+    assert [item["path"] for item in index.query(kind="lora", architecture="sd1")] == [os.path.abspath(path)]
+
+    write_safetensors(path, {"text_model.encoder.layers.0.mlp.fc1.weight": ("F16", [3072, 768])}, data=False)
+    os.utime(path, ns=(0, 0))
+    assert index.index_file(path)["kind"] == "text_encoder"
+    assert index.query(kind="lora") == []
+    assert index.index_file(tmp_path / "missing.safetensors") is None